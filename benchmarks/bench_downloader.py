@@ -0,0 +1,127 @@
+"""
+Benchmarks of the downloader against the local mock cdn.
+
+Usage: python -m benchmarks.bench_downloader [--assets 2000] [--latency 0.01] [--bandwidth 10e6] ...
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Any
+from typing import Callable
+
+from moc_utils import asset_api
+from moc_utils.__main__ import Downloader
+from moc_utils.__main__ import Mirror
+from moc_utils.asset_api import AssetAPIHandler
+from moc_utils.metrics import format_size
+
+from .mock_cdn import MockCDN
+from .mock_cdn import MockCDNConfig
+
+
+def measure(name: str, func: Callable[[], Any], cdn: MockCDN) -> dict[str, Any]:
+    sent = cdn.bytes_sent
+    requests = cdn.requests
+    tracemalloc.start()
+    start = time.perf_counter()
+    failed = False
+    try:
+        func()
+    except SystemExit as e:
+        # the downloader exits with 1 if any file failed
+        failed = e.code not in (None, 0)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    transferred = cdn.bytes_sent - sent
+    result = {
+        "name": name,
+        "seconds": elapsed,
+        "bytes": transferred,
+        "bytes_per_second": transferred / elapsed if elapsed else 0.0,
+        "requests": cdn.requests - requests,
+        "peak_python_memory": peak,
+        "failed": failed,
+    }
+    print(
+        f"{name:<24} {elapsed:8.3f}s {format_size(transferred):>12} {format_size(result['bytes_per_second']):>12}/s"
+        f" {result['requests']:>7} requests, peak memory {format_size(peak)}{' (failed)' if failed else ''}"
+    )
+    return result
+
+
+def bench_fetch(repeat: int) -> None:
+    for _ in range(repeat):
+        AssetAPIHandler.fetch("us-prod", cache_ttl=0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--assets", type=int, default=2000, help="number of assets served by the mock cdn")
+    parser.add_argument("--gamefiles", type=int, default=20, help="number of game files served by the mock cdn")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds each response is delayed")
+    parser.add_argument("--bandwidth", type=float, default=None, help="bytes per second per connection")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--workers", type=int, default=None, help="number of parallel downloads")
+    parser.add_argument("--fetch-repeat", type=int, default=50, help="number of version requests")
+    parser.add_argument("--json", type=str, default=None, help="path to write the results to")
+    args = parser.parse_args()
+
+    # measure the actual work, not the on-disk caches
+    os.environ["MOC_UTILS_NO_CACHE"] = "1"
+
+    config = MockCDNConfig(
+        assets=args.assets,
+        gamefiles=args.gamefiles,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+    )
+    results: list[dict[str, Any]] = []
+    with MockCDN(config) as cdn, tempfile.TemporaryDirectory() as tmp:
+        asset_api.VERSION_URL = cdn.version_url
+        print(f"mock cdn at {cdn.url}")
+
+        results.append(measure("AssetAPIHandler.fetch", lambda: bench_fetch(args.fetch_repeat), cdn))
+
+        assets_dst = os.path.join(tmp, "assets")
+        results.append(
+            measure("Downloader.assets", lambda: Downloader(assets_dst, "us-prod", workers=args.workers).assets(), cdn)
+        )
+        results.append(
+            measure(
+                "Downloader.assets (noop)",
+                lambda: Downloader(assets_dst, "us-prod", workers=args.workers).assets(),
+                cdn,
+            )
+        )
+
+        game_dst = os.path.join(tmp, "game")
+        results.append(
+            measure("Downloader.game", lambda: Downloader(game_dst, "us-prod", workers=args.workers).game(), cdn)
+        )
+        results.append(
+            measure("Downloader.game (noop)", lambda: Downloader(game_dst, "us-prod", workers=args.workers).game(), cdn)
+        )
+
+        mirror_dst = os.path.join(tmp, "mirror")
+        results.append(
+            measure(
+                "Mirror.assets (4 cdns)",
+                lambda: Mirror(mirror_dst, "us-prod,tw-prod,jp-prod,cn-prod", workers=args.workers).assets(),
+                cdn,
+            )
+        )
+
+    if args.json:
+        with open(args.json, "wt", encoding="utf8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
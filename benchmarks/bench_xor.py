@@ -0,0 +1,64 @@
+"""
+Benchmarks of the TextAsset XOR against the former per-byte implementation.
+
+Usage: python -m benchmarks.bench_xor [--sizes 1024 65536 1048576 8388608] [--repeat 5]
+"""
+
+import argparse
+import json
+import os
+import time
+from itertools import cycle
+from typing import Any
+from typing import Callable
+
+from moc_utils.export.lua.dump import decrypt_textasset_data
+from moc_utils.export.lua.dump import encrypt_textasset_data
+from moc_utils.export.lua.dump import xor_textasset_data
+from moc_utils.metrics import format_size
+
+
+def decrypt_textasset_data_per_byte(enc: bytes) -> bytearray:
+    # the former implementation, kept as reference
+    dec_k = bytearray([23, 241, 195, 85, 120, 100, 57, 64, 66, 119, 89, 18, 51, 203, 123, 185, 53])
+    return bytearray([enc[0] ^ 53, *[e ^ k for e, k in zip(enc[1:], cycle(dec_k))]])
+
+
+def best_of(func: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1 << 10, 1 << 16, 1 << 20, 8 << 20])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per size, the best one is reported")
+    parser.add_argument("--json", type=str, default=None, help="path to write the results to")
+    args = parser.parse_args()
+
+    results: list[dict[str, Any]] = []
+    for size in args.sizes:
+        enc = os.urandom(size)
+        dec = decrypt_textasset_data(memoryview(enc))
+        assert dec == decrypt_textasset_data_per_byte(enc), "implementations differ"
+        assert encrypt_textasset_data(dec) == enc, "encryption doesn't round trip"
+
+        per_byte = best_of(lambda: decrypt_textasset_data_per_byte(enc), args.repeat)
+        bulk = best_of(lambda: xor_textasset_data(memoryview(enc)), args.repeat)
+        results.append({"size": size, "per_byte_seconds": per_byte, "bulk_seconds": bulk})
+        print(
+            f"{format_size(size):>10}: per byte {per_byte * 1000:9.3f} ms, bulk {bulk * 1000:7.3f} ms,"
+            f" {per_byte / bulk:7.1f}x faster, {format_size(size / bulk):>10}/s"
+        )
+
+    if args.json:
+        with open(args.json, "wt", encoding="utf8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""A local stand-in for the version endpoint and the cdn of the game."""
+
+import hashlib
+import json
+import random
+import re
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Optional
+
+
+@dataclass
+class MockCDNConfig:
+    """
+    Content and behaviour of the mock cdn.
+
+    Parameters
+    ---
+    assets: int
+        number of {name}_{md5}.unity3d assets listed in the asset_md5 manifest.
+    asset_size: tuple[int, int]
+        min. and max. size of the assets in bytes.
+    gamefiles: int
+        number of files listed in the GameFileInfo.
+    gamefile_size: tuple[int, int]
+        min. and max. size of the game files in bytes.
+    latency: float
+        seconds each response is delayed before the headers are sent.
+    bandwidth: Optional[float]
+        bytes per second per connection, None for unlimited.
+    error_rate: float
+        share of the requests answered with 503.
+    seed: int
+        seed of the generated content.
+    """
+
+    assets: int = 2000
+    asset_size: tuple[int, int] = (1 << 10, 256 << 10)
+    gamefiles: int = 20
+    gamefile_size: tuple[int, int] = (1 << 20, 16 << 20)
+    latency: float = 0.0
+    bandwidth: Optional[float] = None
+    error_rate: float = 0.0
+    seed: int = 0
+
+
+def synthetic_content(name: str, size: int) -> bytes:
+    # cheap deterministic content, repeating the digest of the name
+    block = hashlib.sha256(name.encode("utf8")).digest() * 2048
+    return (block * (size // len(block) + 1))[:size]
+
+
+def build_text_asset_file(assets: list[tuple[str, bytes]], unity_version: str = "2021.3.21f1") -> bytes:
+    """
+    Builds a minimal serialized file (format version 17) holding TextAssets, readable by UnityPy.
+
+    Args:
+        assets (list[tuple[str, bytes]]): name and script of the TextAssets.
+        unity_version (str): The unity version stored in the file.
+
+    Returns:
+        bytes: The serialized file.
+    """
+
+    def aligned_string(data: bytes) -> bytes:
+        out = struct.pack("<i", len(data)) + data
+        return out + b"\x00" * (-len(out) % 4)
+
+    objects = [aligned_string(name.encode("utf8")) + aligned_string(script) for name, script in assets]
+
+    header_size = 20
+    meta = bytearray(unity_version.encode("utf8") + b"\x00")
+    # target platform (StandaloneWindows64), no type tree, one type
+    meta += struct.pack("<i?i", 19, False, 1)
+    # TextAsset, not stripped, no script, empty type hash
+    meta += struct.pack("<i?h", 49, False, -1) + b"\x00" * 16
+    meta += struct.pack("<i", len(objects))
+    meta += b"\x00" * (-(header_size + len(meta)) % 4)
+    data = bytearray()
+    for path_id, obj in enumerate(objects, 1):
+        data += b"\x00" * (-len(data) % 8)
+        meta += struct.pack("<qIIi", path_id, len(data), len(obj), 0)
+        data += obj
+    # no scripts, no externals, empty user information
+    meta += struct.pack("<ii", 0, 0) + b"\x00"
+
+    data_offset = header_size + len(meta)
+    data_offset += -data_offset % 16
+    header = struct.pack(">IIII", len(meta), data_offset + len(data), 17, data_offset) + b"\x00" * 4
+    out = header + meta
+    return bytes(out + b"\x00" * (data_offset - len(out)) + data)
+
+
+class MockCDN:
+    """
+    Serves a synthetic version endpoint, GameFileInfo, asset_md5 manifest, game files and assets.
+
+    The version endpoint is available at {url}/version/{channel}/{version},
+    point moc_utils.asset_api.VERSION_URL to version_url to use it.
+    Range requests are supported, so resumed downloads can be tested as well.
+    """
+
+    config: MockCDNConfig
+    files: dict[str, tuple[str, int]]  # path -> (content key, size)
+    manifest: dict[str, dict[str, str | int]]
+    gamefileinfo: dict[str, object]
+    requests: int
+    bytes_sent: int
+    _server: Optional[ThreadingHTTPServer]
+    _thread: Optional[threading.Thread]
+    _lock: threading.Lock
+    _static: dict[str, bytes]
+
+    def __init__(self, config: Optional[MockCDNConfig] = None) -> None:
+        self.config = config if config is not None else MockCDNConfig()
+        self.files = {}
+        self._static = {}
+        self.requests = 0
+        self.bytes_sent = 0
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._generate()
+
+    def _generate(self) -> None:
+        rng = random.Random(self.config.seed)
+
+        self.manifest = {}
+        for i in range(self.config.assets):
+            key = f"bench/dir{i % 50}/asset_{i}"
+            size = rng.randint(*self.config.asset_size)
+            md5 = hashlib.md5(f"{key}{size}".encode("utf8")).hexdigest()[:16]
+            self.manifest[key] = {"md5": md5, "size": size}
+            self.files[f"WebAssets/{key}_{md5}.unity3d"] = (key, size)
+
+        file_infos: list[dict[str, object]] = []
+        for i in range(self.config.gamefiles):
+            name = f"SoC_Data/file_{i}.dat"
+            size = rng.randint(*self.config.gamefile_size)
+            md5 = hashlib.md5(synthetic_content(name, size)).hexdigest()
+            file_infos.append({"FileName": name, "FileSize": size, "Md5Hash": md5})
+            self.files[f"pc/SoC_Data/file_{i}_{md5}.dat"] = (name, size)
+        self.gamefileinfo = {"FileInfos": file_infos, "TotalFileSize": sum(f["FileSize"] for f in file_infos)}  # type: ignore
+
+        manifest_raw = build_text_asset_file([("asset_md5", json.dumps(self.manifest).encode("utf8"))])
+        self.pc_md5 = hashlib.md5(manifest_raw).hexdigest()[:16]
+        self.win_md5 = hashlib.md5(json.dumps(self.gamefileinfo).encode("utf8")).hexdigest()[:16]
+        self._static[f"WebAssets/asset_md5_{self.pc_md5}.unity3d"] = manifest_raw
+        self._static[f"pc/GameFileInfo_{self.win_md5}.json"] = json.dumps(self.gamefileinfo).encode("utf8")
+
+    @property
+    def url(self) -> str:
+        assert self._server is not None, "server isn't running"
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def version_url(self) -> str:
+        return f"{self.url}/version/{{channel}}/{{version}}"
+
+    def version_response(self, channel: str) -> dict[str, object]:
+        return {
+            "url_asset": f"{self.url}/cdn/",
+            "pc_md5": self.pc_md5,
+            "win_md5": self.win_md5,
+            "launcher_md5": "",
+            "use_hash": True,
+            "channel": channel,
+            "version": "0",
+        }
+
+    def content(self, path: str) -> Optional[tuple[str, int]]:
+        return self.files.get(path)
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> "MockCDN":
+        cdn = self
+
+        class Handler(MockCDNRequestHandler):
+            mock = cdn
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "MockCDN":
+        return self.start()
+
+    def __exit__(self, *_args: object) -> None:
+        self.stop()
+
+
+class MockCDNRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, which would otherwise trigger delayed acks
+    disable_nagle_algorithm = True
+    mock: MockCDN
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:  # noqa: N802
+        mock = self.mock
+        config = mock.config
+        with mock._lock:
+            mock.requests += 1
+        if config.latency:
+            time.sleep(config.latency)
+        if config.error_rate and random.random() < config.error_rate:
+            self._send(503, b"injected error")
+            return
+
+        path = self.path.split("?", 1)[0]
+        match = re.fullmatch(r"/version/([^/]+)/([^/]+)", path)
+        if match:
+            self._send(200, json.dumps(mock.version_response(match.group(1))).encode("utf8"))
+            return
+
+        if not path.startswith("/cdn/"):
+            self._send(404, b"not found")
+            return
+        path = path[5:]
+
+        static = mock._static.get(path)
+        if static is not None:
+            self._send(200, static)
+            return
+        content = mock.content(path)
+        if content is None:
+            self._send(404, b"not found")
+            return
+        key, size = content
+        data = synthetic_content(key, size)
+
+        start = 0
+        rng = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if rng:
+            start = int(rng.group(1))
+            if start >= size:
+                self._send(416, b"")
+                return
+            self._send(206, data[start:], {"Content-Range": f"bytes {start}-{size - 1}/{size}"})
+        else:
+            self._send(200, data)
+
+    def _send(self, status: int, body: bytes, headers: Optional[dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+
+        bandwidth = self.mock.config.bandwidth
+        chunk_size = 64 << 10
+        try:
+            for i in range(0, len(body), chunk_size):
+                chunk = body[i : i + chunk_size]
+                self.wfile.write(chunk)
+                if bandwidth:
+                    time.sleep(len(chunk) / bandwidth)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        with self.mock._lock:
+            self.mock.bytes_sent += len(body)
@@ -1,19 +1,36 @@
-import concurrent
+import concurrent.futures
 import json
 import os
-from typing import Any
-from typing import Callable
+from contextlib import ExitStack
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import ContextManager
+from typing import Iterator
 from typing import Optional
 from typing import cast
 
 import fire
 
+from moc_utils import engine
+from moc_utils import limiter
+from moc_utils import net
+from moc_utils import transfer
 from moc_utils.asset_api import AssetAPIHandler
-from moc_utils.asset_api import AssetMd5Utils
+from moc_utils.asset_api import AssetMd5
+from moc_utils.asset_api import FileInfo
+from moc_utils.blob_store import BlobStore
+from moc_utils.blob_store import link_file
 from moc_utils.export.lua.dump import dump_database_from_game
 from moc_utils.export.lua.dump import dump_database_from_server
+from moc_utils.hash_file import AssetHashIndex
+from moc_utils.hash_file import AssetHashJournal
+from moc_utils.metrics import METRICS
+from moc_utils.metrics import ProgressBar
+from moc_utils.metrics import TransferMetrics
+from moc_utils.metrics import format_size
 from moc_utils.news import LANGUAGE as NEWS_LANGUAGE
 from moc_utils.news import TapSDKBillboard
+from moc_utils.verify import verify_files
 
 
 class Downloader(object):
@@ -30,86 +47,427 @@ class Downloader(object):
         channel to use.
     loc: Optional[str]
         localisation to use (None (default), en, ja, ko, zh-cn, zh-tw).
+    workers: Optional[int]
+        number of parallel downloads, also used as connection pool size.
+    retries: Optional[int]
+        max. number of retries for failed requests (5 (default)).
+    timeout: Optional[float]
+        read timeout in seconds per request (60 (default)).
+    blob_store: Optional[str]
+        directory of a content-addressed asset store shared between regions/channels.
+    blob_store_max_gb: Optional[float]
+        size the blob store gets trimmed to after a sync, least recently used assets are removed first.
+    adaptive: bool
+        adapt the number of concurrent transfers to the cdn, between min_workers and workers.
+    min_workers: int
+        min. number of concurrent transfers when adaptive is set (1 (default)).
+    progress: bool
+        render a live progress bar instead of a line per file.
+    metrics_json: Optional[str]
+        path to write a json report of the transfer metrics to at exit.
     """
 
     dst: str
     cdn: str
     channel: str
     loc: Optional[str]
+    workers: int
+    store: Optional[BlobStore]
+    progress: bool
+    metrics_json: Optional[str]
     handler: AssetAPIHandler
 
-    def __init__(self, dst: str, cdn: str, channel: Optional[str] = None, loc: Optional[str] = None) -> None:
+    def __init__(
+        self,
+        dst: str,
+        cdn: str,
+        channel: Optional[str] = None,
+        loc: Optional[str] = None,
+        workers: Optional[int] = None,
+        retries: Optional[int] = None,
+        timeout: Optional[float] = None,
+        blob_store: Optional[str] = None,
+        blob_store_max_gb: Optional[float] = None,
+        adaptive: bool = False,
+        min_workers: int = 1,
+        progress: bool = False,
+        metrics_json: Optional[str] = None,
+    ) -> None:
         self.dst = dst
         self.cdn = cdn
         self.channel = channel if channel is not None else self.cdn
         self.loc = loc
+        self.workers, self.store = configure_transfers(
+            workers, retries, timeout, blob_store, blob_store_max_gb, adaptive, min_workers
+        )
+        self.progress = progress
+        self.metrics_json = metrics_json
         self.handler = AssetAPIHandler.fetch(self.cdn, self.channel)  # type: ignore
 
+    def instrument(self, expected_bytes: int) -> ContextManager[TransferMetrics]:
+        return instrument(expected_bytes, self.progress, self.metrics_json)
+
+    def log(self, msg: str) -> None:
+        # per file messages, replaced by the progress bar if it's enabled
+        if not self.progress:
+            print(msg)
+
     def launcher(self) -> None:
         """Downloads the launcher for the game."""
         os.makedirs(self.dst, exist_ok=True)
         fp = os.path.join(self.dst, f"SoCLauncher_PC_{self.channel}.exe")
-        with open(fp, "wb") as f:
-            f.write(self.handler.get_launcher_pc())
+        with self.instrument(0):
+            self.handler.download_launcher_pc(fp)
 
-    def game(self) -> None:
-        """Downloads the game files for running the game."""
+    def game(self, force: bool = False) -> None:
+        """Downloads the game files for running the game, skipping files that are already up to date."""
         file_infos = self.handler.get_gamefileinfo_win()
 
-        thread_pool = concurrent.futures.ThreadPoolExecutor()  # type: ignore
-        threads = []
-
-        for file_info in file_infos["FileInfos"]:
-            print(f"Starting download of {file_info['FileName']}...")
-            fp = os.path.join(self.dst, file_info["FileName"])
-            threads.append(thread_pool.submit(download_n_store, self.handler.get_gamefile_pc, [file_info], fp))  # type: ignore
-
-        concurrent.futures.wait(threads)  # type: ignore
-        print("Download complete.")
-
-    def assets(self) -> None:
+        outdated = file_infos["FileInfos"]
+        up_to_date: list[FileInfo] = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as thread_pool:
+            if not force:
+                # hashlib releases the gil, so the local files can be hashed in parallel
+                checks = list(
+                    thread_pool.map(
+                        lambda file_info: transfer.is_up_to_date(
+                            os.path.join(self.dst, file_info["FileName"]), file_info["FileSize"], file_info["Md5Hash"]
+                        ),
+                        outdated,
+                    )
+                )
+                up_to_date = [file_info for file_info, check in zip(outdated, checks) if check]
+                outdated = [file_info for file_info, check in zip(outdated, checks) if not check]
+            failed = self.download_gamefiles(outdated, thread_pool)
+        saved = sum(file_info["FileSize"] for file_info in up_to_date)
+
+        if failed:
+            print(f"Download failed for {len(failed)} of {len(outdated)} files.")
+            exit(1)
+        print(f"Download complete, skipped {len(up_to_date)} up-to-date files ({format_size(saved)} saved).")
+
+    def download_gamefiles(
+        self, file_infos: list[FileInfo], thread_pool: concurrent.futures.ThreadPoolExecutor
+    ) -> list[str]:
+        threads: dict[concurrent.futures.Future[int], str] = {}
+        with self.instrument(sum(file_info["FileSize"] for file_info in file_infos)):
+            for file_info in file_infos:
+                self.log(f"Starting download of {file_info['FileName']}...")
+                fp = os.path.join(self.dst, file_info["FileName"])
+                future = thread_pool.submit(self.handler.download_gamefile_pc, file_info, fp)
+                threads[future] = file_info["FileName"]
+
+            concurrent.futures.wait(threads)
+        return report_failures(threads)
+
+    def assets(self, max_inflight_mb: int = engine.DEFAULT_MAX_INFLIGHT_BYTES >> 20) -> None:
         """Downloads the assets for the game."""
         os.makedirs(self.dst, exist_ok=True)
 
-        filehash_fp = os.path.join(self.dst, "file_hash.txt")
-        if os.path.exists(filehash_fp):
-            with open(filehash_fp, "rt", encoding="utf8") as f:
-                filehash_text = f.read()
-            local = AssetMd5Utils.parse_hash_file(filehash_text)
-        else:
-            local = {}
+        journal = AssetHashJournal(os.path.join(self.dst, "file_hash.txt"))
+        local = journal.load()
 
         remote = self.handler.get_asset_md5()
 
-        thread_pool = concurrent.futures.ThreadPoolExecutor()  # type: ignore
-        threads = []
+        def download_n_record(key: str, md5: str, fp: str) -> int:
+            expected = remote[key]["size"]
+            if self.store is not None:
+                size = self.store.fetch(
+                    md5, fp, lambda blob_fp: self.handler.download_unity_asset(key, md5, blob_fp, expected)
+                )
+            else:
+                size = self.handler.download_unity_asset(key, md5, fp, expected)
+            journal.record(key, md5)
+            return size
+
+        jobs: list[engine.DownloadJob] = []
+        for key in outdated_assets(remote, local):
+            entry = remote[key]
+            self.log(f"Updating {key}..." if key in local else f"Downloading {key}...")
+            fp = os.path.join(self.dst, f"{key}.unity3d")
+            jobs.append(engine.DownloadJob(key, entry["size"], download_n_record, (key, entry["md5"], fp)))
+
+        jobs = engine.schedule_by_size(jobs, self.workers)
+        expected = sum(job.size for job in jobs)
+        print(f"Downloading {len(jobs)} assets, {format_size(expected)} in total...")
+        with journal, self.instrument(expected):
+            result = engine.AsyncDownloadEngine(self.workers, max_inflight_mb << 20).run(jobs)
+        # only keep what is actually on disk, failed assets keep their old entry (if any)
+        local = journal.load()
+        local.retain(remote)
+        journal.compact(local)
+        if self.store is not None:
+            freed = self.store.evict()
+            if freed:
+                print(f"Evicted {format_size(freed)} from the blob store.")
+        if not result.ok:
+            print(f"Download failed for {len(result.failed)} of {len(jobs)} assets.")
+            exit(1)
+        print("Download complete.")
 
-        for key, entry in remote.items():
-            if key.startswith(("audio", "localization")):
-                # TODO
-                continue
+    def verify(self, game: bool = False, repair: bool = False, prune: bool = False) -> None:
+        """Checks the local assets (or game files with --game) against the server, using all cores."""
+        if game:
+            file_infos = {
+                file_info["FileName"]: file_info for file_info in self.handler.get_gamefileinfo_win()["FileInfos"]
+            }
+            expected = {name: (info["FileSize"], info["Md5Hash"]) for name, info in file_infos.items()}
+        else:
+            remote = {
+                key: entry
+                for key, entry in self.handler.get_asset_md5().items()
+                if not key.startswith(("audio", "localization"))
+            }
+            expected = {f"{key}.unity3d": (entry["size"], entry["md5"]) for key, entry in remote.items()}
+
+        report = verify_files(self.dst, expected)
+        report.print_summary()
+
+        if prune:
+            # the game dir also holds files the server doesn't list, e.g. settings and logs
+            names = report.leftovers if game else report.prunable
+            for name in names:
+                os.remove(os.path.join(self.dst, name))
+            print(f"Removed {len(names)} orphaned and leftover files.")
+
+        if not repair or report.intact:
+            if not report.intact:
+                exit(1)
+            return
+
+        bad = report.missing + report.corrupt
+        for name in report.corrupt:
+            os.remove(os.path.join(self.dst, name))
+        if game:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as thread_pool:
+                failed = self.download_gamefiles([file_infos[name] for name in bad], thread_pool)
+            if failed:
+                exit(1)
+        else:
+            # forget the broken assets, so that the sync downloads them again
+            journal = AssetHashJournal(os.path.join(self.dst, "file_hash.txt"))
+            local = journal.load()
+            for name in bad:
+                local.remove(name[: -len(".unity3d")])
+            journal.compact(local)
+            self.assets()
+
+
+def configure_transfers(
+    workers: Optional[int],
+    retries: Optional[int],
+    timeout: Optional[float],
+    blob_store: Optional[str],
+    blob_store_max_gb: Optional[float],
+    adaptive: bool,
+    min_workers: int,
+) -> tuple[int, Optional[BlobStore]]:
+    # sets up the shared session and limiter, returns the number of workers and the blob store
+    workers = workers if workers is not None else net.DEFAULT_WORKERS
+    net.configure(pool_size=workers, retries=retries, read_timeout=timeout)
+    limiter.install(limiter.AdaptiveLimiter(min_workers, workers) if adaptive else None)
+    store = None
+    if blob_store is not None:
+        max_size = int(blob_store_max_gb * (1 << 30)) if blob_store_max_gb is not None else None
+        store = BlobStore(blob_store, max_size)
+    return workers, store
+
+
+@contextmanager
+def instrument(expected_bytes: int, progress: bool, metrics_json: Optional[str]) -> Iterator[TransferMetrics]:
+    # collects the metrics of the downloads within the context
+    METRICS.reset()
+    METRICS.expect(expected_bytes)
+    try:
+        if progress:
+            with ProgressBar(METRICS):
+                yield METRICS
+        else:
+            yield METRICS
+    finally:
+        if metrics_json is not None:
+            METRICS.write_json(metrics_json)
+
+
+def outdated_assets(remote: AssetMd5, local: AssetHashIndex) -> list[str]:
+    """Returns the keys of the assets that are missing locally or differ from the server."""
+    outdated: list[str] = []
+    for key, entry in remote.items():
+        if key.startswith(("audio", "localization")):
+            # TODO
+            continue
+        if local.md5(key) != entry["md5"]:
+            outdated.append(key)
+    return outdated
+
+
+def report_failures(threads: dict[concurrent.futures.Future[int], str]) -> list[str]:
+    failed: list[str] = []
+    for future, name in threads.items():
+        err = future.exception()
+        if err is not None:
+            print(f"Failed to download {name}: {err}")
+            failed.append(name)
+    return failed
+
+
+@dataclass
+class MirrorRegion:
+    channel: str
+    dst: str
+    handler: AssetAPIHandler
+    remote: AssetMd5
+    journal: AssetHashJournal
+    local: AssetHashIndex
 
-            if key in local:
-                if entry["md5"] == local[key]["md5"]:
-                    continue
-                print(f"Updating {key}...")
-            else:
-                print(f"Downloading {key}...")
+    def asset_path(self, key: str) -> str:
+        return os.path.join(self.dst, f"{key}.unity3d")
 
-            fp = os.path.join(self.dst, f"{key}.unity3d")
-            threads.append(thread_pool.submit(download_n_store, self.handler.get_unity_asset, [key, entry["md5"]], fp))  # type: ignore
 
-        concurrent.futures.wait(threads)  # type: ignore
-        with open(filehash_fp, "wt", encoding="utf8") as f:
-            f.write(AssetMd5Utils.dump_hash_file(remote))
-        print("Download complete.")
+class Mirror(object):
+    """
+    A mirror of the assets of several regions, synced in one process.
 
+    The versions and manifests of all regions are fetched concurrently,
+    every distinct asset is downloaded once and linked into the directories of all regions that need it.
 
-def download_n_store(func: Callable[..., bytes], values: list[Any], dst: str) -> None:
-    data = func(*values)
-    os.makedirs(os.path.dirname(dst), exist_ok=True)
-    with open(dst, "wb") as f:
-        f.write(data)
+    Parameters
+    ---
+    dst: str
+        Path to save the files to, every region is stored in a sub directory named after its channel.
+    regions: str | list[str]
+        regions to mirror as cdn or cdn:channel, e.g. us-prod,tw-prod,jp-prod,cn-prod.
+    workers: Optional[int]
+        number of parallel downloads, shared by all regions.
+    retries: Optional[int]
+        max. number of retries for failed requests (5 (default)).
+    timeout: Optional[float]
+        read timeout in seconds per request (60 (default)).
+    blob_store: Optional[str]
+        directory of a content-addressed asset store, kept across runs.
+    blob_store_max_gb: Optional[float]
+        size the blob store gets trimmed to after a sync, least recently used assets are removed first.
+    adaptive: bool
+        adapt the number of concurrent transfers to the cdn, between min_workers and workers.
+    min_workers: int
+        min. number of concurrent transfers when adaptive is set (1 (default)).
+    progress: bool
+        render a live progress bar instead of a line per region.
+    metrics_json: Optional[str]
+        path to write a json report of the transfer metrics to at exit.
+    """
+
+    dst: str
+    regions: list[tuple[str, str]]
+    workers: int
+    store: Optional[BlobStore]
+    progress: bool
+    metrics_json: Optional[str]
+
+    def __init__(
+        self,
+        dst: str,
+        regions: str | list[str] | tuple[str, ...],
+        workers: Optional[int] = None,
+        retries: Optional[int] = None,
+        timeout: Optional[float] = None,
+        blob_store: Optional[str] = None,
+        blob_store_max_gb: Optional[float] = None,
+        adaptive: bool = False,
+        min_workers: int = 1,
+        progress: bool = False,
+        metrics_json: Optional[str] = None,
+    ) -> None:
+        self.dst = dst
+        if isinstance(regions, str):
+            regions = regions.split(",")
+        self.regions = []
+        for region in regions:
+            cdn, _, channel = region.strip().partition(":")
+            self.regions.append((cdn, channel or cdn))
+        self.workers, self.store = configure_transfers(
+            workers, retries, timeout, blob_store, blob_store_max_gb, adaptive, min_workers
+        )
+        self.progress = progress
+        self.metrics_json = metrics_json
+
+    def fetch_regions(self) -> list[MirrorRegion]:
+        """Fetches the versions and asset manifests of all regions concurrently."""
+
+        def fetch_region(cdn: str, channel: str) -> MirrorRegion:
+            handler = AssetAPIHandler.fetch(cdn, channel)  # type: ignore
+            dst = os.path.join(self.dst, channel)
+            journal = AssetHashJournal(os.path.join(dst, "file_hash.txt"))
+            return MirrorRegion(channel, dst, handler, handler.get_asset_md5(), journal, journal.load())
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.regions)) as pool:
+            return list(pool.map(lambda region: fetch_region(*region), self.regions))
+
+    def assets(self, max_inflight_mb: int = engine.DEFAULT_MAX_INFLIGHT_BYTES >> 20) -> None:
+        """Downloads the assets of all regions."""
+        regions = self.fetch_regions()
+
+        # md5 -> (region, key) that need the asset, and md5 -> an up-to-date local copy
+        targets: dict[str, list[tuple[MirrorRegion, str]]] = {}
+        copies: dict[str, str] = {}
+        for region in regions:
+            os.makedirs(region.dst, exist_ok=True)
+            outdated = outdated_assets(region.remote, region.local)
+            for key in outdated:
+                targets.setdefault(region.remote[key]["md5"], []).append((region, key))
+            for key, md5, _timestamp in region.local.items():
+                entry = region.remote.get(key)
+                if entry is not None and entry["md5"] == md5:
+                    copies.setdefault(md5, region.asset_path(key))
+            print(f"{region.channel}: {len(outdated)} of {len(region.remote)} assets outdated")
+
+        def fetch_n_link(md5: str, dsts: list[tuple[MirrorRegion, str]]) -> int:
+            region, key = dsts[0]
+            fp = region.asset_path(key)
+            expected = region.remote[key]["size"]
+            copy = copies.get(md5)
+            if copy is not None and os.path.exists(copy):
+                link_file(copy, fp)
+                size = 0
+            elif self.store is not None:
+                size = self.store.fetch(
+                    md5, fp, lambda blob_fp: region.handler.download_unity_asset(key, md5, blob_fp, expected)
+                )
+            else:
+                size = region.handler.download_unity_asset(key, md5, fp, expected)
+            region.journal.record(key, md5)
+            for other, other_key in dsts[1:]:
+                link_file(fp, other.asset_path(other_key))
+                other.journal.record(other_key, md5)
+            return size
+
+        jobs: list[engine.DownloadJob] = []
+        for md5, dsts in targets.items():
+            region, key = dsts[0]
+            # the same key can stand for different assets in several regions, the results are kept by name
+            name = f"{region.channel}/{key}"
+            jobs.append(engine.DownloadJob(name, region.remote[key]["size"], fetch_n_link, (md5, dsts)))
+        jobs = engine.schedule_by_size(jobs, self.workers)
+        expected = sum(job.size for job in jobs)
+        print(f"Fetching {len(jobs)} distinct assets, {format_size(expected)} in total...")
+        with ExitStack() as stack:
+            for region in regions:
+                stack.enter_context(region.journal)
+            with instrument(expected, self.progress, self.metrics_json):
+                result = engine.AsyncDownloadEngine(self.workers, max_inflight_mb << 20).run(jobs)
+
+        for region in regions:
+            local = region.journal.load()
+            local.retain(region.remote)
+            region.journal.compact(local)
+        if self.store is not None:
+            freed = self.store.evict()
+            if freed:
+                print(f"Evicted {format_size(freed)} from the blob store.")
+        if not result.ok:
+            print(f"Download failed for {len(result.failed)} of {len(jobs)} distinct assets.")
+            exit(1)
+        print("Mirror complete.")
 
 
 class News:
@@ -175,31 +533,50 @@ class Database:
     Parameters
     ---
     dst: str
-        Path to save the files to.
+        Path to save the files to, a path ending with .zip, .tar, .tar.gz, .tar.xz, .tar.bz2 or .tar.zst
+        (requires zstandard) writes an archive instead.
     loc: Optional[str]
-        localisation to use (none (default), en, ja, ko, zh-cn, zh-tw).
+        localisation to use (none (default), en, ja, ko, zh-cn, zh-tw), several ones separated by commas.
     area: Optional[str]
-        area to use (none (default), us, tw, kr, jp, cn).
+        area to use (none (default), us, tw, kr, jp, cn), several ones separated by commas.
+        Every loc/area combination is dumped to db_{loc}_{area} in a single Lua VM.
+    processes: int
+        number of processes exporting the localization languages in parallel, each with its own Lua VM
+        (1 (default) exports them in the VM of the database).
+        Exits with status 1 if any language failed.
     """
 
     dst: str
-    loc: str
-    area: str
-
-    def __init__(self, dst: str, loc: str = "none", area: str = "none") -> None:
+    loc: "str | tuple[str, ...]"
+    area: "str | tuple[str, ...]"
+    processes: int
+
+    def __init__(
+        self,
+        dst: str,
+        loc: "str | tuple[str, ...]" = "none",
+        area: "str | tuple[str, ...]" = "none",
+        processes: int = 1,
+    ) -> None:
         self.dst = dst
         self.loc = loc
         self.area = area
+        self.processes = processes
 
     def from_game(self, game_dir: str) -> None:
         """Dumps the database using the game instance."""
-        dump_database_from_game(game_dir, self.dst, self.loc, self.area)  # type: ignore
+        self._check(dump_database_from_game(game_dir, self.dst, self.loc, self.area, self.processes))  # type: ignore
 
     def from_server(self, cdn: str, channel: Optional[str] = None) -> None:
         """Dumps the database using the assets from the server."""
         handler = AssetAPIHandler.fetch(cdn, channel)  # type: ignore
-        dump_database_from_server(handler, self.dst, self.loc, self.area)  # type: ignore
+        self._check(dump_database_from_server(handler, self.dst, self.loc, self.area, self.processes))  # type: ignore
+
+    def _check(self, errors: dict[str, str]) -> None:
+        if errors:
+            print(f"Failed to export the localization of {len(errors)} languages: {', '.join(errors)}")
+            exit(1)
 
 
 if __name__ == "__main__":
-    fire.Fire({"news": News, "download": Downloader, "database": Database})  # type: ignore
+    fire.Fire({"news": News, "download": Downloader, "mirror": Mirror, "database": Database})  # type: ignore
@@ -1,18 +1,26 @@
 import inspect
 import json
 import os
-import re
 import time
 from dataclasses import dataclass
 from typing import Literal
 from typing import Optional
 from typing import TypedDict
 
-import requests
 import UnityPy
 
+from . import cache
+from . import limiter
+from . import net
+from . import transfer
+from .metrics import METRICS
+
 REGION = Literal["tw-prod", "us-prod", "kr-prod", "jp-prod"]
 AUDIO_LANGUAGE = Literal["cn", "jp", "kr"]
+# can be pointed to a mirror or a local test server
+VERSION_URL = os.environ.get(
+    "MOC_UTILS_VERSION_URL", "https://ssrpg-{cdn_region}-user-center.xdgtw.com/version/{channel}/{version}"
+)
 
 
 class FileInfo(TypedDict):
@@ -39,6 +47,9 @@ class AssetMd5EntryLocal(TypedDict):
 AssetMd5 = dict[str, AssetMd5Entry]
 AssetMd5Local = dict[str, AssetMd5EntryLocal]
 
+# characters of the shortened md5s in file_hash.txt
+MD5_CHARS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
 
 @dataclass
 class AssetAPIHandler:
@@ -84,26 +95,51 @@ class AssetAPIHandler:
         )
 
     @classmethod
-    def fetch(cls, cdn_region: REGION, channel: Optional[REGION] = None, version: str = "0") -> "AssetAPIHandler":
+    def fetch(
+        cls,
+        cdn_region: REGION,
+        channel: Optional[REGION] = None,
+        version: str = "0",
+        cache_ttl: float = cache.VERSION_TTL,
+    ) -> "AssetAPIHandler":
         # server seems to ignore client version, and always return the same response,
         # as long as a client version is provided
         # versions: us-prod, ..., steam-demo -> us-prod
         if channel is None:
             channel = cdn_region
-        url = f"https://ssrpg-{cdn_region}-user-center.xdgtw.com/version/{channel}/{version}"
-        # print(url)
-        res = requests.get(url)
-        res.raise_for_status()
-        data = res.json()
-        if "RawMap" in data:
-            raise ValueError(json.dumps(data))
-        return cls.from_dict({**res.json(), channel: channel})
+        cache_name = f"version_{cdn_region}_{channel}_{version}.json"
+        data = cache.read_json(cache_name, cache_ttl) if cache_ttl > 0 else None
+        if data is None:
+            url = VERSION_URL.format(cdn_region=cdn_region, channel=channel, version=version)
+            # print(url)
+            res = net.get(url)
+            res.raise_for_status()
+            data = res.json()
+            if "RawMap" in data:
+                raise ValueError(json.dumps(data))
+            cache.write_json(cache_name, data)
+        return cls.from_dict({**data, channel: channel})
 
     def get_file(self, directory: str, filename: str) -> bytes:
         url = f"{self.url_asset}{directory}/{filename}"
-        res = requests.get(url)
-        res.raise_for_status()
-        return res.content
+        chunks: list[bytes] = []
+        # streamed, so that the time to the first byte is measured like for the downloads of transfer
+        with limiter.slot() as slot, METRICS.track() as tracker, net.get(url, stream=True) as res:
+            res.raise_for_status()
+            for chunk in res.iter_content(transfer.CHUNK_SIZE):
+                tracker.first_byte()
+                slot.first_byte()
+                chunks.append(chunk)
+                slot.add_bytes(len(chunk))
+                METRICS.record_bytes(len(chunk))
+        return b"".join(chunks)
+
+    def download_file(
+        self, directory: str, filename: str, dst: str, size: Optional[int] = None, md5: Optional[str] = None
+    ) -> int:
+        # streaming and resumable variant of get_file, returns the size of the file
+        url = f"{self.url_asset}{directory}/{filename}"
+        return transfer.stream_to_file(url, dst, size, md5)
 
     def get_gamefileinfo_win(self) -> GameFileInfo:
         # fetches the list of game files for windows
@@ -113,6 +149,14 @@ class AssetAPIHandler:
         return json.loads(self.get_file("pc", name))
 
     def get_launcher_pc(self, channel: Optional[REGION] = None, version: Optional[str] = None) -> bytes:
+        return self.get_file("Launcher", self.launcher_pc_name(channel, version))
+
+    def download_launcher_pc(self, dst: str, channel: Optional[REGION] = None, version: Optional[str] = None) -> int:
+        name = self.launcher_pc_name(channel, version)
+        # the version keys the part file, so that a part of another launcher version isn't resumed
+        return self.download_file("Launcher", name, dst, md5=version or self.launcher_md5)
+
+    def launcher_pc_name(self, channel: Optional[REGION] = None, version: Optional[str] = None) -> str:
         if channel is None:
             channel = self.channel
         if version is None:
@@ -120,11 +164,17 @@ class AssetAPIHandler:
                 raise ValueError("version is required when launcher_md5 is not provided")
             version = self.launcher_md5
 
-        name = f"SoCLauncher_PC_{channel or self.channel}.{version}.exe"
-
-        return self.get_file("Launcher", name)
+        return f"SoCLauncher_PC_{channel or self.channel}.{version}.exe"
 
     def get_gamefile_pc(self, file_info: FileInfo) -> bytes:
+        return self.get_file("pc", self.gamefile_pc_name(file_info))
+
+    def download_gamefile_pc(self, file_info: FileInfo, dst: str) -> int:
+        return self.download_file(
+            "pc", self.gamefile_pc_name(file_info), dst, file_info["FileSize"], file_info["Md5Hash"]
+        )
+
+    def gamefile_pc_name(self, file_info: FileInfo) -> str:
         filename = file_info["FileName"]
         if self.use_hash:
             split = filename.rsplit(".", 1)
@@ -134,23 +184,40 @@ class AssetAPIHandler:
             else:
                 # name_hash.ext
                 filename = f"{split[0]}_{file_info['Md5Hash']}.{split[1]}"
+        return filename
 
-        return self.get_file("pc", filename)
-
-    def get_asset_md5(self) -> AssetMd5:
+    def get_asset_md5(self, use_cache: bool = True) -> AssetMd5:
         # /assets/name -- name - {md5, size} mapping
+        # the manifest is immutable for a given pc_md5, so the decoded version can be cached forever
+        cache_name = f"asset_md5_{self.pc_md5}.json"
+        if use_cache and self.pc_md5:
+            asset_md5 = cache.read_json(cache_name)
+            if asset_md5 is not None:
+                return asset_md5
+
         asset_md5_unity3d = self.get_unity_asset("asset_md5", self.pc_md5)
         env = UnityPy.load(asset_md5_unity3d)  # type: ignore
         asset_md5_ta = next(obj for obj in env.objects if obj.type.name == "TextAsset").read()  # type: ignore
         asset_md5 = json.loads(asset_md5_ta.m_Script)  # type: ignore
+        if use_cache and self.pc_md5:
+            cache.write_json(cache_name, asset_md5)
         return asset_md5
 
     def get_unity_asset(self, asset_name: str, asset_md5: Optional[str] = None) -> bytes:
+        return self.get_file("WebAssets", self.unity_asset_name(asset_name, asset_md5))
+
+    def download_unity_asset(
+        self, asset_name: str, asset_md5: Optional[str], dst: str, size: Optional[int] = None
+    ) -> int:
+        # the shortened md5 can't be verified, but keeps parts of other versions from being resumed
+        return self.download_file("WebAssets", self.unity_asset_name(asset_name, asset_md5), dst, size, asset_md5)
+
+    def unity_asset_name(self, asset_name: str, asset_md5: Optional[str] = None) -> str:
         name = asset_name
         if self.use_hash:
             assert asset_md5 is not None, "asset_md5 must be provided when use_hash is True"
             name = f"{name}_{asset_md5}"
-        return self.get_file("WebAssets", f"{name}.unity3d")
+        return f"{name}.unity3d"
 
     def get_audio(self, asset_name: str, asset_md5: str) -> bytes:
         name = asset_name
@@ -160,23 +227,50 @@ class AssetAPIHandler:
 
 
 class AssetMd5Utils:
+    @staticmethod
+    def parse_hash_line(line: str) -> Optional[tuple[str, str, int]]:
+        """
+        Parses a single key|md5|timestamp line of a file_hash.txt.
+
+        Args:
+            line (str): The line, with or without the line separator.
+
+        Returns:
+            Optional[tuple[str, str, int]]: key, md5 and timestamp, or None if the line is malformed.
+        """
+        key, sep, rest = line.rstrip("\r\n").rpartition("|")
+        if not sep or not rest.isdigit():
+            return None
+        key, sep, md5 = key.rpartition("|")
+        if not sep or not key or len(md5) != 16 or md5.strip(MD5_CHARS):
+            return None
+        return key, md5, int(rest)
+
     @staticmethod
     def parse_hash_file(text: str) -> AssetMd5Local:
-        return {
-            match.group(1): (
-                {
-                    "md5": match.group(2),
-                    "timestamp": int(match.group(3)),
-                }
-            )
-            for match in re.finditer(r"(.+?)\|([a-z0-9]{16})\|(\d+)", text)
-        }
+        local: AssetMd5Local = {}
+        for line in text.splitlines():
+            entry = AssetMd5Utils.parse_hash_line(line)
+            if entry is not None:
+                local[entry[0]] = {"md5": entry[1], "timestamp": entry[2]}
+        return local
+
+    @staticmethod
+    def line_separator() -> str:
+        # files are written in text mode, so this results in \r\n on all systems
+        return "\n" if os.name == "nt" else "\r\n"
 
     @staticmethod
     def dump_hash_file(asset_md5: AssetMd5) -> str:
-        sep = "\n" if os.name == "nt" else "\r\n"
+        sep = AssetMd5Utils.line_separator()
         return sep.join(f"{k}|{v['md5']}|{int(time.time())}" for k, v in asset_md5.items()) + sep
 
+    @staticmethod
+    def dump_hash_file_local(asset_md5_local: AssetMd5Local) -> str:
+        # keeps the timestamps of the entries
+        sep = AssetMd5Utils.line_separator()
+        return sep.join(f"{k}|{v['md5']}|{v['timestamp']}" for k, v in asset_md5_local.items()) + sep
+
     @staticmethod
     def compare_asset_hashs(asset_md5_local: AssetMd5 | AssetMd5Local, asset_md5_server: AssetMd5) -> AssetMd5:
         """
@@ -0,0 +1,150 @@
+import errno
+import os
+import shutil
+import threading
+from typing import Callable
+from typing import Optional
+
+# linux ioctl for cloning a file (copy-on-write), supported by btrfs, xfs, ...
+FICLONE = 0x40049409
+
+
+class BlobStore:
+    """
+    A local content-addressed store for assets, keyed by their md5.
+
+    Assets are downloaded into the store once and then linked into the asset trees,
+    preferably via hardlink, else via reflink, and as last resort via copy.
+    This way multiple regions/channels share the data of identical assets.
+
+    Parameters
+    ---
+    root: str
+        Directory of the store.
+    max_size: Optional[int]
+        Size in bytes the store gets trimmed to by evict, least recently used blobs are removed first.
+    """
+
+    root: str
+    max_size: Optional[int]
+    _locks: dict[str, threading.Lock]
+    _locks_lock: threading.Lock
+
+    def __init__(self, root: str, max_size: Optional[int] = None) -> None:
+        self.root = root
+        self.max_size = max_size
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, md5: str) -> str:
+        return os.path.join(self.root, md5[:2], md5)
+
+    def has(self, md5: str) -> bool:
+        return os.path.exists(self.path(md5))
+
+    def _lock(self, md5: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(md5, threading.Lock())
+
+    def fetch(self, md5: str, dst: str, download: Callable[[str], int]) -> int:
+        """
+        Stores the blob at dst, the blob is only downloaded if it isn't in the store yet.
+
+        Args:
+            md5 (str): The md5 of the blob.
+            dst (str): The path to store the blob at.
+            download (Callable[[str], int]): Downloads the blob to the given path and returns its size.
+
+        Returns:
+            int: The number of downloaded bytes, 0 if the blob was in the store.
+        """
+        blob_fp = self.path(md5)
+        downloaded = 0
+        with self._lock(md5):
+            if os.path.exists(blob_fp):
+                # mark as recently used
+                os.utime(blob_fp)
+            else:
+                downloaded = download(blob_fp)
+        link_file(blob_fp, dst)
+        return downloaded
+
+    def add(self, md5: str, src: str) -> None:
+        """Adds an existing file to the store."""
+        with self._lock(md5):
+            if not os.path.exists(self.path(md5)):
+                link_file(src, self.path(md5))
+
+    def size(self) -> int:
+        return sum(entry.stat().st_size for entry in self._scan())
+
+    def evict(self, max_size: Optional[int] = None) -> int:
+        """
+        Removes the least recently used blobs until the store fits into max_size.
+        Files linked into the asset trees stay untouched.
+
+        Args:
+            max_size (Optional[int]): The size to trim to, defaults to the max_size of the store.
+
+        Returns:
+            int: The number of freed bytes.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        if max_size is None:
+            return 0
+
+        blobs = [(entry.stat(), entry.path) for entry in self._scan()]
+        total = sum(stat.st_size for stat, _ in blobs)
+        freed = 0
+        for stat, fp in sorted(blobs, key=lambda blob: blob[0].st_mtime):
+            if total - freed <= max_size:
+                break
+            os.remove(fp)
+            freed += stat.st_size
+        return freed
+
+    def _scan(self) -> list[os.DirEntry[str]]:
+        entries: list[os.DirEntry[str]] = []
+        for prefix in os.scandir(self.root):
+            if prefix.is_dir():
+                entries.extend(
+                    entry for entry in os.scandir(prefix.path) if entry.is_file() and not entry.name.endswith(".part")
+                )
+        return entries
+
+
+def link_file(src: str, dst: str) -> None:
+    """Links src to dst, via hardlink if possible, else via reflink or copy. An existing dst is replaced."""
+    dirname = os.path.dirname(dst)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+
+    # link to a temporary name first, so that dst is replaced atomically
+    tmp = f"{dst}.link"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        if not reflink(src, tmp):
+            shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def reflink(src: str, dst: str) -> bool:
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return True
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF):
+                raise
+    os.remove(dst)
+    return False
@@ -0,0 +1,58 @@
+import json
+import os
+import time
+from typing import Any
+from typing import Optional
+
+# lifetime in seconds of the cached version endpoint responses
+VERSION_TTL = 300.0
+
+
+def cache_dir() -> str:
+    path = os.environ.get("MOC_UTILS_CACHE_DIR")
+    if path is None:
+        base = os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA") or os.path.expanduser("~/.cache")
+        path = os.path.join(base, "moc_utils")
+    return path
+
+
+def enabled() -> bool:
+    return not os.environ.get("MOC_UTILS_NO_CACHE")
+
+
+def read_json(name: str, max_age: Optional[float] = None) -> Optional[Any]:
+    """
+    Reads a cached json entry.
+
+    Args:
+        name (str): The name of the entry.
+        max_age (Optional[float]): Max. age of the entry in seconds, older entries are ignored.
+
+    Returns:
+        Optional[Any]: The cached data, or None if there is no valid entry.
+    """
+    if not enabled():
+        return None
+    fp = os.path.join(cache_dir(), name)
+    try:
+        if max_age is not None and time.time() - os.path.getmtime(fp) > max_age:
+            return None
+        with open(fp, "rb") as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(name: str, data: Any) -> None:
+    # failing to write the cache mustn't break the actual work
+    if not enabled():
+        return
+    fp = os.path.join(cache_dir(), name)
+    tmp_fp = f"{fp}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir(), exist_ok=True)
+        with open(tmp_fp, "wt", encoding="utf8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_fp, fp)
+    except OSError as e:
+        print(f"Failed to write cache {fp}: {e}")
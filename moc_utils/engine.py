@@ -0,0 +1,171 @@
+import asyncio
+import concurrent.futures
+from collections import deque
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import Optional
+
+from . import net
+
+# upper limit of the summed size of all downloads running at the same time
+DEFAULT_MAX_INFLIGHT_BYTES = 256 << 20
+
+
+@dataclass
+class DownloadJob:
+    name: str
+    size: int
+    func: Callable[..., Any]
+    args: tuple[Any, ...] = ()
+
+
+@dataclass
+class EngineResult:
+    completed: list[str] = field(default_factory=list)
+    failed: dict[str, BaseException] = field(default_factory=dict)
+    bytes_done: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+
+def schedule_by_size(jobs: Iterable[DownloadJob], concurrency: int) -> list[DownloadJob]:
+    """
+    Orders the jobs longest first, so that no large job is left for the end of the run,
+    while spreading the large jobs over the queue, so that they don't all run at once.
+
+    The largest jobs that together make up half of the bytes count as large.
+    Every group of `concurrency` consecutive jobs holds at most half (but at least one) large jobs,
+    the remaining slots are filled with the other jobs, again largest first.
+    Once the other jobs ran out, the remaining large jobs follow at the end.
+
+    Args:
+        jobs (Iterable[DownloadJob]): The jobs to schedule.
+        concurrency (int): The number of jobs running at the same time.
+
+    Returns:
+        list[DownloadJob]: The scheduled jobs.
+    """
+    ordered = sorted(jobs, key=lambda job: job.size, reverse=True)
+    half = sum(job.size for job in ordered) / 2
+
+    n_large = 0
+    acc = 0
+    while n_large < len(ordered) and acc < half:
+        acc += ordered[n_large].size
+        n_large += 1
+    large = iter(ordered[:n_large])
+    small = iter(ordered[n_large:])
+
+    window = max(1, concurrency)
+    large_slots = max(1, window // 2)
+    scheduled: list[DownloadJob] = []
+    while len(scheduled) < len(ordered):
+        taken = [job for _, job in zip(range(large_slots), large)]
+        taken.extend(job for _, job in zip(range(window - len(taken)), small))
+        scheduled.extend(taken)
+    return scheduled
+
+
+class ByteBudget:
+    """
+    Limits the summed size of the running jobs.
+    Waiting jobs are admitted in FIFO order, so a large job can't be starved by smaller ones.
+    A job larger than the whole budget is still admitted once nothing else is running.
+    """
+
+    limit: int
+    used: int
+    _waiters: deque[tuple[int, "asyncio.Future[None]"]]
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.used = 0
+        self._waiters = deque()
+
+    def _fits(self, size: int) -> bool:
+        return self.used == 0 or self.used + size <= self.limit
+
+    async def acquire(self, size: int) -> None:
+        if not self._waiters and self._fits(size):
+            self.used += size
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((size, waiter))
+        await waiter
+
+    def release(self, size: int) -> None:
+        self.used -= size
+        while self._waiters and self._fits(self._waiters[0][0]):
+            size, waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.used += size
+                waiter.set_result(None)
+
+
+class AsyncDownloadEngine:
+    """
+    Runs download jobs from an asyncio event loop.
+
+    The jobs are started in the given order by a fixed number of worker coroutines,
+    so neither the number of running jobs nor the summed size of their files exceeds the configured limits.
+    The blocking http calls run on a thread pool sized to the concurrency.
+    Failed jobs don't stop the others, their exceptions are collected in the result.
+
+    Parameters
+    ---
+    concurrency: int
+        max. number of jobs running at the same time.
+    max_inflight_bytes: int
+        max. summed size of the jobs running at the same time.
+    """
+
+    concurrency: int
+    max_inflight_bytes: int
+    on_complete: Optional[Callable[[DownloadJob, Any], None]]
+
+    def __init__(
+        self,
+        concurrency: int = net.DEFAULT_WORKERS,
+        max_inflight_bytes: int = DEFAULT_MAX_INFLIGHT_BYTES,
+        on_complete: Optional[Callable[[DownloadJob, Any], None]] = None,
+    ) -> None:
+        self.concurrency = max(1, concurrency)
+        self.max_inflight_bytes = max_inflight_bytes
+        self.on_complete = on_complete
+
+    def run(self, jobs: Iterable[DownloadJob]) -> EngineResult:
+        return asyncio.run(self.run_async(jobs))
+
+    async def run_async(self, jobs: Iterable[DownloadJob]) -> EngineResult:
+        result = EngineResult()
+        budget = ByteBudget(self.max_inflight_bytes)
+        queue = iter(jobs)
+        loop = asyncio.get_running_loop()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+
+            async def worker() -> None:
+                # the iterator is only advanced from the event loop thread, so no lock is required
+                for job in queue:
+                    await budget.acquire(job.size)
+                    try:
+                        value = await loop.run_in_executor(executor, job.func, *job.args)
+                    except Exception as e:
+                        print(f"Failed to download {job.name}: {e}")
+                        result.failed[job.name] = e
+                    else:
+                        result.completed.append(job.name)
+                        result.bytes_done += job.size
+                        if self.on_complete is not None:
+                            self.on_complete(job, value)
+                    finally:
+                        budget.release(job.size)
+
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+        return result
@@ -0,0 +1,110 @@
+import contextlib
+import hashlib
+import os
+import time
+from typing import Optional
+
+from ... import cache
+
+# compiled chunks that weren't used for this long are removed from the disk
+MAX_AGE = 30 * 24 * 3600.0
+
+
+class LuaChunkCache:
+    """
+    Cache of compiled Lua chunks, keyed by a hash of the chunk name and source.
+
+    Chunks are kept in memory and, if root is set, stored as one file per chunk,
+    so that later runs load the bytecode instead of parsing the source again.
+    Bytecode is specific to the Lua build, so every library gets its own root, see default.
+
+    Parameters
+    ---
+    root: Optional[str]
+        directory of the chunk files, None to keep the chunks in memory only.
+    """
+
+    root: Optional[str]
+    chunks: dict[str, bytes]
+    hits: int
+    misses: int
+
+    def __init__(self, root: Optional[str] = None) -> None:
+        self.root = root
+        self.chunks = {}
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def default(cls, lib_fp: str) -> "LuaChunkCache":
+        """Returns the cache of a Lua library in the cache dir of moc_utils, in memory only if caching is disabled."""
+        if not cache.enabled():
+            return cls()
+        return cls(os.path.join(cache.cache_dir(), "lua_chunks", library_key(lib_fp)))
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the compiled chunk, or None if it isn't cached."""
+        chunk = self.chunks.get(key)
+        if chunk is None and self.root is not None:
+            fp = os.path.join(self.root, f"{key}.luac")
+            try:
+                with open(fp, "rb") as f:
+                    chunk = f.read()
+                # keeps chunks in use from being pruned
+                os.utime(fp)
+            except OSError:
+                chunk = None
+            if chunk is not None:
+                self.chunks[key] = chunk
+        if chunk is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return chunk
+
+    def put(self, key: str, chunk: bytes) -> None:
+        # failing to write the cache mustn't break the actual work
+        self.chunks[key] = chunk
+        if self.root is None:
+            return
+        fp = os.path.join(self.root, f"{key}.luac")
+        tmp_fp = f"{fp}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with open(tmp_fp, "wb") as f:
+                f.write(chunk)
+            os.replace(tmp_fp, fp)
+        except OSError as e:
+            print(f"Failed to write cache {fp}: {e}")
+
+    def discard(self, key: str) -> None:
+        """Removes a chunk, e.g. one the library refused to load."""
+        self.chunks.pop(key, None)
+        if self.root is not None:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(self.root, f"{key}.luac"))
+
+    def prune(self, max_age: float = MAX_AGE) -> None:
+        """Removes the chunk files of all libraries that weren't used within max_age seconds."""
+        if self.root is None:
+            return
+        threshold = time.time() - max_age
+        for dirpath, _dirs, files in os.walk(os.path.dirname(self.root)):
+            for file in files:
+                fp = os.path.join(dirpath, file)
+                try:
+                    if os.path.getmtime(fp) < threshold:
+                        os.remove(fp)
+                except OSError:
+                    pass
+
+
+def chunk_key(name: str, source: bytes) -> str:
+    # the chunk name is part of the bytecode, e.g. for error messages
+    return hashlib.sha1(name.encode("utf-8") + b"\x00" + source).hexdigest()
+
+
+def library_key(fp: str) -> str:
+    # the content, as the library of server dumps is written to a new temp file every time
+    with open(fp, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
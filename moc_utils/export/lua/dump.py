@@ -1,16 +1,34 @@
+import concurrent.futures
+import functools
 import gc
 import os
-from itertools import cycle
+from contextlib import contextmanager
+from itertools import product
 from tempfile import TemporaryDirectory
 from typing import TYPE_CHECKING
+from typing import Any
 from typing import Callable
+from typing import Iterator
 from typing import Literal
+from typing import Mapping
 from typing import Optional
+from typing import Sequence
 
 import UnityPy
 import UnityPy.classes
 
-from .handler import LuaHandler
+from .json_writer import dumps
+from .lazy_map import LazyLuaMap
+from .script_cache import LuaScriptCache
+from .script_cache import local_bundle_key
+from .session import KEEP_MODULES
+from .session import VIRTUAL_ASSET_DIR
+from .session import VIRTUAL_EXPORT_DIR
+from .session import LuaFileSystem
+from .session import LuaSession
+from .sink import DumpSink
+from .sink import MemorySink
+from .sink import sink_for
 
 if TYPE_CHECKING:
     from UnityPy.classes import TextAsset
@@ -19,26 +37,76 @@ if TYPE_CHECKING:
 
 LUA_PATH = os.path.join(os.path.dirname(__file__), "scripts")
 
+# the first byte is XORed with 53, the following ones with the cycled
+# [23, 241, 195, 85, 120, 100, 57, 64, 66, 119, 89, 18, 51, 203, 123, 185, 53],
+# which is the same as cycling this key from the first byte on
+TEXTASSET_KEY = bytes([53, 23, 241, 195, 85, 120, 100, 57, 64, 66, 119, 89, 18, 51, 203, 123, 185])
+# pre-tiled key stream for scripts up to 1 MiB
+TEXTASSET_KEY_STREAM = (TEXTASSET_KEY * ((1 << 20) // len(TEXTASSET_KEY) + 1))[: 1 << 20]
+
+
+def lua_require_unitypy(lua_map: Mapping[str, bytes], trace: Optional[bool] = None) -> Callable[[str], bytes]:
+    """
+    Returns the loader of the modules required by the scripts.
+    Modules are looked up in lua_map, in the scripts of moc_utils, and in lua_map with a lower-cased directory,
+    in that order. Where a module was found is memoized, so repeated requires only cost a dict lookup.
+
+    Args:
+        lua_map (Mapping[str, bytes]): The lua scripts of the game.
+        trace (Optional[bool]): Whether to print every loaded module, defaults to the env var MOC_UTILS_TRACE_LUA.
+
+    Returns:
+        Callable[[str], bytes]: The loader, returning b"" for unknown modules.
+    """
+    if trace is None:
+        trace = bool(os.environ.get("MOC_UTILS_TRACE_LUA"))
+    scripts = local_scripts()
+    # module -> (origin, key in lua_map or scripts)
+    resolved: dict[str, tuple[str, str]] = {}
+
+    def resolve(filename: str) -> tuple[str, str]:
+        if filename in lua_map:
+            return "lua_map", filename
+        if filename in scripts:
+            return "local", filename
+        dirname, _, name = filename.partition("/")
+        key = f"{dirname.lower()}/{name}"
+        if name and key in lua_map:
+            return "lua_map", key
+        return "missing", filename
 
-def lua_require_unitypy(lua_map: dict[str, bytes]) -> Callable[[str], bytes]:
     def lua_require(filename: str) -> bytes:
-        print(f"Py: Loading {filename}")
         if filename == "DBTemplate/text":
             return b"return {}"
 
-        if filename in lua_map:
-            return lua_map[filename]
+        origin, key = resolved.get(filename) or resolved.setdefault(filename, resolve(filename))
+        if trace:
+            print(f"Py: Loading {filename} ({origin})")
+        if origin == "lua_map":
+            return lua_map[key]
+        if origin == "local":
+            return read_local_script(scripts[key])
+        return b""
 
-        fp = os.path.join(LUA_PATH, f"{filename}.lua")
-        if not os.path.exists(fp):
-            dirname, name = filename.split("/", 1)
-            key = f"{dirname.lower()}/{name}"
-            return lua_map.get(key, b"")
+    return lua_require
 
-        with open(fp, "rb") as f:
-            return f.read()
 
-    return lua_require
+@functools.lru_cache(maxsize=None)
+def local_scripts() -> dict[str, str]:
+    # module name -> path of the scripts shipped with moc_utils, listed once per process
+    scripts: dict[str, str] = {}
+    for dirpath, _dirs, files in os.walk(LUA_PATH):
+        for file in files:
+            if file.endswith(".lua"):
+                fp = os.path.join(dirpath, file)
+                scripts[os.path.relpath(fp, LUA_PATH)[:-4].replace(os.sep, "/")] = fp
+    return scripts
+
+
+@functools.lru_cache(maxsize=None)
+def read_local_script(fp: str) -> bytes:
+    with open(fp, "rb") as f:
+        return f.read()
 
 
 # class LuaIOHandler:
@@ -61,132 +129,305 @@ def lua_require_unitypy(lua_map: dict[str, bytes]) -> Callable[[str], bytes]:
 
 
 def dump_database(
-    dst: str,
+    dst: "str | DumpSink",
     slua_fp: str,
     asset_dir: str,
-    lua_map: dict[str, bytes],
+    lua_map: Mapping[str, bytes],
     loc: str = "none",
     operating_area: Literal["none", "cn", "tw", "jp", "kr", "us"] = "none",
+    session: Optional[LuaSession] = None,
+    assets: Optional[Mapping[str, bytes]] = None,
 ) -> None:
-    os.makedirs(dst, exist_ok=True)
-    dst_dir_lua = dst.replace("\\", "\\\\")
+    with sink_for(dst) as sink:
+        run_database(slua_fp, asset_dir, lua_map, json_table_writer(sink), loc, operating_area, session, sink, assets)
+
+
+def json_table_writer(sink: DumpSink) -> Callable[[str, Any], None]:
+    def export_table(name: str, data: Any) -> None:
+        # neatjson wrote empty tables as [] and all other ones as objects, arrays included
+        if isinstance(data, list) and data:
+            data = dict(enumerate(data, 1))
+        sink.write(f"{name}.json", dumps(data))
+
+    return export_table
+
+
+def load_database(
+    slua_fp: str,
+    asset_dir: str,
+    lua_map: Mapping[str, bytes],
+    loc: str = "none",
+    operating_area: Literal["none", "cn", "tw", "jp", "kr", "us"] = "none",
+    session: Optional[LuaSession] = None,
+    assets: Optional[Mapping[str, bytes]] = None,
+) -> dict[str, Any]:
+    """
+    Loads the database into memory, instead of dumping it to json files.
+
+    Args:
+        slua_fp (str): The path of the slua library.
+        asset_dir (str): The directory holding db_lua.bytes.
+        lua_map (Mapping[str, bytes]): The lua scripts of the game.
+        loc (str): The localisation to use.
+        operating_area (str): The area to use.
+        session (Optional[LuaSession]): The VM to use, a new one if None.
+        assets (Optional[Mapping[str, bytes]]): The files of asset_dir by name, e.g. db_lua.bytes,
+            to serve them from memory.
+
+    Returns:
+        dict[str, Any]: The tables of the database by name, see LuaHandler.to_python for their conversion.
+    """
+    tables: dict[str, Any] = {}
+    run_database(slua_fp, asset_dir, lua_map, tables.__setitem__, loc, operating_area, session, None, assets)
+    return tables
+
+
+def run_database(
+    slua_fp: str,
+    asset_dir: str,
+    lua_map: Mapping[str, bytes],
+    export_table: Callable[[str, Any], None],
+    loc: str = "none",
+    operating_area: str = "none",
+    session: Optional[LuaSession] = None,
+    sink: Optional[DumpSink] = None,
+    assets: Optional[Mapping[str, bytes]] = None,
+) -> None:
+    # dump.lua passes every table of the database to export_table,
+    # files the scripts write below EXPORT_DIR go to sink, reads below ASSET_DIR are served from assets
+    if assets is not None:
+        asset_dir = VIRTUAL_ASSET_DIR
     asset_dir_lua = asset_dir.replace("\\", "\\\\")
     dump_code_init = f"""
     Localization = "{loc}"
     OperatingArea = "{operating_area}"
-    EXPORT_DIR = "{dst_dir_lua}"
+    EXPORT_DIR = "{VIRTUAL_EXPORT_DIR}"
     ASSET_DIR = "{asset_dir_lua}"
+    EXPORT_TABLE = python.export_table
     require("dump")
     """
 
-    handler = LuaHandler(slua_fp)
-    handler.register_package_loader(lua_require_unitypy(lua_map))
-    handler.loadstring(dump_code_init)
-    if handler.pcall(0, 1, 0):
-        err_msg = handler.tolstring(-1)
-        print("Error executing Lua script:", err_msg)
-    del handler
+    with session_for(slua_fp, lua_map, session) as session:
+        session.set_exporter(export_table)
+        session.set_filesystem(LuaFileSystem(sink, VIRTUAL_EXPORT_DIR, assets, asset_dir))
+        try:
+            session.run(dump_code_init)
+        finally:
+            session.set_exporter(None)
+            session.set_filesystem(None)
 
 
-def dump_localization(dst: str, slua_fp: str, lua_map: dict[str, bytes]) -> None:
-    os.makedirs(dst, exist_ok=True)
-    dst_dir_lua = dst.replace("\\", "\\\\")
-    dump_code_init = f"""
-    EXPORT_DIR = "{dst_dir_lua}"
-    local neatjson = require("neatjson")
-    local json_options = {{
-        wrap = true,
-        sort = function(k) return k end,
-    }}
+def dump_localization(
+    dst: "str | DumpSink",
+    slua_fp: str,
+    lua_map: Mapping[str, bytes],
+    session: Optional[LuaSession] = None,
+    processes: int = 1,
+) -> dict[str, str]:
+    """
+    Dumps the localization of every language to dst/{lang}, in session by default.
+    With processes > 1, the languages are exported in parallel by a process pool instead,
+    every worker runs its own Lua VM and passes its files back in one piece, session is unused then.
+
+    Args:
+        dst (str | DumpSink): The directory or archive to dump to.
+        slua_fp (str): The path of the slua library.
+        lua_map (Mapping[str, bytes]): The lua scripts of the game.
+        session (Optional[LuaSession]): The VM to use for a serial export, a new one if None.
+        processes (int): The number of worker processes, 1 to export in session.
+
+    Returns:
+        dict[str, str]: The error message of every language that failed.
+    """
+    languages: dict[str, list[str]] = {}
+    for key in lua_map:
+        if key.startswith("dblang_"):
+            languages.setdefault(key.split("/", 1)[0].split("_", 1)[1], []).append(key)
+
+    errors: dict[str, str] = {}
+    with sink_for(dst) as sink:
+        if processes <= 1 or len(languages) <= 1:
+            with session_for(slua_fp, lua_map, session) as session:
+                session.set_exporter(json_table_writer(sink))
+                try:
+                    # one run per language, so that a failing language doesn't stop the other ones
+                    for lang, keys in languages.items():
+                        try:
+                            session.run(localization_code(keys))
+                        except Exception as e:
+                            print(f"Failed to export the localization {lang}: {e}")
+                            errors[lang] = str(e)
+                finally:
+                    session.set_exporter(None)
+            return errors
+
+        # the workers only get the scripts they need, overrides of the shared modules included
+        shared = {name: lua_map[name] for name in KEEP_MODULES if name in lua_map}
+        workers = min(processes, len(languages))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for lang, keys in languages.items():
+                scripts = {**shared, **{key: lua_map[key] for key in keys}}
+                futures[lang] = pool.submit(dump_localization_language, slua_fp, scripts)
+            for lang, future in futures.items():
+                try:
+                    files, error = future.result()
+                except Exception as e:
+                    files, error = {}, str(e)
+                for name, data in files.items():
+                    sink.write(name, data)
+                if error:
+                    print(f"Failed to export the localization {lang}: {error}")
+                    errors[lang] = error
+        return errors
+
+
+def dump_localization_language(slua_fp: str, lua_map: dict[str, bytes]) -> tuple[dict[str, bytes], Optional[str]]:
+    # runs in a worker process, a failing language mustn't affect the other ones
+    keys = [key for key in lua_map if key.startswith("dblang_")]
+    sink = MemorySink()
+    try:
+        with LuaSession(slua_fp, lua_require_unitypy(lua_map)) as session:
+            session.set_exporter(json_table_writer(sink))
+            session.run(localization_code(keys))
+    except Exception as e:
+        return sink.files, str(e)
+    return sink.files, None
+
+
+def localization_code(keys: list[str]) -> str:
+    dump_code_init = """
     function export_loc(loc_key)
         local success, func = pcall(loadfile, loc_key)
         if not success or not func then
             return
         end
         local trans_datas = func()
-        local loc_table = {{}}
+        local loc_table = {}
         for index, value in ipairs(trans_datas) do
             local id = value[1]
             local key = value[2]
             local val = value[3]
             if loc_table[id] == nil then
-                loc_table[id] = {{}}
+                loc_table[id] = {}
             end
             loc_table[id][key] = val
         end
-        local string = neatjson(loc_table,  json_options)
-        local fp = EXPORT_DIR .. "/" .. loc_key:sub(8) .. ".json"
-        local file = io.open(fp, "w")
-        file:write(string)
-        file:close()
+        -- converted and written by python
+        python.export_table(loc_key:sub(8), loc_table)
     end
     """
     export_call_template = 'export_loc("{0}")'
-    lines = [export_call_template.format(key) for key in lua_map if key.startswith("dblang_")]
-    langs = set(key.split("/", 1)[0].split("_", 1)[1] for key in lua_map if key.startswith("dblang_"))
-    for lang in langs:
-        os.makedirs(os.path.join(dst, lang), exist_ok=True)
+    lines = [export_call_template.format(key) for key in keys]
+    return "\n".join([dump_code_init, *lines])
 
-    handler = LuaHandler(slua_fp)
-    handler.register_package_loader(lua_require_unitypy(lua_map))
-    handler.loadstring("\n".join([dump_code_init, *lines]))
-    if handler.pcall(0, 1, 0):
-        err_msg = handler.tolstring(-1)
-        print("Error executing Lua script:", err_msg)
 
-    del handler
+@contextmanager
+def session_for(slua_fp: str, lua_map: Mapping[str, bytes], session: Optional[LuaSession]) -> Iterator[LuaSession]:
+    # a given session is reset and reused, otherwise a new one is used for this dump only
+    if session is None:
+        with LuaSession(slua_fp, lua_require_unitypy(lua_map)) as session:
+            yield session
+    else:
+        session.reset()
+        session.set_loader(lua_require_unitypy(lua_map))
+        yield session
 
 
 def dump_database_n_localization(
-    dst: str,
+    dst: "str | DumpSink",
     slua_fp: str,
     asset_dir: str,
-    lua_map: dict[str, bytes],
+    lua_map: Mapping[str, bytes],
     loc: str = "none",
     operating_area: Literal["none", "cn", "tw", "jp", "kr", "us"] = "none",
-) -> None:
-    db_dst = os.path.join(dst, "db")
+    session: Optional[LuaSession] = None,
+    assets: Optional[Mapping[str, bytes]] = None,
+    processes: int = 1,
+) -> dict[str, str]:
+    # returns the errors of the localization, see dump_localization
+    with sink_for(dst) as sink, session_for(slua_fp, lua_map, session) as session:
+        dump_database(sink.child("db"), slua_fp, asset_dir, lua_map, loc, operating_area, session, assets)
+        return dump_localization(sink, slua_fp, lua_map, session, processes)
+
+
+def dump_database_variants(
+    dst: "str | DumpSink",
+    slua_fp: str,
+    asset_dir: str,
+    lua_map: Mapping[str, bytes],
+    variants: list[tuple[str, str]],
+    assets: Optional[Mapping[str, bytes]] = None,
+    processes: int = 1,
+) -> dict[str, str]:
+    """
+    Dumps the database for several localisation/area combinations and the localization once,
+    all in a single Lua VM that is reset in between.
+
+    Args:
+        dst (str | DumpSink): The directory or archive to dump to,
+            a single variant is stored in db, several ones in db_{loc}_{area}.
+        slua_fp (str): The path of the slua library.
+        asset_dir (str): The directory holding db_lua.bytes.
+        lua_map (Mapping[str, bytes]): The lua scripts of the game.
+        variants (list[tuple[str, str]]): The (loc, area) combinations to dump.
+        assets (Optional[Mapping[str, bytes]]): The files of asset_dir by name, to serve them from memory.
+        processes (int): The number of processes exporting the localization, see dump_localization.
+
+    Returns:
+        dict[str, str]: The error message of every language of the localization that failed.
+    """
+    if len(variants) == 1:
+        loc, operating_area = variants[0]
+        # any area string is passed on to the scripts
+        area: Any = operating_area
+        return dump_database_n_localization(dst, slua_fp, asset_dir, lua_map, loc, area, None, assets, processes)
+
+    with sink_for(dst) as sink, LuaSession(slua_fp, lua_require_unitypy(lua_map)) as session:
+        for loc, operating_area in variants:
+            print(f"Dumping the database for {loc}/{operating_area}...")
+            db_sink = sink.child(f"db_{loc}_{operating_area}")
+            dump_database(db_sink, slua_fp, asset_dir, lua_map, loc, operating_area, session, assets)  # type: ignore
+        return dump_localization(sink, slua_fp, lua_map, session, processes)
+
 
-    dump_database(db_dst, slua_fp, asset_dir, lua_map, loc, operating_area)
-    dump_localization(dst, slua_fp, lua_map)
+def database_variants(loc: "str | Sequence[str]", operating_area: "str | Sequence[str]") -> list[tuple[str, str]]:
+    # fire passes comma separated values as tuples
+    locs = [loc] if isinstance(loc, str) else list(loc)
+    areas = [operating_area] if isinstance(operating_area, str) else list(operating_area)
+    return list(product(locs, areas))
 
 
 def dump_database_from_game(
     game_dir: str,
     dst_dir: str,
-    loc: str = "none",
-    operating_area: Literal["none", "cn", "tw", "jp", "kr", "us"] = "none",
-) -> None:
+    loc: "str | Sequence[str]" = "none",
+    operating_area: "str | Sequence[str]" = "none",
+    processes: int = 1,
+) -> dict[str, str]:
+    # returns the errors of the localization, see dump_localization
     slua_fp = os.path.join(game_dir, "SoC_Data", "Plugins", "x86_64", "slua.dll")
     # slua_fp = r"D:\Projects\SoC\lu2\build_win\Release\xdlua.dll"
     assets_fp = os.path.join(game_dir, "assets")
 
     print("Loading lua files from assets...")
-    lua_map: dict[str, bytes] = {}
     unity_lua_dir = os.path.join(assets_fp, "lua")
-    for file in os.listdir(unity_lua_dir):
-        lua_dir = file[4:-8]
-        if len(lua_dir) > 0:
-            lua_dir = f"{lua_dir}/"
-        env = UnityPy.load(os.path.join(unity_lua_dir, file))  # type: ignore
-        for obj in env.objects:
-            if obj.type.name == "TextAsset":
-                ta: TextAsset = obj.read()  # type: ignore
-                key = f"{lua_dir}{ta.m_Name}"
-                script = ta.m_Script
-                if isinstance(script, str):
-                    script = script.encode("utf-8", "surrogateescape")
-                lua_map[key] = bytes(decrypt_textasset_data(script))  # type: ignore
-
-    dump_database_n_localization(dst_dir, slua_fp, assets_fp, lua_map, loc, operating_area)
+    files = os.listdir(unity_lua_dir)
+    fps = [os.path.join(unity_lua_dir, file) for file in files]
+    # bundles are only parsed once a script of them is required
+    with LazyLuaMap.from_files(fps, [file[4:-8] for file in files], LuaScriptCache.default()) as lua_map:
+        variants = database_variants(loc, operating_area)
+        return dump_database_variants(dst_dir, slua_fp, assets_fp, lua_map, variants, None, processes)
 
 
 def dump_database_from_server(
     handler: "AssetAPIHandler",
     dst_dir: str,
-    loc: str = "none",
-    operating_area: Literal["none", "cn", "tw", "jp", "kr", "us"] = "none",
-) -> None:
+    loc: "str | Sequence[str]" = "none",
+    operating_area: "str | Sequence[str]" = "none",
+    processes: int = 1,
+) -> dict[str, str]:
+    # returns the errors of the localization, see dump_localization
     temp_dir = TemporaryDirectory()
     try:
         print("Fetching game files...")
@@ -211,50 +452,122 @@ def dump_database_from_server(
                     script = ta.m_Script
                     if isinstance(script, str):
                         script = script.encode("utf-8", "surrogateescape")
-                    db_lua_bytes = bytes(script)  # type: ignore
-                    with open(os.path.join(temp_dir.name, "db_lua.bytes"), "wb") as f:
-                        f.write(db_lua_bytes)
+                    # served to the scripts from memory
+                    assets = {"db_lua.bytes": bytes(script)}  # type: ignore
                     break
         else:
             raise ValueError("db_lua.bytes not found in db_template")
 
         # collect all lua files
         print("Loading lua files from directly downloaded assets...")
-        lua_map: dict[str, bytes] = {}
-        for key, value in asset_md5.items():
-            if key.startswith("lua/"):
-                lua_dir = key.split("/", 1)[1][4:]
-                if len(lua_dir) > 0:
-                    lua_dir = f"{lua_dir}/"
-                raw = handler.get_unity_asset(key, value["md5"])
-                env = UnityPy.load(raw)  # type: ignore
-                for obj in env.objects:
-                    if obj.type.name == "TextAsset":
-                        ta: TextAsset = obj.read()  # type: ignore
-                        key = f"{lua_dir}{ta.m_Name}"
-                        script = ta.m_Script
-                        if isinstance(script, str):
-                            script = script.encode("utf-8", "surrogateescape")
-                        lua_map[key] = bytes(decrypt_textasset_data(script))  # type: ignore
-
-        dump_database_n_localization(dst_dir, slua_fp, temp_dir.name, lua_map, loc, operating_area)
-    except Exception as e:
-        print(f"Error: {e}")
+        with LazyLuaMap.from_server(handler, asset_md5, LuaScriptCache.default()) as lua_map:
+            variants = database_variants(loc, operating_area)
+            return dump_database_variants(dst_dir, slua_fp, VIRTUAL_ASSET_DIR, lua_map, variants, assets, processes)
     finally:
         gc.collect()
         temp_dir.cleanup()
 
 
-def decrypt_textasset_data(enc: bytes) -> bytearray:
-    dec_k = bytearray([23, 241, 195, 85, 120, 100, 57, 64, 66, 119, 89, 18, 51, 203, 123, 185, 53])
-    return bytearray([enc[0] ^ 53, *[e ^ k for e, k in zip(enc[1:], cycle(dec_k))]])
+def load_lua_bundle(src: "bytes | str", lua_dir: str) -> dict[str, bytes]:
+    """
+    Loads the decrypted lua scripts of a lua bundle.
+    Only takes picklable arguments, so that it can run in a process pool.
+
+    Args:
+        src (bytes | str): The raw bundle or its path.
+        lua_dir (str): The directory of the scripts, the name of the bundle without lua_ prefix.
+
+    Returns:
+        dict[str, bytes]: {lua_dir}/{name} -> decrypted script.
+    """
+    if len(lua_dir) > 0:
+        lua_dir = f"{lua_dir}/"
+    scripts: dict[str, bytes] = {}
+    env = UnityPy.load(src)  # type: ignore
+    for obj in env.objects:
+        if obj.type.name == "TextAsset":
+            ta: TextAsset = obj.read()  # type: ignore
+            script = ta.m_Script
+            if isinstance(script, str):
+                script = script.encode("utf-8", "surrogateescape")
+            scripts[f"{lua_dir}{ta.m_Name}"] = xor_textasset_data(script)  # type: ignore
+    return scripts
+
+
+def load_lua_bundles(
+    fps: list[str],
+    lua_dirs: list[str],
+    processes: Optional[int] = None,
+    use_cache: bool = True,
+) -> list[dict[str, bytes]]:
+    """
+    Loads the decrypted lua scripts of local lua bundles, bundles that changed since the last run are
+    parsed by a process pool.
+
+    Args:
+        fps (list[str]): The paths of the bundles.
+        lua_dirs (list[str]): The directories of the scripts of the bundles, see load_lua_bundle.
+        processes (Optional[int]): The number of parsing processes, defaults to the number of cores.
+        use_cache (bool): Use the decrypted script cache, unless caching is disabled via MOC_UTILS_NO_CACHE.
+
+    Returns:
+        list[dict[str, bytes]]: The scripts of each bundle.
+    """
+    script_cache = LuaScriptCache.default() if use_cache else None
+    bundle_keys = [local_bundle_key(fp) for fp in fps]
+    results = [script_cache.get(bundle_key) if script_cache is not None else None for bundle_key in bundle_keys]
+    missing = [i for i, scripts in enumerate(results) if scripts is None]
+    if missing:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+            loaded = pool.map(load_lua_bundle, [fps[i] for i in missing], [""] * len(missing))
+            for i, scripts in zip(missing, loaded):
+                results[i] = scripts
+                if script_cache is not None:
+                    script_cache.put(bundle_keys[i], scripts)
+
+    if script_cache is not None:
+        with script_cache:
+            script_cache.save(current=bundle_keys)
+        print(f"Lua script cache: {script_cache.hits} bundles cached, {script_cache.misses} loaded.")
+    # the cache stores the names without directory, so that it doesn't depend on the caller
+    return [prefix_scripts(scripts, lua_dir) for scripts, lua_dir in zip(results, lua_dirs)]  # type: ignore
+
+
+def prefix_scripts(scripts: dict[str, bytes], lua_dir: str) -> dict[str, bytes]:
+    if len(lua_dir) == 0:
+        return scripts
+    return {f"{lua_dir}/{name}": script for name, script in scripts.items()}
+
+
+def xor_textasset_data(data: "bytes | bytearray | memoryview") -> bytes:
+    """
+    XORs the data with the key stream of the lua TextAssets, which en- as well as decrypts them.
+
+    The whole buffer is XORed at once as a single big integer instead of byte by byte,
+    memoryviews are read without copying them first.
+    """
+    size = len(data)
+    if size <= len(TEXTASSET_KEY_STREAM):
+        key_stream = memoryview(TEXTASSET_KEY_STREAM)[:size]
+    else:
+        key_stream = (TEXTASSET_KEY * (size // len(TEXTASSET_KEY) + 1))[:size]
+    return (int.from_bytes(data, "little") ^ int.from_bytes(key_stream, "little")).to_bytes(size, "little")
+
+
+def decrypt_textasset_data(enc: "bytes | bytearray | memoryview") -> bytearray:
+    return bytearray(xor_textasset_data(enc))
+
+
+def encrypt_textasset_data(dec: "bytes | bytearray | memoryview") -> bytearray:
+    return bytearray(xor_textasset_data(dec))
 
 
 def extract_scripts(game_fp: str, dst_fp: str, game_lua_fp: Optional[str] = None) -> None:
     if game_lua_fp is None:
         game_lua_fp = os.path.join(game_fp, "assets", "lua")
     unity_asset_fps = [os.path.join(root, file) for root, _dirs, files in os.walk(game_lua_fp) for file in files]
-    for i, unity_asset_fp in enumerate(unity_asset_fps):
+    bundles = load_lua_bundles(unity_asset_fps, [""] * len(unity_asset_fps))
+    for i, (unity_asset_fp, scripts) in enumerate(zip(unity_asset_fps, bundles)):
         print(f"Extracting {i + 1}/{len(unity_asset_fps)}: {unity_asset_fp}")
         name = os.path.basename(unity_asset_fp)
         if name.startswith("lua_"):
@@ -263,16 +576,9 @@ def extract_scripts(game_fp: str, dst_fp: str, game_lua_fp: Optional[str] = None
             name = name[:-8]
 
         exp_dir = os.path.join(dst_fp, name)
-        env = UnityPy.load(unity_asset_fp)  # type: ignore
-        for obj in env.objects:
-            if obj.type.name != "TextAsset":
-                continue
-            ta: TextAsset = obj.read()  # type: ignore
-            print("", ta.m_Name)
+        for script_name, script in scripts.items():
+            print("", script_name)
 
             os.makedirs(exp_dir, exist_ok=True)
-            with open(os.path.join(exp_dir, f"{ta.m_Name}.lua"), "wb") as f:
-                script = ta.m_Script
-                if isinstance(script, str):
-                    script = script.encode("utf-8", "surrogateescape")
-                f.write(decrypt_textasset_data(ta.m_Script))  # type: ignore
+            with open(os.path.join(exp_dir, f"{script_name}.lua"), "wb") as f:
+                f.write(script)
@@ -1,9 +1,150 @@
 import _ctypes
 import ctypes
 import os
+from typing import Any
 from typing import Callable
+from typing import Optional
+
+from .chunk_cache import LuaChunkCache
+from .chunk_cache import chunk_key
 
 lua_CFunction = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p)  # noqa: N816
+# int (*lua_Writer) (lua_State *L, const void* p, size_t sz, void* ud);
+lua_Writer = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p)  # noqa: N816
+
+# lua_tolstring returning the pointer, as the declared c_char_p return type stops at null bytes
+lua_tolstring_ptr = ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_size_t))
+
+# replaces io.open and io.lines by versions that ask python first, see LuaHandler.register_io_handler
+IO_CODE = """
+local real_open = io.open
+local real_lines = io.lines
+
+local function memory_reader(content)
+    local pos = 1
+    local file = {}
+    function file:read(fmt)
+        fmt = fmt or "*l"
+        if type(fmt) == "number" then
+            if pos > #content then
+                return nil
+            end
+            local s = content:sub(pos, pos + fmt - 1)
+            pos = pos + fmt
+            return s
+        end
+        local kind = fmt:sub(1, 2)
+        if kind == "*a" then
+            local s = content:sub(pos)
+            pos = #content + 1
+            return s
+        elseif kind == "*l" then
+            if pos > #content then
+                return nil
+            end
+            local e = content:find("\\n", pos, true)
+            local line
+            if e then
+                line = content:sub(pos, e - 1)
+                pos = e + 1
+            else
+                line = content:sub(pos)
+                pos = #content + 1
+            end
+            return line
+        elseif kind == "*n" then
+            local s, e = content:find("^%s*[-+]?%d*%.?%d+[eE]?[-+]?%d*", pos)
+            if not s then
+                return nil
+            end
+            pos = e + 1
+            return tonumber(content:sub(s, e))
+        end
+        error("bad argument #1 to 'read' (invalid format)")
+    end
+    function file:lines()
+        return function()
+            return file:read("*l")
+        end
+    end
+    function file:seek(whence, offset)
+        local base = ({set = 0, cur = pos - 1, ["end"] = #content})[whence or "cur"]
+        pos = base + (offset or 0) + 1
+        return pos - 1
+    end
+    function file:write()
+        return nil, "file not opened for writing"
+    end
+    function file:close()
+        return true
+    end
+    return file
+end
+
+local function buffered_writer(filename)
+    local parts = {}
+    local file = {}
+    function file:write(...)
+        for i = 1, select("#", ...) do
+            parts[#parts + 1] = tostring((select(i, ...)))
+        end
+        return file
+    end
+    function file:flush()
+        return true
+    end
+    function file:setvbuf()
+        return true
+    end
+    function file:close()
+        python.io_write(filename, table.concat(parts))
+        parts = {}
+        return true
+    end
+    return file
+end
+
+-- virtual files are either read only or write only, appending or updating them isn't supported
+io.open = function(filename, mode)
+    mode = mode or "r"
+    local access = python.io_access(filename)
+    if access == nil then
+        return real_open(filename, mode)
+    end
+    if access == "r" and mode:match("^rb?$") then
+        local content = python.io_read(filename)
+        if content == nil then
+            return nil, filename .. ": No such file or directory"
+        end
+        return memory_reader(content)
+    elseif access == "w" and mode:match("^wb?$") then
+        return buffered_writer(filename)
+    end
+    error("io.open: mode '" .. mode .. "' isn't supported for the virtual file " .. filename, 2)
+end
+
+io.lines = function(filename)
+    if filename == nil then
+        return real_lines()
+    end
+    local access = python.io_access(filename)
+    if access == nil then
+        return real_lines(filename)
+    end
+    local content = access == "r" and python.io_read(filename) or nil
+    if content == nil then
+        error(filename .. ": No such file or directory", 2)
+    end
+    return memory_reader(content):lines()
+end
+"""
+
+# basic types of lua.h
+LUA_TNIL = 0
+LUA_TBOOLEAN = 1
+LUA_TNUMBER = 3
+LUA_TSTRING = 4
+LUA_TTABLE = 5
 
 
 class luaL_Reg(ctypes.Structure):  # noqa: N801
@@ -17,14 +158,21 @@ class LuaHandler:
     fp: str
     lua: ctypes.CDLL
     state: ctypes.c_void_p
+    callbacks: list[ctypes._CFuncPtr]  # type: ignore
+    export_errors: list[tuple[str, Exception]]
+    tolstring_ptr: Callable[..., Optional[int]]
 
     def __init__(self, fp: str) -> None:
         self.fp = fp
+        # the registered python functions have to outlive their registration
+        self.callbacks = []
+        self.export_errors = []
         if os.name == "nt":
             self.lua = ctypes.WinDLL(fp)
         else:
             raise NotImplementedError("TODO: compile slua with necessary modifications for non-windows")
         register_lua_functions(self.lua)
+        self.tolstring_ptr = lua_tolstring_ptr(("lua_tolstring", self.lua))
         self.newstate()
         self.openlibs()
 
@@ -38,7 +186,7 @@ class LuaHandler:
         if err:
             err_msg = self.tolstring(-1)
             print(f"Error {err} executing Lua script:", err_msg)
-            raise Exception("Failed to load string")
+            raise Exception(f"Failed to load string: {err_msg}")
 
     def newstate(self) -> None:
         self.state = self.lua.luaL_newstate()
@@ -83,7 +231,58 @@ class LuaHandler:
             return ""
         return value.decode("utf-8")
 
-    def register_package_loader(self, loader: Callable[[str], bytes]) -> None:
+    def dump(self, l_state: Optional[ctypes.c_void_p] = None) -> bytes:
+        """Returns the bytecode of the function on top of the stack."""
+        parts: list[bytes] = []
+
+        @lua_Writer
+        def writer(_l_state: ctypes.c_void_p, p: ctypes.c_void_p, sz: int, _ud: ctypes.c_void_p) -> int:
+            parts.append(ctypes.string_at(p, sz))
+            return 0
+
+        err = self.lua.lua_dump(l_state or self.state, writer, None)
+        if err:
+            raise Exception(f"Failed to dump chunk: {err}")
+        return b"".join(parts)
+
+    def load_chunk(
+        self, l_state: ctypes.c_void_p, source: bytes, name: str, chunk_cache: Optional[LuaChunkCache] = None
+    ) -> int:
+        """
+        Compiles source and pushes the function, or the error message, onto the stack.
+        With a chunk cache, the cached bytecode of the source is loaded instead,
+        and newly compiled chunks are added to the cache.
+
+        Args:
+            l_state (ctypes.c_void_p): The state to push the function onto.
+            source (bytes): The source, or bytecode, of the chunk.
+            name (str): The name of the chunk.
+            chunk_cache (Optional[LuaChunkCache]): The cache of compiled chunks.
+
+        Returns:
+            int: The error code of luaLS_loadbuffer, 0 on success.
+        """
+        name_c = name.encode("utf-8")
+        if chunk_cache is None:
+            return self.lua.luaLS_loadbuffer(l_state, source, len(source), name_c)
+
+        key = chunk_key(name, source)
+        chunk = chunk_cache.get(key)
+        if chunk is not None:
+            if not self.lua.luaLS_loadbuffer(l_state, chunk, len(chunk), name_c):
+                return 0
+            # e.g. written by a different build of the library
+            self.lua.lua_settop(l_state, -2)
+            chunk_cache.discard(key)
+
+        err = self.lua.luaLS_loadbuffer(l_state, source, len(source), name_c)
+        if not err:
+            chunk_cache.put(key, self.dump(l_state))
+        return err
+
+    def register_package_loader(
+        self, loader: Callable[[str], bytes], chunk_cache: Optional[LuaChunkCache] = None
+    ) -> None:
         @lua_CFunction
         def loader_handler(l_state: ctypes.c_void_p) -> int:
             c_size_t = ctypes.c_size_t()
@@ -91,9 +290,13 @@ class LuaHandler:
             filename = value.decode("utf-8")
             raw = loader(filename)
             if raw:
-                self.lua.lua_pushlstring(l_state, raw, len(raw))
+                # pushes the compiled module, or the compile error
+                self.load_chunk(l_state, raw, filename, chunk_cache)
+            else:
+                self.lua.lua_pushnil(l_state)
             return 1
 
+        self.callbacks.append(loader_handler)
         # Register the loader handler function
         functions = [
             luaL_Reg(
@@ -107,12 +310,13 @@ class LuaHandler:
         self.loadstring(
             """
             loadfile = function(modulename)
-                print("Loading module", modulename)
-                -- call python
+                -- call python, which compiles the module, or loads its cached bytecode
                 local result = python.loader(modulename)
-                if type(result) == "string" and #result > 0 then
-                    -- Compile and return the module
-                    return assert(loadstring(result, modulename))
+                if type(result) == "function" then
+                    return result
+                end
+                if type(result) == "string" then
+                    error(result)
                 end
                 return "Failed to load module " .. modulename .. " from Python"
             end
@@ -122,46 +326,168 @@ class LuaHandler:
         )
         self.pcall(0, 0, 0)
 
-    # def register_io_handler(self, handler):
-    #     # io:open(filename, mode) -> file
-    #     # io.open(Util.MakePath(name), "rb", "r"
-    #     # file:read(*all, *a) -> string?
-    #     # file:close
-    #     # file:lines() -> string[]
-    #     # file:gsub
-    #     # file:find
-    #     # file:write(str)
-    #     self.loadstring(
-    #         """
-    #     io:open = function(filename, mode)
-    #         ref = python.io_open(filename, mode)
-    #         if ref == nil then
-    #             return nil
-    #         end
-    #         local file = {}
-    #         file.ref = ref
-    #         file.read = function(self, ...)
-    #             return python.io_read(self.ref, ...)
-    #         end
-    #         file.close = function(self)
-    #             python.io_close(self.ref)
-    #         end
-    #         file.lines = function(self)
-    #             return python.io_lines(self.ref)
-    #         end
-    #         file.write = function(self, str)
-    #             python.io_write(self.ref, str)
-    #         end
-    #         file.gsub = function(self, ...)
-    #             return python.io_gsub(self.ref, ...)
-    #         end
-    #         file.find = function(self, ...)
-    #             return python.io_find(self.ref, ...)
-    #         end
-    #         return file
-    #     end
-    #     """
-    #     )
+    def to_python(self, idx: int = -1, l_state: Optional[ctypes.c_void_p] = None) -> Any:
+        """
+        Converts the value at idx of the stack to a python object, the stack is left as it was.
+        Tables become dicts sorted by key, numbers first, or lists if their keys are 1..n.
+        Integral numbers become ints, functions, userdata and threads become None.
+        Tables referenced several times are converted once and shared.
+
+        Args:
+            idx (int): The stack index of the value.
+            l_state (Optional[ctypes.c_void_p]): The state to read from, defaults to the main state.
+
+        Returns:
+            Any: The converted value.
+
+        Raises:
+            ValueError: If a table contains itself.
+        """
+        l_state = l_state or self.state
+        top = self.lua.lua_gettop(l_state)
+        if idx < 0:
+            idx = top + idx + 1
+        try:
+            return self._to_python(l_state, idx, set(), {})
+        finally:
+            self.lua.lua_settop(l_state, top)
+
+    def _to_python(self, l_state: ctypes.c_void_p, idx: int, path: set[int], memo: dict[int, Any]) -> Any:
+        lua = self.lua
+        kind = lua.lua_type(l_state, idx)
+        if kind == LUA_TNUMBER:
+            return lua_number(lua.lua_tonumber(l_state, idx))
+        if kind == LUA_TSTRING:
+            return self._tostring(l_state, idx)
+        if kind == LUA_TBOOLEAN:
+            return bool(lua.lua_toboolean(l_state, idx))
+        if kind != LUA_TTABLE:
+            return None
+
+        ptr: int = lua.lua_topointer(l_state, idx)
+        if ptr in memo:
+            return memo[ptr]
+        if ptr in path:
+            raise ValueError("Lua table contains itself")
+        if not lua.lua_checkstack(l_state, 2):
+            raise MemoryError("Lua stack overflow")
+        path.add(ptr)
+
+        items: list[tuple[Any, Any]] = []
+        lua.lua_pushnil(l_state)
+        key_idx = lua.lua_gettop(l_state)
+        while lua.lua_next(l_state, idx):
+            # keys of other types are skipped, like neatjson does
+            key_kind = lua.lua_type(l_state, key_idx)
+            if key_kind in (LUA_TNUMBER, LUA_TSTRING):
+                key = self._to_python(l_state, key_idx, path, memo)
+                items.append((key, self._to_python(l_state, key_idx + 1, path, memo)))
+            # pops the value, keeps the key for lua_next
+            lua.lua_settop(l_state, key_idx)
+
+        path.discard(ptr)
+        memo[ptr] = value = table_to_python(items)
+        return value
+
+    def _tostring(self, l_state: ctypes.c_void_p, idx: int) -> str:
+        return self._tobytes(l_state, idx).decode("utf-8", "replace")
+
+    def _tobytes(self, l_state: ctypes.c_void_p, idx: int) -> bytes:
+        c_size_t = ctypes.c_size_t()
+        ptr = self.tolstring_ptr(l_state, idx, ctypes.byref(c_size_t))
+        return ctypes.string_at(ptr, c_size_t.value) if ptr else b""
+
+    def register_table_exporter(self, exporter: Callable[[str, Any], None]) -> None:
+        """
+        Registers python.export_table(name, table), which converts the table via to_python
+        and passes it to exporter. Errors can't be raised through the VM, so they are collected
+        in export_errors for the caller to raise once the code returned.
+        """
+
+        @lua_CFunction
+        def export_handler(l_state: ctypes.c_void_p) -> int:
+            name = self._tostring(l_state, 1)
+            try:
+                exporter(name, self.to_python(2, l_state))
+            except Exception as e:
+                self.export_errors.append((name, e))
+            return 0
+
+        self.callbacks.append(export_handler)
+        self.register([luaL_Reg(name="export_table".encode("utf-8") + b"\x00", func=export_handler)], "python")
+
+    def register_io_handler(
+        self,
+        access: Callable[[str], Optional[str]],
+        read: Callable[[str], Optional[bytes]],
+        write: Callable[[str, bytes], None],
+    ) -> None:
+        """
+        Backs io.open and io.lines by python.
+        Files that access marks as "r" are read from memory, files it marks as "w" are buffered in Lua
+        and passed to write in one piece on close, every other file uses the real io.
+        Other modes of the virtual files raise a Lua error.
+        Errors of write are collected in export_errors, like the ones of the exporter.
+
+        Args:
+            access (Callable[[str], Optional[str]]): "r" or "w" for virtual files, None for real ones.
+            read (Callable[[str], Optional[bytes]]): Returns the content of a virtual file, None if it doesn't exist.
+            write (Callable[[str, bytes], None]): Receives the content of a written file.
+        """
+
+        @lua_CFunction
+        def read_handler(l_state: ctypes.c_void_p) -> int:
+            data = read(self._tostring(l_state, 1))
+            if data is None:
+                self.lua.lua_pushnil(l_state)
+            else:
+                self.lua.lua_pushlstring(l_state, data, len(data))
+            return 1
+
+        @lua_CFunction
+        def access_handler(l_state: ctypes.c_void_p) -> int:
+            mode = access(self._tostring(l_state, 1))
+            if mode is None:
+                self.lua.lua_pushnil(l_state)
+            else:
+                self.lua.lua_pushstring(l_state, mode.encode("utf-8"))
+            return 1
+
+        @lua_CFunction
+        def write_handler(l_state: ctypes.c_void_p) -> int:
+            name = self._tostring(l_state, 1)
+            try:
+                write(name, self._tobytes(l_state, 2))
+            except Exception as e:
+                self.export_errors.append((name, e))
+            return 0
+
+        handlers = {"io_access": access_handler, "io_read": read_handler, "io_write": write_handler}
+        self.callbacks.extend(handlers.values())
+        self.register(
+            [luaL_Reg(name=name.encode("utf-8") + b"\x00", func=func) for name, func in handlers.items()], "python"
+        )
+        self.loadstring(IO_CODE)
+        self.pcall(0, 0, 0)
+
+
+def lua_number(value: float) -> "int | float":
+    # lua 5.1 only has doubles
+    return int(value) if value.is_integer() else value
+
+
+def table_to_python(items: list[tuple[Any, Any]]) -> "dict[Any, Any] | list[Any]":
+    # empty tables become lists, like neatjson writes them
+    if not items:
+        return []
+    n = len(items)
+    if all(type(key) is int and 1 <= key <= n for key, _ in items) and len({key for key, _ in items}) == n:
+        values: list[Any] = [None] * n
+        for key, value in items:
+            values[key - 1] = value
+        return values
+    items.sort(key=lambda item: (isinstance(item[0], str), item[0]))
+    return dict(items)
 
 
 def register_lua_functions(lua: ctypes.CDLL) -> None:
@@ -198,8 +524,8 @@ def register_lua_functions(lua: ctypes.CDLL) -> None:
     ]
 
     # int lua_dump (lua_State *L, lua_Writer writer, void *data)
-    # lua.lua_dump.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
-    # lua.lua_dump.restype = ctypes.c_int
+    lua.lua_dump.argtypes = [ctypes.c_void_p, lua_Writer, ctypes.c_void_p]
+    lua.lua_dump.restype = ctypes.c_int
 
     # lua.luaZ_read.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_size_t]
     # lua.luaZ_read.restype = ctypes.c_size_t
@@ -228,6 +554,36 @@ def register_lua_functions(lua: ctypes.CDLL) -> None:
     lua.lua_pushinteger.argtypes = [ctypes.c_void_p, ctypes.c_int]
     lua.lua_pushinteger.restype = None
 
+    lua.lua_pushnil.argtypes = [ctypes.c_void_p]
+    lua.lua_pushnil.restype = None
+
+    lua.lua_settop.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lua.lua_settop.restype = None
+
+    lua.lua_gettop.argtypes = [ctypes.c_void_p]
+    lua.lua_gettop.restype = ctypes.c_int
+
+    lua.lua_checkstack.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lua.lua_checkstack.restype = ctypes.c_int
+
+    lua.lua_type.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lua.lua_type.restype = ctypes.c_int
+
+    lua.lua_next.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lua.lua_next.restype = ctypes.c_int
+
+    lua.lua_tonumber.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lua.lua_tonumber.restype = ctypes.c_double
+
+    lua.lua_toboolean.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lua.lua_toboolean.restype = ctypes.c_int
+
+    lua.lua_topointer.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lua.lua_topointer.restype = ctypes.c_void_p
+
+    lua.lua_pushboolean.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lua.lua_pushboolean.restype = None
+
     lua.lua_pushstring.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
     lua.lua_pushstring.restype = None
 
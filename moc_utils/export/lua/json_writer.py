@@ -0,0 +1,27 @@
+import json
+import math
+from typing import Any
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+
+def dumps(data: Any) -> bytes:
+    """Serializes data as indented json, with orjson if it's installed."""
+    if orjson is not None:
+        # writes NaN and infinities as null
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)  # type: ignore
+    return json.dumps(finite(data), indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def finite(data: Any) -> Any:
+    # replaces NaN and infinities by None, as orjson does, instead of the invalid json NaN and Infinity
+    if isinstance(data, float):
+        return data if math.isfinite(data) else None
+    if isinstance(data, dict):
+        return {key: finite(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [finite(value) for value in data]
+    return data
@@ -0,0 +1,264 @@
+import concurrent.futures
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from tempfile import TemporaryDirectory
+from typing import TYPE_CHECKING
+from typing import Iterator
+from typing import Mapping
+from typing import Optional
+
+import UnityPy
+
+from ... import net
+from .script_cache import LuaScriptCache
+from .script_cache import local_bundle_key
+from .script_cache import remote_bundle_key
+
+if TYPE_CHECKING:
+    from moc_utils.asset_api import AssetAPIHandler
+    from moc_utils.asset_api import AssetMd5
+
+# number of parsed bundles kept in memory
+DEFAULT_MAX_BUNDLES = 8
+
+
+@dataclass
+class LuaBundle:
+    key: str  # key of the bundle in the script cache
+    lua_dir: str
+    fp: str  # path of the bundle, remote bundles are downloaded there on demand
+    names: Optional[list[str]]  # names of the scripts, without lua_dir, None until it's indexed
+    asset: Optional[tuple[str, str, int]] = None  # key, md5 and size of a remote bundle that isn't downloaded yet
+
+
+class LazyLuaMap(Mapping[str, bytes]):
+    """
+    A lua_map that only knows which bundle holds which script up front.
+
+    Building the map only reads the names of the scripts of bundles missing in the script cache.
+    A bundle is parsed and decrypted the first time one of its scripts is requested and put into the script cache
+    right away, only the scripts of the last max_bundles requested bundles are kept in memory.
+
+    Parameters
+    ---
+    bundles: list[LuaBundle]
+        the indexed bundles, later bundles win for duplicate names.
+    script_cache: Optional[LuaScriptCache]
+        cache to load the scripts from and to store parsed ones in.
+    max_bundles: int
+        number of parsed bundles kept in memory.
+    handler: Optional[AssetAPIHandler]
+        handler of the cdn of remote bundles that aren't downloaded yet.
+    """
+
+    bundles: list[LuaBundle]
+    script_cache: Optional[LuaScriptCache]
+    max_bundles: int
+    handler: Optional["AssetAPIHandler"]
+    loads: int
+    _index: dict[str, tuple[int, str]]  # name -> (bundle, name within the bundle)
+    _loaded: "OrderedDict[int, dict[str, bytes]]"
+    _lock: threading.Lock
+    _temp_dir: Optional[TemporaryDirectory]
+
+    def __init__(
+        self,
+        bundles: list[LuaBundle],
+        script_cache: Optional[LuaScriptCache] = None,
+        max_bundles: int = DEFAULT_MAX_BUNDLES,
+        handler: Optional["AssetAPIHandler"] = None,
+    ) -> None:
+        self.bundles = bundles
+        self.script_cache = script_cache
+        self.max_bundles = max(1, max_bundles)
+        self.handler = handler
+        self.loads = 0
+        self._index = {}
+        for i, bundle in enumerate(bundles):
+            prefix = f"{bundle.lua_dir}/" if bundle.lua_dir else ""
+            for name in bundle.names or ():
+                self._index[f"{prefix}{name}"] = (i, name)
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        self._temp_dir = None
+
+    @classmethod
+    def from_files(
+        cls,
+        fps: list[str],
+        lua_dirs: list[str],
+        script_cache: Optional[LuaScriptCache] = None,
+        processes: Optional[int] = None,
+    ) -> "LazyLuaMap":
+        """
+        Indexes local lua bundles, only bundles missing in the script cache are opened to read their script names.
+
+        Args:
+            fps (list[str]): The paths of the bundles.
+            lua_dirs (list[str]): The directories of the scripts of the bundles, see load_lua_bundle.
+            script_cache (Optional[LuaScriptCache]): The cache of the decrypted scripts.
+            processes (Optional[int]): The number of indexing processes, defaults to the number of cores.
+
+        Returns:
+            LazyLuaMap: The lazy lua_map.
+        """
+        bundles: list[LuaBundle] = []
+        for fp, lua_dir in zip(fps, lua_dirs):
+            bundle_key = local_bundle_key(fp)
+            bundles.append(LuaBundle(bundle_key, lua_dir, fp, cached_names(script_cache, bundle_key)))
+        missing = [bundle for bundle in bundles if bundle.names is None]
+        if missing:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+                for bundle, names in zip(missing, pool.map(index_lua_bundle, [bundle.fp for bundle in missing])):
+                    bundle.names = names
+        print(f"Lua script cache: {len(bundles) - len(missing)} bundles cached, {len(missing)} indexed.")
+        return cls.from_bundles(bundles, script_cache)
+
+    @classmethod
+    def from_server(
+        cls,
+        handler: "AssetAPIHandler",
+        asset_md5: "AssetMd5",
+        script_cache: Optional[LuaScriptCache] = None,
+        workers: Optional[int] = None,
+        processes: Optional[int] = None,
+    ) -> "LazyLuaMap":
+        """
+        Indexes the lua bundles of the server.
+        Bundles missing in the script cache are downloaded to a temporary directory of the map
+        and their script names are read, the other bundles are only downloaded if their scripts are required
+        and aren't cached.
+
+        Args:
+            handler (AssetAPIHandler): The handler of the cdn.
+            asset_md5 (AssetMd5): The asset manifest of the cdn.
+            script_cache (Optional[LuaScriptCache]): The cache of the decrypted scripts.
+            workers (Optional[int]): The number of parallel downloads.
+            processes (Optional[int]): The number of indexing processes, defaults to the number of cores.
+
+        Returns:
+            LazyLuaMap: The lazy lua_map, removing the downloaded bundles once it's closed.
+        """
+        temp_dir = TemporaryDirectory()
+        bundles: list[LuaBundle] = []
+        for key, entry in asset_md5.items():
+            if key.startswith("lua/"):
+                bundle_key = remote_bundle_key(handler.url_asset, key, entry["md5"])
+                fp = os.path.join(temp_dir.name, handler.unity_asset_name(key.split("/", 1)[1], entry["md5"]))
+                asset = (key, entry["md5"], entry["size"])
+                bundles.append(
+                    LuaBundle(bundle_key, key.split("/", 1)[1][4:], fp, cached_names(script_cache, bundle_key), asset)
+                )
+        missing = [bundle for bundle in bundles if bundle.names is None]
+        try:
+            if missing:
+                with (
+                    concurrent.futures.ThreadPoolExecutor(max_workers=workers or net.DEFAULT_WORKERS) as downloads,
+                    concurrent.futures.ProcessPoolExecutor(max_workers=processes) as indexers,
+                ):
+
+                    def fetch_n_index(bundle: LuaBundle) -> "concurrent.futures.Future[list[str]]":
+                        download_bundle(handler, bundle)
+                        return indexers.submit(index_lua_bundle, bundle.fp)
+
+                    indexed = [(bundle, downloads.submit(fetch_n_index, bundle)) for bundle in missing]
+                    for bundle, future in indexed:
+                        bundle.names = future.result().result()
+        except BaseException:
+            temp_dir.cleanup()
+            raise
+        print(f"Lua script cache: {len(bundles) - len(missing)} bundles cached, {len(missing)} indexed.")
+        lua_map = cls.from_bundles(bundles, script_cache, handler)
+        lua_map._temp_dir = temp_dir
+        return lua_map
+
+    @classmethod
+    def from_bundles(
+        cls,
+        bundles: list[LuaBundle],
+        script_cache: Optional[LuaScriptCache] = None,
+        handler: Optional["AssetAPIHandler"] = None,
+    ) -> "LazyLuaMap":
+        # indexed names are cached right away, so that the next run doesn't have to index or download the bundles
+        if script_cache is not None:
+            for bundle in bundles:
+                script_cache.put_names(bundle.key, bundle.names or [])
+        return cls(bundles, script_cache, handler=handler)
+
+    def __getitem__(self, name: str) -> bytes:
+        i, script_name = self._index[name]
+        return self._scripts(i)[script_name]
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __enter__(self) -> "LazyLuaMap":
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._loaded.clear()
+        if self.script_cache is not None:
+            self.script_cache.save(current=[bundle.key for bundle in self.bundles])
+            self.script_cache.close()
+        if self._temp_dir is not None:
+            self._temp_dir.cleanup()
+            self._temp_dir = None
+
+    def _scripts(self, i: int) -> dict[str, bytes]:
+        with self._lock:
+            scripts = self._loaded.get(i)
+            if scripts is not None:
+                self._loaded.move_to_end(i)
+                return scripts
+
+            bundle = self.bundles[i]
+            scripts = self.script_cache.get(bundle.key) if self.script_cache is not None else None
+            if scripts is None:
+                from .dump import load_lua_bundle
+
+                if bundle.asset is not None:
+                    assert self.handler is not None, f"{bundle.key} isn't downloaded"
+                    download_bundle(self.handler, bundle)
+                scripts = load_lua_bundle(bundle.fp, "")
+                self.loads += 1
+                if self.script_cache is not None:
+                    self.script_cache.put(bundle.key, scripts)
+
+            self._loaded[i] = scripts
+            while len(self._loaded) > self.max_bundles:
+                self._loaded.popitem(last=False)
+            return scripts
+
+
+def cached_names(script_cache: Optional[LuaScriptCache], key: str) -> Optional[list[str]]:
+    return script_cache.names(key) if script_cache is not None else None
+
+
+def download_bundle(handler: "AssetAPIHandler", bundle: LuaBundle) -> None:
+    assert bundle.asset is not None
+    key, md5, size = bundle.asset
+    handler.download_unity_asset(key, md5, bundle.fp, size)
+    bundle.asset = None
+
+
+def index_lua_bundle(src: "bytes | str") -> list[str]:
+    """Returns the names of the scripts of a lua bundle, without reading or decrypting the scripts themselves."""
+    names: list[str] = []
+    env = UnityPy.load(src)  # type: ignore
+    for obj in env.objects:
+        if obj.type.name == "TextAsset":
+            peek_name = getattr(obj, "peek_name", None)
+            name = peek_name() if peek_name is not None else None
+            names.append(name if name is not None else obj.read().m_Name)  # type: ignore
+    return names
@@ -0,0 +1,212 @@
+import json
+import mmap
+import os
+from typing import Iterable
+from typing import Optional
+
+from ... import cache
+
+# pack files get rewritten once less than this share of them is still referenced
+MIN_LIVE_RATIO = 0.5
+# indexes of other versions use another key format and are discarded
+INDEX_VERSION = 2
+
+
+class LuaScriptCache:
+    """
+    On-disk cache of the decrypted scripts of lua bundles.
+
+    The scripts of all bundles are stored back to back in a single pack file,
+    which is memory mapped for reading. A json index maps every bundle key
+    (source|name|version, see remote_bundle_key and local_bundle_key) to the names, offsets and sizes of its scripts.
+    New bundles are appended to the pack, save writes the index and rewrites the pack
+    once most of it belongs to bundles that aren't used anymore.
+    Bundles that were only indexed can be stored by the names of their scripts, see put_names.
+    The cache isn't meant to be written by several processes at the same time.
+
+    Parameters
+    ---
+    root: str
+        directory of the pack and index file.
+    """
+
+    root: str
+    pack_fp: str
+    index_fp: str
+    bundles: dict[str, list[tuple[str, int, int]]]  # bundle key -> [(name, offset, size)]
+    hits: int
+    misses: int
+    _mm: Optional[mmap.mmap]
+    _pack_size: int
+    _dirty: bool
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.pack_fp = os.path.join(root, "scripts.pack")
+        self.index_fp = os.path.join(root, "scripts.index.json")
+        self.bundles = {}
+        self.hits = 0
+        self.misses = 0
+        self._mm = None
+        self._pack_size = 0
+        self._dirty = False
+        self._load_index()
+
+    @classmethod
+    def default(cls) -> Optional["LuaScriptCache"]:
+        """Returns the cache in the cache dir of moc_utils, or None if caching is disabled."""
+        if not cache.enabled():
+            return None
+        return cls(os.path.join(cache.cache_dir(), "lua_scripts"))
+
+    def __enter__(self) -> "LuaScriptCache":
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        self.close()
+
+    def _load_index(self) -> None:
+        try:
+            with open(self.index_fp, "rb") as f:
+                index = json.loads(f.read())
+            # a cache of names only has no pack yet
+            pack_size = os.path.getsize(self.pack_fp) if os.path.exists(self.pack_fp) else 0
+        except (OSError, ValueError):
+            return
+        if index.get("version") != INDEX_VERSION:
+            return
+        bundles = {key: [tuple(entry) for entry in entries] for key, entries in index["bundles"].items()}
+        # an index referencing data beyond the pack belongs to a different or truncated pack
+        if any(offset + size > pack_size for entries in bundles.values() for _, offset, size in entries):
+            return
+        self.bundles = bundles  # type: ignore
+        self._pack_size = pack_size
+
+    def get(self, key: str) -> Optional[dict[str, bytes]]:
+        """Returns the scripts of a bundle, or None if they aren't cached."""
+        if not self._has_scripts(key):
+            self.misses += 1
+            return None
+        entries = self.bundles[key]
+        self.hits += 1
+        if not entries:
+            return {}
+        mm = self._map()
+        return {name: mm[offset : offset + size] for name, offset, size in entries}
+
+    def names(self, key: str) -> Optional[list[str]]:
+        """Returns the names of the scripts of a bundle without reading them, or None if it isn't cached."""
+        entries = self.bundles.get(key)
+        return None if entries is None else [name for name, _, _ in entries]
+
+    def put_names(self, key: str, names: list[str]) -> None:
+        """Stores the names of the scripts of a bundle without the scripts, unless the scripts are cached."""
+        if self._has_scripts(key):
+            return
+        # an offset of -1 marks the script as missing in the pack
+        self.bundles[key] = [(name, -1, 0) for name in names]
+        self._dirty = True
+
+    def put(self, key: str, scripts: dict[str, bytes]) -> None:
+        """Appends the scripts of a bundle to the pack."""
+        entries: list[tuple[str, int, int]] = []
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.pack_fp, "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            for name, script in scripts.items():
+                f.write(script)
+                entries.append((name, offset, len(script)))
+                offset += len(script)
+            f.flush()
+            os.fsync(f.fileno())
+        self._pack_size = offset
+        self.bundles[key] = entries
+        self._dirty = True
+
+    def save(self, current: Optional[Iterable[str]] = None) -> None:
+        """
+        Writes the index, after dropping the other versions of the current bundles.
+
+        Args:
+            current (Optional[Iterable[str]]): The keys of the bundles in use,
+                cached versions of the same bundles from the same source with other keys are dropped.
+                Bundles of other sources, e.g. another cdn or a game dir, are kept.
+        """
+        if current is not None:
+            current = set(current)
+            names = {bundle_name(key) for key in current}
+            for key in [key for key in self.bundles if key not in current and bundle_name(key) in names]:
+                del self.bundles[key]
+                self._dirty = True
+        live = sum(size for entries in self.bundles.values() for _, _, size in entries)
+        if self._pack_size and live < self._pack_size * MIN_LIVE_RATIO:
+            self._rewrite_pack()
+        if self._dirty:
+            self._write_index()
+
+    def _has_scripts(self, key: str) -> bool:
+        entries = self.bundles.get(key)
+        return entries is not None and all(offset >= 0 for _, offset, _ in entries)
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def _map(self) -> mmap.mmap:
+        # remapped if the pack grew since it was mapped
+        if self._mm is None or len(self._mm) < self._pack_size:
+            self.close()
+            with open(self.pack_fp, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm
+
+    def _rewrite_pack(self) -> None:
+        bundles: dict[str, list[tuple[str, int, int]]] = {}
+        offset = 0
+        tmp_fp = f"{self.pack_fp}.tmp"
+        mm = self._map()
+        with open(tmp_fp, "wb") as f:
+            for key, entries in self.bundles.items():
+                bundles[key] = []
+                for name, src_offset, size in entries:
+                    if src_offset < 0:
+                        bundles[key].append((name, src_offset, size))
+                        continue
+                    f.write(mm[src_offset : src_offset + size])
+                    bundles[key].append((name, offset, size))
+                    offset += size
+            f.flush()
+            os.fsync(f.fileno())
+        # a mapped file can't be replaced on windows
+        self.close()
+        os.replace(tmp_fp, self.pack_fp)
+        self.bundles = bundles
+        self._pack_size = offset
+        self._dirty = True
+
+    def _write_index(self) -> None:
+        tmp_fp = f"{self.index_fp}.tmp"
+        with open(tmp_fp, "wt", encoding="utf8") as f:
+            json.dump({"version": INDEX_VERSION, "bundles": self.bundles}, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_fp, self.index_fp)
+        self._dirty = False
+
+
+def local_bundle_key(fp: str) -> str:
+    # local bundles have no md5 at hand, so their size and mtime identify the version
+    stat = os.stat(fp)
+    fp = os.path.abspath(fp)
+    return f"{os.path.dirname(fp)}|{os.path.basename(fp)}|{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def remote_bundle_key(source: str, key: str, md5: str) -> str:
+    # source is the asset url of the cdn, so that the versions of several cdns don't evict each other
+    return f"{source}|{key}|{md5}"
+
+
+def bundle_name(bundle_key: str) -> str:
+    # source|name, everything but the version
+    return bundle_key.rsplit("|", 1)[0]
@@ -66,26 +66,32 @@ function convertMetaParamIndexToNormalTable(key, data)
 end
 
 
-local neatjson = require("neatjson")
-local json_options = {{
-    wrap = true,
-    sort = function(k) return tonumber(k) or k end,
-}}
+-- python sets EXPORT_TABLE to convert and write the tables itself, neatjson is the fallback
+local export_table = EXPORT_TABLE
+if export_table == nil then
+    local neatjson = require("neatjson")
+    local json_options = {{
+        wrap = true,
+        sort = function(k) return tonumber(k) or k end,
+    }}
+    export_table = function(k, data)
+        local string = neatjson(data, json_options)
+        local fp = EXPORT_DIR .. "/" .. k .. ".json"
+        local file = io.open(fp, "w")
+        file:write(string)
+        file:close()
+    end
+end
 
 for k, v in pairs(Database.db_loader.Global) do
     print(k, v)
     if k == "LuaCodes" or k == "LuaFuncs" or v == nil then
     else
         print("Dumping " .. k)
-        local string = ""
         if Database["_" .. k] then
-            string = neatjson(convertMetaParamIndexToNormalTable(k, v),  json_options)
+            export_table(k, convertMetaParamIndexToNormalTable(k, v))
         else
-            string=neatjson(v, json_options)
+            export_table(k, v)
         end
-        local fp = EXPORT_DIR .. "/" .. k .. ".json"
-        local file = io.open(fp, "w")
-        file:write(string)
-        file:close()
     end
 end
@@ -0,0 +1,252 @@
+from typing import Any
+from typing import Callable
+from typing import Mapping
+from typing import Optional
+
+from .chunk_cache import LuaChunkCache
+from .handler import LuaHandler
+from .sink import DumpSink
+
+# paths the Lua scripts get as EXPORT_DIR and ASSET_DIR, if their files are handled by python
+VIRTUAL_EXPORT_DIR = "export:"
+VIRTUAL_ASSET_DIR = "assets:"
+
+# modules without state that depends on the dump, they stay loaded across resets
+KEEP_MODULES = ("neatjson",)
+
+# library tables that scripts might patch, their fields are restored by reset
+LIBRARY_TABLES = ("string", "table", "math", "io", "os", "coroutine", "debug", "package")
+
+SNAPSHOT_CODE = """
+local libs = {...}
+local base = {globals = {}, loaded = {}, libs = {}}
+for k, v in pairs(_G) do
+    base.globals[k] = v
+end
+for k, v in pairs(package.loaded) do
+    base.loaded[k] = v
+end
+for _, name in ipairs(libs) do
+    local lib = _G[name]
+    if type(lib) == "table" then
+        local fields = {}
+        for k, v in pairs(lib) do
+            fields[k] = v
+        end
+        base.libs[name] = fields
+    end
+end
+base.globals.__SESSION_BASE = base
+__SESSION_BASE = base
+"""
+
+RESET_CODE = """
+local keep = {}
+for _, name in ipairs({...}) do
+    keep[name] = true
+end
+local base = __SESSION_BASE
+for k in pairs(_G) do
+    if base.globals[k] == nil then
+        _G[k] = nil
+    end
+end
+for k, v in pairs(base.globals) do
+    _G[k] = v
+end
+for name, fields in pairs(base.libs) do
+    local lib = _G[name]
+    for k in pairs(lib) do
+        if fields[k] == nil then
+            lib[k] = nil
+        end
+    end
+    for k, v in pairs(fields) do
+        lib[k] = v
+    end
+end
+for k, v in pairs(package.loaded) do
+    if base.loaded[k] == nil and not keep[k] then
+        package.loaded[k] = nil
+    end
+end
+for k, v in pairs(base.loaded) do
+    package.loaded[k] = v
+end
+collectgarbage("collect")
+"""
+
+
+class LuaSession:
+    """
+    A single Lua VM shared by several dumps.
+
+    The library is loaded, the libs are opened and the python loader is installed once.
+    reset restores the globals, the library tables and package.loaded to the state right after the setup,
+    so that every dump starts from a clean VM. Modules in keep_modules, e.g. neatjson,
+    stay loaded across resets, so that they are only compiled once per session.
+
+    Parameters
+    ---
+    slua_fp: str
+        path of the slua library.
+    loader: Optional[Callable[[str], bytes]]
+        source of the required modules, see lua_require_unitypy, can be replaced via set_loader.
+    keep_modules: tuple[str, ...]
+        modules that stay loaded across resets.
+    chunk_cache: Optional[LuaChunkCache]
+        cache of the compiled modules, defaults to the cache of the library in the cache dir of moc_utils.
+    """
+
+    handler: LuaHandler
+    keep_modules: tuple[str, ...]
+    chunk_cache: LuaChunkCache
+    _loader: Optional[Callable[[str], bytes]]
+    _exporter: Optional[Callable[[str, Any], None]]
+    _filesystem: Optional["LuaFileSystem"]
+
+    def __init__(
+        self,
+        slua_fp: str,
+        loader: Optional[Callable[[str], bytes]] = None,
+        keep_modules: tuple[str, ...] = KEEP_MODULES,
+        chunk_cache: Optional[LuaChunkCache] = None,
+    ) -> None:
+        self.keep_modules = keep_modules
+        self.chunk_cache = chunk_cache if chunk_cache is not None else LuaChunkCache.default(slua_fp)
+        self._loader = loader
+        self._exporter = None
+        self._filesystem = None
+        self.handler = LuaHandler(slua_fp)
+        # loader, exporter and file system are looked up per call, so that they can be replaced without touching the VM
+        self.handler.register_package_loader(self._load, self.chunk_cache)
+        self.handler.register_table_exporter(self._export)
+        self.handler.register_io_handler(self._access, self._read, self._write)
+        self._call(SNAPSHOT_CODE, LIBRARY_TABLES)
+
+    def __enter__(self) -> "LuaSession":
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        self.close()
+
+    def set_loader(self, loader: Callable[[str], bytes]) -> None:
+        self._loader = loader
+
+    def _load(self, filename: str) -> bytes:
+        if self._loader is None:
+            return b""
+        return self._loader(filename)
+
+    def set_exporter(self, exporter: Optional[Callable[[str, Any], None]]) -> None:
+        """Sets the receiver of the tables passed to python.export_table."""
+        self._exporter = exporter
+
+    def _export(self, name: str, data: Any) -> None:
+        if self._exporter is not None:
+            self._exporter(name, data)
+
+    def set_filesystem(self, filesystem: Optional["LuaFileSystem"]) -> None:
+        """Sets the files served to io.open, None to only use the real files."""
+        self._filesystem = filesystem
+
+    def _access(self, path: str) -> Optional[str]:
+        return self._filesystem.access(path) if self._filesystem is not None else None
+
+    def _read(self, path: str) -> Optional[bytes]:
+        return self._filesystem.read(path) if self._filesystem is not None else None
+
+    def _write(self, path: str, data: bytes) -> None:
+        if self._filesystem is not None:
+            self._filesystem.write(path, data)
+
+    def run(self, code: str) -> None:
+        """Runs a chunk of Lua code in the current state, raises the errors of the exporter and writes afterwards."""
+        self.handler.export_errors.clear()
+        self.handler.loadstring(code)
+        self.handler.pcall(0, 1, 0)
+        errors, self.handler.export_errors = self.handler.export_errors, []
+        if errors:
+            details = "\n".join(f"{name}: {e}" for name, e in errors)
+            raise Exception(f"Failed to export {len(errors)} tables or files:\n{details}")
+
+    def reset(self) -> None:
+        """Restores the state right after the setup, except for the modules in keep_modules."""
+        self._call(RESET_CODE, self.keep_modules)
+
+    def close(self) -> None:
+        # the library is freed once the handler is collected
+        if hasattr(self, "handler"):
+            del self.handler
+            self.chunk_cache.prune()
+
+    def _call(self, code: str, args: tuple[str, ...]) -> None:
+        self.handler.loadstring(code)
+        for arg in args:
+            self.handler.lua.lua_pushstring(self.handler.state, arg.encode("utf-8"))
+        self.handler.pcall(len(args), 0, 0)
+
+
+class LuaFileSystem:
+    """
+    The files behind io.open of a LuaSession.
+
+    Reads below asset_dir are served from assets, writes below export_dir go to sink,
+    all other paths use the real files.
+
+    Parameters
+    ---
+    sink: Optional[DumpSink]
+        receiver of the files written below export_dir.
+    export_dir: str
+        the EXPORT_DIR of the scripts.
+    assets: Optional[Mapping[str, bytes]]
+        files by their path relative to asset_dir.
+    asset_dir: str
+        the ASSET_DIR of the scripts.
+    """
+
+    sink: Optional[DumpSink]
+    export_dir: str
+    assets: Optional[Mapping[str, bytes]]
+    asset_dir: str
+
+    def __init__(
+        self,
+        sink: Optional[DumpSink] = None,
+        export_dir: str = VIRTUAL_EXPORT_DIR,
+        assets: Optional[Mapping[str, bytes]] = None,
+        asset_dir: str = VIRTUAL_ASSET_DIR,
+    ) -> None:
+        self.sink = sink
+        self.export_dir = export_dir
+        self.assets = assets
+        self.asset_dir = asset_dir
+
+    def access(self, path: str) -> Optional[str]:
+        """Returns "r" for the virtual files below asset_dir, "w" for the ones below export_dir, None otherwise."""
+        if self.assets is not None and relative_name(path, self.asset_dir) is not None:
+            return "r"
+        if self.sink is not None and relative_name(path, self.export_dir) is not None:
+            return "w"
+        return None
+
+    def read(self, path: str) -> Optional[bytes]:
+        if self.assets is None:
+            return None
+        name = relative_name(path, self.asset_dir)
+        return self.assets.get(name) if name is not None else None
+
+    def write(self, path: str, data: bytes) -> None:
+        name = relative_name(path, self.export_dir)
+        assert self.sink is not None and name is not None, f"{path} isn't below {self.export_dir}"
+        self.sink.write(name, data)
+
+
+def relative_name(path: str, root: str) -> Optional[str]:
+    # the scripts join paths with either slash
+    path = path.replace("\\", "/")
+    root = root.replace("\\", "/").rstrip("/")
+    if not path.startswith(f"{root}/"):
+        return None
+    return path[len(root) + 1 :].lstrip("/")
@@ -0,0 +1,204 @@
+import io
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from abc import ABC
+from abc import abstractmethod
+from contextlib import contextmanager
+from typing import Any
+from typing import BinaryIO
+from typing import Iterator
+from typing import Optional
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+# suffix -> mode of tarfile.open
+TAR_MODES = {
+    ".tar": "w",
+    ".tar.gz": "w:gz",
+    ".tgz": "w:gz",
+    ".tar.xz": "w:xz",
+    ".tar.bz2": "w:bz2",
+}
+ZSTD_SUFFIXES = (".tar.zst", ".tzst")
+
+
+class DumpSink(ABC):
+    """
+    Destination of the files of a dump, names are relative paths with forward slashes.
+    Sinks are thread safe, but not shared between processes.
+    """
+
+    @abstractmethod
+    def write(self, name: str, data: bytes) -> None:
+        """Stores a file, directories replace an earlier one of the same name, archives raise a ValueError."""
+
+    def child(self, prefix: str) -> "DumpSink":
+        """Returns a view of the sink that writes below prefix."""
+        return PrefixedSink(self, prefix)
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "DumpSink":
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        self.close()
+
+
+class DirectorySink(DumpSink):
+    """
+    Writes the files to a directory.
+
+    Parameters
+    ---
+    root: str
+        the directory to write to.
+    """
+
+    root: str
+    _dirs: set[str]
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self._dirs = set()
+        os.makedirs(root, exist_ok=True)
+
+    def write(self, name: str, data: bytes) -> None:
+        fp = os.path.join(self.root, *name.split("/"))
+        dirname = os.path.dirname(fp)
+        if dirname not in self._dirs:
+            os.makedirs(dirname, exist_ok=True)
+            self._dirs.add(dirname)
+        with open(fp, "wb") as f:
+            f.write(data)
+
+
+class MemorySink(DumpSink):
+    """Keeps the files in memory, e.g. to pass them from a worker process to the actual sink."""
+
+    files: dict[str, bytes]
+
+    def __init__(self) -> None:
+        self.files = {}
+
+    def write(self, name: str, data: bytes) -> None:
+        self.files[name] = data
+
+
+class PrefixedSink(DumpSink):
+    parent: DumpSink
+    prefix: str
+
+    def __init__(self, parent: DumpSink, prefix: str) -> None:
+        self.parent = parent
+        self.prefix = prefix.strip("/")
+
+    def write(self, name: str, data: bytes) -> None:
+        self.parent.write(f"{self.prefix}/{name}", data)
+
+
+class ZipSink(DumpSink):
+    """
+    Streams the files into a deflated zip archive.
+
+    Parameters
+    ---
+    fp: str
+        path of the archive.
+    """
+
+    archive: zipfile.ZipFile
+    _names: set[str]
+    _lock: threading.Lock
+
+    def __init__(self, fp: str) -> None:
+        self.archive = zipfile.ZipFile(fp, "w", compression=zipfile.ZIP_DEFLATED)
+        self._names = set()
+        self._lock = threading.Lock()
+
+    def write(self, name: str, data: bytes) -> None:
+        with self._lock:
+            add_name(self._names, name)
+            self.archive.writestr(name, data)
+
+    def close(self) -> None:
+        self.archive.close()
+
+
+class TarSink(DumpSink):
+    """
+    Streams the files into a tar archive, compressed according to the suffix of fp.
+    .tar.zst requires the zstandard package.
+
+    Parameters
+    ---
+    fp: str
+        path of the archive.
+    """
+
+    archive: tarfile.TarFile
+    _stream: Optional[BinaryIO]
+    _names: set[str]
+    _lock: threading.Lock
+
+    def __init__(self, fp: str) -> None:
+        self._stream = None
+        self._names = set()
+        self._lock = threading.Lock()
+        lower = fp.lower()
+        if lower.endswith(ZSTD_SUFFIXES):
+            # checked before the archive is created, so that no empty file is left behind
+            if zstandard is None:
+                raise ImportError("Writing .tar.zst archives requires the zstandard package")
+            self._stream = zstandard.ZstdCompressor().stream_writer(open(fp, "wb"))  # type: ignore  # noqa: SIM115
+            self.archive = tarfile.open(fileobj=self._stream, mode="w|")  # type: ignore
+        else:
+            mode: Any = next(mode for suffix, mode in TAR_MODES.items() if lower.endswith(suffix))
+            self.archive = tarfile.open(fp, mode)
+
+    def write(self, name: str, data: bytes) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        with self._lock:
+            add_name(self._names, name)
+            self.archive.addfile(info, io.BytesIO(data))
+
+    def close(self) -> None:
+        self.archive.close()
+        if self._stream is not None:
+            self._stream.close()
+
+
+def add_name(names: set[str], name: str) -> None:
+    # entries of an archive can't be replaced, a second one of the same name would only shadow the first
+    if name in names:
+        raise ValueError(f"{name} was already written to the archive")
+    names.add(name)
+
+
+def open_sink(dst: str) -> DumpSink:
+    """Returns the sink for dst, an archive for the suffixes of zip and tar files, a directory otherwise."""
+    lower = dst.lower()
+    if lower.endswith(".zip"):
+        return ZipSink(dst)
+    if lower.endswith((*TAR_MODES, *ZSTD_SUFFIXES)):
+        return TarSink(dst)
+    return DirectorySink(dst)
+
+
+@contextmanager
+def sink_for(dst: "str | DumpSink") -> Iterator[DumpSink]:
+    # a given sink is left open for the caller
+    if isinstance(dst, DumpSink):
+        yield dst
+    else:
+        with open_sink(dst) as sink:
+            yield sink
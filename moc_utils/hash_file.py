@@ -0,0 +1,364 @@
+import os
+import sys
+import threading
+import time
+from array import array
+from typing import IO
+from typing import Container
+from typing import Iterator
+from typing import Optional
+
+from .asset_api import AssetMd5Local
+from .asset_api import AssetMd5Utils
+
+# the game writes \r\n on all systems, see AssetMd5Utils.line_separator
+LINE_SEPARATOR = b"\r\n"
+MD5_LENGTH = 16
+
+
+class AssetHashIndex:
+    """
+    Compact table of the entries of a file_hash.txt.
+
+    Instead of a dict per entry, the md5s and timestamps are kept in flat arrays next to the interned keys.
+    Changes are tracked per entry, so write only touches the lines that changed
+    and untouched entries keep their original timestamp.
+    """
+
+    __slots__ = ("_dirty", "_index", "_keys", "_md5s", "_offsets", "_rewrite", "_source", "_stat", "_timestamps")
+
+    _index: dict[str, int]
+    _keys: list[Optional[str]]  # None for removed entries
+    _md5s: bytearray  # MD5_LENGTH ascii chars per entry
+    _timestamps: array  # type: ignore
+    _offsets: array  # type: ignore  # offset of the line in the source file, -1 if it isn't written yet
+    _dirty: bytearray
+    _rewrite: bool
+    _source: Optional[str]
+    _stat: Optional[tuple[int, int]]
+
+    def __init__(self) -> None:
+        self._index = {}
+        self._keys = []
+        self._md5s = bytearray()
+        self._timestamps = array("q")
+        self._offsets = array("q")
+        self._dirty = bytearray()
+        self._rewrite = False
+        self._source = None
+        self._stat = None
+
+    @classmethod
+    def load(cls, fp: str) -> "AssetHashIndex":
+        """Reads a file_hash.txt, a missing file results in an empty index."""
+        index = cls()
+        stat = file_stat(fp)
+        if stat is None:
+            return index
+        with open(fp, "rb") as f:
+            data = f.read()
+
+        # collected in plain lists first, appending entry by entry to the arrays is much slower
+        positions = index._index
+        keys: list[Optional[str]] = []
+        md5s: list[str] = []
+        timestamps: list[int] = []
+        offsets: list[int] = []
+        for offset, key, md5, timestamp in iter_hash_lines(data):
+            i = positions.get(key)
+            if i is None:
+                positions[sys.intern(key)] = len(keys)
+                keys.append(key)
+                md5s.append(md5)
+                timestamps.append(timestamp)
+                offsets.append(offset)
+            else:
+                # the last line of a key wins, like in parse_hash_file
+                md5s[i] = md5
+                timestamps[i] = timestamp
+                offsets[i] = offset
+        index._keys = keys
+        index._md5s = bytearray("".join(md5s), "ascii")
+        index._timestamps = array("q", timestamps)
+        index._offsets = array("q", offsets)
+        index._dirty = bytearray(len(keys))
+        index._source = fp
+        index._stat = stat
+        # keys with invalid utf8 are written back differently encoded, so their lines can't be replaced in place
+        index._rewrite = not is_utf8(data)
+        return index
+
+    def update_from(self, fp: str) -> None:
+        """Applies the entries of another file in the same format, e.g. a journal, as changes."""
+        if not os.path.exists(fp):
+            return
+        with open(fp, "rb") as f:
+            data = f.read()
+        for _offset, key, md5, timestamp in iter_hash_lines(data):
+            self.set(key, md5, timestamp)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def md5(self, key: str) -> Optional[str]:
+        i = self._index.get(key)
+        return None if i is None else self._md5(i)
+
+    def timestamp(self, key: str) -> Optional[int]:
+        i = self._index.get(key)
+        return None if i is None else self._timestamps[i]
+
+    def items(self) -> Iterator[tuple[str, str, int]]:
+        """Yields key, md5 and timestamp of all entries."""
+        for key, i in self._index.items():
+            yield key, self._md5(i), self._timestamps[i]
+
+    def to_local(self) -> AssetMd5Local:
+        return {key: {"md5": md5, "timestamp": timestamp} for key, md5, timestamp in self.items()}
+
+    def set(self, key: str, md5: str, timestamp: Optional[int] = None) -> bool:
+        """
+        Sets the md5 of an entry.
+
+        Args:
+            key (str): The key of the asset.
+            md5 (str): The shortened md5 of the asset.
+            timestamp (Optional[int]): The time of the download, defaults to now.
+
+        Returns:
+            bool: True if the entry changed, an entry with the same md5 keeps its timestamp.
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+        i = self._index.get(key)
+        if i is None:
+            self._append(key, md5, timestamp, -1, dirty=True)
+            return True
+        if self._md5(i) == md5:
+            return False
+        if len(str(self._timestamps[i])) != len(str(timestamp)):
+            # the line changes its length, so it can't be replaced in place
+            self._rewrite = True
+        self._md5s[i * MD5_LENGTH : (i + 1) * MD5_LENGTH] = md5.encode("ascii")
+        self._timestamps[i] = timestamp
+        self._dirty[i] = 1
+        return True
+
+    def remove(self, key: str) -> bool:
+        i = self._index.pop(key, None)
+        if i is None:
+            return False
+        self._keys[i] = None
+        self._rewrite = True
+        return True
+
+    def retain(self, keys: Container[str]) -> int:
+        """Removes all entries not in keys, returns the number of removed entries."""
+        removed = [key for key in self._index if key not in keys]
+        for key in removed:
+            self.remove(key)
+        return len(removed)
+
+    def dump(self) -> bytes:
+        return b"".join(self._line(i) + LINE_SEPARATOR for i in self._index.values())
+
+    def write(self, fp: str) -> None:
+        """
+        Writes the index to fp.
+
+        If fp is the file the index was loaded from and wasn't modified since,
+        changed entries are replaced in place and new ones are appended.
+        Otherwise, e.g. after removing entries, the file is atomically rewritten.
+        """
+        if self._rewrite or self._source != fp or self._stat is None or file_stat(fp) != self._stat:
+            self._write_full(fp)
+        elif any(self._dirty):
+            self._write_changes(fp)
+        self._dirty = bytearray(len(self._keys))
+        self._rewrite = False
+        self._source = fp
+        self._stat = file_stat(fp)
+
+    def _write_changes(self, fp: str) -> None:
+        with open(fp, "r+b") as f:
+            appended: list[int] = []
+            for i in self._index.values():
+                if not self._dirty[i]:
+                    continue
+                if self._offsets[i] < 0:
+                    appended.append(i)
+                    continue
+                f.seek(self._offsets[i])
+                f.write(self._line(i))
+
+            if appended:
+                end = f.seek(0, os.SEEK_END)
+                if end:
+                    f.seek(end - 1)
+                    if f.read(1) != b"\n":
+                        # a partially written last line mustn't be merged with the next one
+                        end += f.write(LINE_SEPARATOR)
+                for i in appended:
+                    line = self._line(i)
+                    f.write(line + LINE_SEPARATOR)
+                    self._offsets[i] = end
+                    end += len(line) + len(LINE_SEPARATOR)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_full(self, fp: str) -> None:
+        compact = AssetHashIndex()
+        offset = 0
+        tmp_fp = f"{fp}.tmp"
+        with open(tmp_fp, "wb") as f:
+            for key, i in self._index.items():
+                line = self._line(i)
+                f.write(line + LINE_SEPARATOR)
+                compact._append(key, self._md5(i), self._timestamps[i], offset, dirty=False)
+                offset += len(line) + len(LINE_SEPARATOR)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_fp, fp)
+        # drop the removed entries
+        for slot in ("_index", "_keys", "_md5s", "_timestamps", "_offsets"):
+            setattr(self, slot, getattr(compact, slot))
+
+    def _append(self, key: str, md5: str, timestamp: int, offset: int, dirty: bool) -> None:
+        self._index[sys.intern(key)] = len(self._keys)
+        self._keys.append(key)
+        self._md5s += md5.encode("ascii")
+        self._timestamps.append(timestamp)
+        self._offsets.append(offset)
+        self._dirty.append(dirty)
+
+    def _md5(self, i: int) -> str:
+        return self._md5s[i * MD5_LENGTH : (i + 1) * MD5_LENGTH].decode("ascii")
+
+    def _line(self, i: int) -> bytes:
+        return (
+            b"%s|%s|%d"
+            % (
+                self._keys[i].encode("utf8"),  # type: ignore
+                self._md5s[i * MD5_LENGTH : (i + 1) * MD5_LENGTH],
+                self._timestamps[i],
+            )
+        )
+
+
+def iter_hash_lines(data: bytes) -> Iterator[tuple[int, str, str, int]]:
+    """Yields byte offset, key, md5 and timestamp of the valid lines of a file_hash.txt in a single pass."""
+    lines: Iterator[tuple[str, int]]
+    if data.isascii():
+        # character and byte offsets are the same, so the file is decoded at once
+        lines = ((line, len(line)) for line in data.decode("ascii").split("\n"))
+    else:
+        # offsets are counted on the raw bytes, a decoded line with invalid utf8 has another length
+        lines = ((line.decode("utf8", errors="replace"), len(line)) for line in data.split(b"\n"))
+    parse = AssetMd5Utils.parse_hash_line
+    offset = 0
+    for line, size in lines:
+        entry = parse(line)
+        if entry is not None:
+            yield (offset, *entry)
+        offset += size + 1
+
+
+def is_utf8(data: bytes) -> bool:
+    if data.isascii():
+        return True
+    try:
+        data.decode("utf8")
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def file_stat(fp: str) -> Optional[tuple[int, int]]:
+    try:
+        stat = os.stat(fp)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class AssetHashJournal:
+    """
+    Crash-safe bookkeeping of the downloaded assets.
+
+    Every finished download is appended to file_hash.txt.journal right away,
+    so an interrupted sync still knows which assets are on disk.
+    compact writes the changes into file_hash.txt and removes the journal.
+
+    Parameters
+    ---
+    fp: str
+        Path of the file_hash.txt.
+    """
+
+    fp: str
+    journal_fp: str
+    _file: Optional[IO[str]]
+    _lock: threading.Lock
+
+    def __init__(self, fp: str) -> None:
+        self.fp = fp
+        self.journal_fp = f"{fp}.journal"
+        self._file = None
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "AssetHashJournal":
+        self.open()
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        self.close()
+
+    def load(self) -> AssetHashIndex:
+        """Returns the entries of file_hash.txt, updated by the entries of a left-over journal."""
+        index = AssetHashIndex.load(self.fp)
+        index.update_from(self.journal_fp)
+        return index
+
+    def open(self) -> None:
+        # a crash might have left a partially written last line, which must not be merged with the next one
+        partial = False
+        if os.path.exists(self.journal_fp) and os.path.getsize(self.journal_fp):
+            with open(self.journal_fp, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                partial = f.read(1) != b"\n"
+        self._file = open(self.journal_fp, "at", encoding="utf8")  # noqa: SIM115
+        if partial:
+            self._file.write(AssetMd5Utils.line_separator())
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def record(self, key: str, md5: str) -> None:
+        """Appends an asset to the journal, should only be called once the asset is stored on disk."""
+        line = f"{key}|{md5}|{int(time.time())}{AssetMd5Utils.line_separator()}"
+        with self._lock:
+            assert self._file is not None, "journal isn't open"
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def compact(self, index: AssetHashIndex) -> None:
+        """
+        Writes the given entries to file_hash.txt and removes the journal.
+
+        Args:
+            index (AssetHashIndex): The entries to store, usually load() retained to the assets of the server.
+        """
+        self.close()
+        index.write(self.fp)
+        if os.path.exists(self.journal_fp):
+            os.remove(self.journal_fp)
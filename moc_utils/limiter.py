@@ -0,0 +1,196 @@
+import threading
+import time
+from typing import Optional
+
+import requests
+
+CONGESTION_STATUS = (429, 500, 502, 503, 504)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD (additive increase, multiplicative decrease) limit for the number of concurrent transfers.
+
+    Every interval the window of finished transfers is evaluated:
+    if the throughput held or improved and the limit was used, the limit grows by one,
+    if the time to first byte climbed above latency_tolerance times the best seen one, the limit shrinks.
+    Responses with 429/5xx and connection errors shrink the limit right away,
+    but at most once per interval, so a single burst of errors doesn't collapse it to the floor.
+
+    Parameters
+    ---
+    floor: int
+        min. number of concurrent transfers.
+    ceiling: int
+        max. number of concurrent transfers.
+    initial: Optional[int]
+        starting limit, defaults to the middle between floor and ceiling.
+    interval: float
+        seconds between two adjustments.
+    latency_tolerance: float
+        factor of the best seen time to first byte above which the latency counts as climbing.
+    """
+
+    floor: int
+    ceiling: int
+    limit: float
+    in_flight: int
+    interval: float
+    latency_tolerance: float
+    _cond: threading.Condition
+    _window_start: float
+    _window_bytes: int
+    _window_ttfb: float
+    _window_count: int
+    _window_peak: int
+    _best_ttfb: Optional[float]
+    _prev_throughput: float
+    _last_decrease: float
+
+    def __init__(
+        self,
+        floor: int = 1,
+        ceiling: int = 32,
+        initial: Optional[int] = None,
+        interval: float = 2.0,
+        latency_tolerance: float = 2.0,
+    ) -> None:
+        self.floor = max(1, floor)
+        self.ceiling = max(self.floor, ceiling)
+        self.limit = float(initial if initial is not None else (self.floor + self.ceiling) // 2)
+        self.limit = min(max(self.limit, self.floor), self.ceiling)
+        self.in_flight = 0
+        self.interval = interval
+        self.latency_tolerance = latency_tolerance
+        self._cond = threading.Condition()
+        self._best_ttfb = None
+        self._prev_throughput = 0.0
+        # time.monotonic() may start near zero, so the first decrease is always allowed
+        self._last_decrease = float("-inf")
+        self._reset_window(time.monotonic())
+
+    def slot(self) -> "LimiterSlot":
+        return LimiterSlot(self)
+
+    def acquire(self) -> None:
+        with self._cond:
+            self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            self._window_peak = max(self._window_peak, self.in_flight)
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def record(self, ttfb: Optional[float], size: int) -> None:
+        """Records a finished transfer."""
+        with self._cond:
+            self._window_bytes += size
+            if ttfb is not None:
+                self._window_ttfb += ttfb
+                self._window_count += 1
+            self._maybe_adjust()
+
+    def congestion(self) -> None:
+        """Records a sign of an overloaded server, e.g. a 429/5xx response or a connection reset."""
+        with self._cond:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.interval:
+                self._decrease(0.5, now)
+
+    def _maybe_adjust(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.interval:
+            return
+
+        throughput = self._window_bytes / elapsed
+        ttfb = self._window_ttfb / self._window_count if self._window_count else None
+        if ttfb is not None:
+            self._best_ttfb = ttfb if self._best_ttfb is None else min(self._best_ttfb, ttfb)
+
+        if ttfb is not None and self._best_ttfb is not None and ttfb > self._best_ttfb * self.latency_tolerance:
+            self._decrease(0.75, now)
+        elif throughput >= self._prev_throughput * 0.95 and self._window_peak >= int(self.limit):
+            # only grow if the current limit is actually in use
+            self.limit = min(self.ceiling, self.limit + 1)
+            self._cond.notify_all()
+
+        self._prev_throughput = throughput
+        self._reset_window(now)
+
+    def _decrease(self, factor: float, now: float) -> None:
+        self.limit = max(float(self.floor), self.limit * factor)
+        self._last_decrease = now
+
+    def _reset_window(self, now: float) -> None:
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_ttfb = 0.0
+        self._window_count = 0
+        self._window_peak = self.in_flight
+
+
+class LimiterSlot:
+    """
+    A single transfer holding a slot of the limiter, used as context manager around it.
+    Without a limiter, the slot does nothing.
+    """
+
+    limiter: Optional[AdaptiveLimiter]
+    start: float
+    ttfb: Optional[float]
+    size: int
+
+    def __init__(self, limiter: Optional[AdaptiveLimiter]) -> None:
+        self.limiter = limiter
+        self.start = 0.0
+        self.ttfb = None
+        self.size = 0
+
+    def __enter__(self) -> "LimiterSlot":
+        if self.limiter is not None:
+            self.limiter.acquire()
+        self.start = time.monotonic()
+        return self
+
+    def first_byte(self) -> None:
+        if self.ttfb is None:
+            self.ttfb = time.monotonic() - self.start
+
+    def add_bytes(self, size: int) -> None:
+        self.size += size
+
+    def __exit__(self, exc_type: Optional[type[BaseException]], exc: Optional[BaseException], *_args: object) -> None:
+        if self.limiter is None:
+            return
+        self.limiter.release()
+        if exc is None:
+            self.limiter.record(self.ttfb, self.size)
+        elif is_congestion(exc):
+            self.limiter.congestion()
+
+
+def is_congestion(exc: BaseException) -> bool:
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and exc.response.status_code in CONGESTION_STATUS
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout))
+
+
+_limiter: Optional[AdaptiveLimiter] = None
+
+
+def install(limiter: Optional[AdaptiveLimiter]) -> None:
+    """Sets the limiter used by all transfers, None disables the limit."""
+    global _limiter
+    _limiter = limiter
+
+
+def get_limiter() -> Optional[AdaptiveLimiter]:
+    return _limiter
+
+
+def slot() -> LimiterSlot:
+    # a slot of the installed limiter, or a no-op slot if none is installed
+    return LimiterSlot(_limiter)
@@ -0,0 +1,217 @@
+import json
+import sys
+import threading
+import time
+from bisect import bisect_left
+from typing import Any
+from typing import Optional
+from typing import TextIO
+
+# upper bounds in seconds of the latency histogram buckets, the last bucket catches everything above
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    bounds: tuple[float, ...]
+    counts: list[int]
+    total: float
+    count: int
+
+    def __init__(self, bounds: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def to_dict(self) -> dict[str, Any]:
+        labels = [f"<={bound}" for bound in self.bounds] + [f">{self.bounds[-1]}"]
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class TransferMetrics:
+    """
+    Thread-safe counters of the http transfers of the process.
+
+    The downloads report to the shared instance METRICS,
+    which is rendered by ProgressBar and can be written as json report.
+    """
+
+    started: float
+    bytes_done: int
+    bytes_expected: int
+    requests: int
+    failures: int
+    retries: int
+    in_flight: int
+    max_in_flight: int
+    latency: Histogram
+    ttfb: Histogram
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started = time.perf_counter()
+            self.bytes_done = 0
+            self.bytes_expected = 0
+            self.requests = 0
+            self.failures = 0
+            self.retries = 0
+            self.in_flight = 0
+            self.max_in_flight = 0
+            self.latency = Histogram()
+            self.ttfb = Histogram()
+
+    def track(self) -> "RequestTracker":
+        return RequestTracker(self)
+
+    def expect(self, size: int) -> None:
+        with self._lock:
+            self.bytes_expected += size
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def record_bytes(self, size: int) -> None:
+        with self._lock:
+            self.bytes_done += size
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def throughput(self) -> float:
+        elapsed = self.elapsed()
+        return self.bytes_done / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "elapsed": self.elapsed(),
+                "bytes_done": self.bytes_done,
+                "bytes_expected": self.bytes_expected,
+                "bytes_per_second": self.throughput(),
+                "requests": self.requests,
+                "failures": self.failures,
+                "retries": self.retries,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "latency": self.latency.to_dict(),
+                "ttfb": self.ttfb.to_dict(),
+            }
+
+    def write_json(self, fp: str) -> None:
+        with open(fp, "wt", encoding="utf8") as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+
+class RequestTracker:
+    """
+    Measures a single request, used as context manager around it.
+    first_byte has to be called once the first data arrived.
+    """
+
+    metrics: TransferMetrics
+    start: float
+    ttfb: Optional[float]
+
+    def __init__(self, metrics: TransferMetrics) -> None:
+        self.metrics = metrics
+        self.start = 0.0
+        self.ttfb = None
+
+    def __enter__(self) -> "RequestTracker":
+        self.start = time.perf_counter()
+        with self.metrics._lock:
+            self.metrics.requests += 1
+            self.metrics.in_flight += 1
+            self.metrics.max_in_flight = max(self.metrics.max_in_flight, self.metrics.in_flight)
+        return self
+
+    def first_byte(self) -> None:
+        if self.ttfb is None:
+            self.ttfb = time.perf_counter() - self.start
+
+    def __exit__(self, exc_type: Optional[type[BaseException]], *_args: object) -> None:
+        latency = time.perf_counter() - self.start
+        with self.metrics._lock:
+            self.metrics.in_flight -= 1
+            if exc_type is not None:
+                self.metrics.failures += 1
+            self.metrics.latency.add(latency)
+            if self.ttfb is not None:
+                self.metrics.ttfb.add(self.ttfb)
+
+
+class ProgressBar:
+    """
+    Renders the aggregated progress of a TransferMetrics instance in a single, periodically updated line.
+    Used as context manager around the downloads.
+    """
+
+    metrics: TransferMetrics
+    interval: float
+    stream: TextIO
+    _stop: threading.Event
+    _thread: Optional[threading.Thread]
+
+    def __init__(self, metrics: TransferMetrics, interval: float = 0.5, stream: TextIO = sys.stderr) -> None:
+        self.metrics = metrics
+        self.interval = interval
+        self.stream = stream
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self) -> "ProgressBar":
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.render()
+        self.stream.write("\n")
+        self.stream.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.render()
+
+    def render(self) -> None:
+        m = self.metrics
+        done = m.bytes_done
+        expected = max(m.bytes_expected, done)
+        ratio = done / expected if expected else 0.0
+        width = 30
+        bar = "#" * int(ratio * width)
+        line = (
+            f"\r[{bar:<{width}}] {ratio:6.1%} {format_size(done)}/{format_size(expected)}"
+            f" {format_size(m.throughput())}/s, {m.in_flight} in flight, {m.retries} retries, {m.failures} failed"
+        )
+        self.stream.write(line)
+        self.stream.flush()
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+METRICS = TransferMetrics()
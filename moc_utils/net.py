@@ -0,0 +1,147 @@
+import os
+import threading
+from dataclasses import dataclass
+from dataclasses import replace
+from typing import Any
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import limiter
+from .metrics import METRICS
+
+# same as the default worker count of concurrent.futures.ThreadPoolExecutor
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+
+@dataclass(frozen=True)
+class SessionConfig:
+    """
+    Settings of the shared http session.
+
+    Parameters
+    ---
+    pool_size: int
+        max. number of kept-alive connections per host, should match the worker count.
+    retries: int
+        max. number of retries on connection errors and retryable status codes.
+    backoff_factor: float
+        base of the exponential backoff between retries (factor * 2 ** (retry - 1)).
+    status_forcelist: tuple[int, ...]
+        status codes that trigger a retry.
+    connect_timeout: float
+        timeout in seconds for establishing a connection.
+    read_timeout: float
+        timeout in seconds between two received packets.
+    """
+
+    pool_size: int = DEFAULT_WORKERS
+    retries: int = 5
+    backoff_factor: float = 0.5
+    status_forcelist: tuple[int, ...] = (429, 500, 502, 503, 504)
+    connect_timeout: float = 10.0
+    read_timeout: float = 60.0
+
+    @property
+    def timeout(self) -> tuple[float, float]:
+        return (self.connect_timeout, self.read_timeout)
+
+
+class CountingRetry(Retry):
+    # reports every retry to the transfer metrics and the adaptive limiter
+    def increment(self, *args: Any, **kwargs: Any) -> Retry:
+        # raises once the retries are exhausted, the final failed attempt isn't a retry
+        retry = super().increment(*args, **kwargs)
+        METRICS.record_retry()
+        active_limiter = limiter.get_limiter()
+        if active_limiter is not None:
+            response = kwargs.get("response")
+            if response is None or response.status in limiter.CONGESTION_STATUS:
+                active_limiter.congestion()
+        return retry
+
+
+_lock = threading.Lock()
+_config = SessionConfig()
+_session: Optional[requests.Session] = None
+
+
+def configure(**kwargs: Any) -> SessionConfig:
+    """
+    Updates the settings of the shared session.
+    The current session is closed and recreated on its next use.
+
+    Args:
+        **kwargs: fields of SessionConfig to change.
+
+    Returns:
+        SessionConfig: The new settings.
+    """
+    global _config, _session
+    with _lock:
+        _config = replace(_config, **{k: v for k, v in kwargs.items() if v is not None})
+        if _session is not None:
+            _session.close()
+            _session = None
+        return _config
+
+
+def get_config() -> SessionConfig:
+    return _config
+
+
+def create_session(config: SessionConfig) -> requests.Session:
+    retry = CountingRetry(
+        total=config.retries,
+        connect=config.retries,
+        read=config.retries,
+        status=config.retries,
+        backoff_factor=config.backoff_factor,
+        status_forcelist=config.status_forcelist,
+        # the billboard api uses POST for plain queries, so it's safe to retry as well
+        allowed_methods=frozenset({"HEAD", "GET", "POST"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=config.pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """Returns the shared session, it's safe to use it from multiple threads."""
+    global _session
+    session = _session
+    if session is None:
+        with _lock:
+            if _session is None:
+                _session = create_session(_config)
+            session = _session
+    return session
+
+
+def request(method: str, url: str, **kwargs: Any) -> requests.Response:
+    """
+    Sends a request via the shared session.
+
+    Args:
+        method (str): The http method.
+        url (str): The url to request.
+        **kwargs: Passed to requests.Session.request, the timeout defaults to the configured one.
+
+    Returns:
+        requests.Response: The response.
+    """
+    kwargs.setdefault("timeout", _config.timeout)
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs: Any) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs: Any) -> requests.Response:
+    return request("POST", url, **kwargs)
@@ -10,6 +10,7 @@ from typing import TypedDict
 
 import requests
 
+from . import net
 from .asset_api import REGION
 from .asset_api import AssetAPIHandler
 from .asset_api import FileInfo
@@ -122,7 +123,7 @@ class TapSDKBillboard:
             }
         )
         headers = self._get_announcement_headers()
-        res = requests.post(url, data=content, headers=headers)
+        res = net.post(url, data=content, headers=headers)
         return self._process_announcement_response(res)  # type: ignore
 
     def get_announcement_detail_json(self, news_id: int, language: LANGUAGE = "en_US") -> AnnouncementDetail:
@@ -133,7 +134,7 @@ class TapSDKBillboard:
             "client_id": self.client_id,
         }
         headers = self._get_announcement_headers()
-        res = requests.get(url, params=query, headers=headers)
+        res = net.get(url, params=query, headers=headers)
         return self._process_announcement_response(res)  # type: ignore
 
     def _process_announcement_response(self, response: requests.Response) -> dict[str, Any]:
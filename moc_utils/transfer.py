@@ -0,0 +1,167 @@
+import hashlib
+import os
+import re
+from typing import Optional
+
+from . import limiter
+from . import net
+from .metrics import METRICS
+
+# size of the chunks written to disk while streaming a download
+CHUNK_SIZE = 1 << 20
+
+
+class TransferError(Exception):
+    pass
+
+
+def part_path(dst: str, version: Optional[str] = None) -> str:
+    # the version keeps a part of an outdated file from being resumed with the data of the new one
+    return f"{dst}.{version}.part" if version else f"{dst}.part"
+
+
+def is_md5_hexdigest(value: Optional[str]) -> bool:
+    # only full md5 digests can be verified,
+    # the 16 character hashes of the assets aren't plain md5s of the file content
+    return value is not None and re.fullmatch(r"[0-9a-fA-F]{32}", value) is not None
+
+
+def hash_file(fp: str, hasher: Optional["hashlib._Hash"] = None, chunk_size: int = CHUNK_SIZE) -> "hashlib._Hash":
+    if hasher is None:
+        hasher = hashlib.md5()
+    with open(fp, "rb") as f:
+        while chunk := f.read(chunk_size):
+            hasher.update(chunk)
+    return hasher
+
+
+def stream_to_file(
+    url: str,
+    dst: str,
+    size: Optional[int] = None,
+    md5: Optional[str] = None,
+    resume: bool = True,
+    chunk_size: int = CHUNK_SIZE,
+) -> int:
+    """
+    Streams the content of the url into dst without holding it in memory.
+    The data is written to dst.{md5}.part first and renamed to dst once complete,
+    so dst is either missing or complete, but never partially written.
+
+    If a .part file of a previous attempt at the same version exists, the download continues from its end
+    via a Range request. Servers that ignore the Range header, or reject the range, cause a full download.
+    Without md5, the version of a .part file is unknown, so it is never resumed.
+
+    Args:
+        url (str): The url to download.
+        dst (str): The path to store the file at.
+        size (Optional[int]): The expected size of the file.
+        md5 (Optional[str]): The md5 of the file, only full hexdigests are verified,
+            shortened ones only identify the version of the .part file.
+        resume (bool): Whether to continue an existing .part file.
+        chunk_size (int): The number of bytes written at once.
+
+    Raises:
+        TransferError: The downloaded file doesn't match the expected size or md5.
+
+    Returns:
+        int: The size of the file.
+    """
+    dirname = os.path.dirname(dst)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+
+    version = md5
+    part = part_path(dst, version)
+    if not is_md5_hexdigest(md5):
+        md5 = None
+
+    offset = os.path.getsize(part) if resume and version and os.path.exists(part) else 0
+    if size is not None and offset > size:
+        offset = 0
+
+    total = _fetch_part(url, part, offset, size, chunk_size)
+    try:
+        _validate_part(part, total, size, md5, chunk_size)
+    except TransferError:
+        os.remove(part)
+        if not offset:
+            raise
+        # the old part might have been the broken one, so retry once without it
+        total = _fetch_part(url, part, 0, size, chunk_size)
+        try:
+            _validate_part(part, total, size, md5, chunk_size)
+        except TransferError:
+            os.remove(part)
+            raise
+
+    os.replace(part, dst)
+    return total
+
+
+def _fetch_part(url: str, part: str, offset: int, size: Optional[int], chunk_size: int) -> int:
+    # downloads the missing data into the part file, returns the size of the part file
+    if offset and offset == size:
+        # previous attempt finished writing, but failed to rename
+        return offset
+
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with limiter.slot() as slot, METRICS.track() as tracker, net.get(url, stream=True, headers=headers) as res:
+        # range not satisfiable - the part doesn't fit the file, as a complete part was handled above
+        rejected = bool(offset) and res.status_code == 416
+        if not rejected:
+            res.raise_for_status()
+
+            content_range = res.headers.get("Content-Range", "")
+            if offset and (res.status_code != 206 or not content_range.startswith(f"bytes {offset}-")):
+                # server ignored the range request and sends the whole file
+                offset = 0
+
+            with open(part, "ab" if offset else "wb") as f:
+                for chunk in res.iter_content(chunk_size):
+                    tracker.first_byte()
+                    slot.first_byte()
+                    f.write(chunk)
+                    offset += len(chunk)
+                    slot.add_bytes(len(chunk))
+                    METRICS.record_bytes(len(chunk))
+                # make sure the data is on disk before the file gets renamed and recorded as done
+                f.flush()
+                os.fsync(f.fileno())
+    if rejected:
+        # outside of the limiter slot, so that a limit of one doesn't block the retry
+        return _fetch_part(url, part, 0, size, chunk_size)
+    return offset
+
+
+def _validate_part(part: str, total: int, size: Optional[int], md5: Optional[str], chunk_size: int) -> None:
+    if size is not None and total != size:
+        raise TransferError(f"{part}: expected {size} bytes, got {total}")
+    if md5 is not None:
+        digest = hash_file(part, chunk_size=chunk_size).hexdigest()
+        if digest != md5.lower():
+            raise TransferError(f"{part}: expected md5 {md5}, got {digest}")
+
+
+def is_up_to_date(fp: str, size: Optional[int] = None, md5: Optional[str] = None) -> bool:
+    """
+    Checks if the local file matches the expected size and md5.
+    The md5 is only checked if the size matches, as hashing is way more expensive than a stat.
+
+    Args:
+        fp (str): The path of the local file.
+        size (Optional[int]): The expected size of the file.
+        md5 (Optional[str]): The expected md5 hexdigest of the file.
+
+    Returns:
+        bool: True if the file exists and matches.
+    """
+    try:
+        local_size = os.path.getsize(fp)
+    except OSError:
+        return False
+    if size is not None and local_size != size:
+        return False
+    if md5 is not None and is_md5_hexdigest(md5):
+        return hash_file(fp).hexdigest() == md5.lower()
+    return True
@@ -0,0 +1,126 @@
+import concurrent.futures
+import hashlib
+import mmap
+import os
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Optional
+
+# files written by the downloader itself, which aren't listed by the server
+BOOKKEEPING_SUFFIXES = (".part", ".link", ".tmp", "file_hash.txt", "file_hash.txt.journal")
+# the temporary ones among them, left behind by interrupted downloads
+LEFTOVER_SUFFIXES = (".part", ".link", ".tmp")
+ASSET_SUFFIX = ".unity3d"
+
+
+@dataclass
+class VerifyReport:
+    ok: list[str] = field(default_factory=list)
+    missing: list[str] = field(default_factory=list)
+    corrupt: list[str] = field(default_factory=list)
+    orphaned: list[str] = field(default_factory=list)
+    leftovers: list[str] = field(default_factory=list)
+    unverified_hashes: int = 0
+
+    @property
+    def intact(self) -> bool:
+        return not self.missing and not self.corrupt
+
+    @property
+    def prunable(self) -> list[str]:
+        # only files the downloader wrote itself, anything else in the directory might belong to the user
+        return [name for name in self.orphaned if name.endswith(ASSET_SUFFIX)] + self.leftovers
+
+    def print_summary(self) -> None:
+        for name in self.missing:
+            print(f"missing: {name}")
+        for name in self.corrupt:
+            print(f"corrupt: {name}")
+        for name in self.orphaned:
+            print(f"orphaned: {name}")
+        for name in self.leftovers:
+            print(f"leftover: {name}")
+        if self.unverified_hashes:
+            print(f"Warning: only the sizes of {self.unverified_hashes} files with shortened hashes were checked.")
+        counts = {
+            "ok": self.ok,
+            "missing": self.missing,
+            "corrupt": self.corrupt,
+            "orphaned": self.orphaned,
+            "leftover": self.leftovers,
+        }
+        print(", ".join(f"{len(names)} {label}" for label, names in counts.items()))
+
+
+def hash_file_mmap(fp: str) -> str:
+    # mmap avoids copying the file into python objects, hashlib releases the gil for large buffers
+    if os.path.getsize(fp) == 0:
+        return hashlib.md5().hexdigest()
+    with open(fp, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return hashlib.md5(mm).hexdigest()
+
+
+def verify_files(
+    root: str,
+    expected: dict[str, tuple[Optional[int], Optional[str]]],
+    workers: Optional[int] = None,
+) -> VerifyReport:
+    """
+    Checks the files below root against their expected size and md5.
+    Files with the expected size are hashed in parallel by a process pool.
+
+    The assets are listed with shortened 16 character hashes, which can't be derived from the file content,
+    so only the sizes of those files are checked.
+
+    Args:
+        root (str): The directory holding the files.
+        expected (dict[str, tuple[Optional[int], Optional[str]]]): relative path -> (size, md5) of the files.
+        workers (Optional[int]): The number of processes, defaults to the number of cores.
+
+    Returns:
+        VerifyReport: The result of the check.
+    """
+    report = VerifyReport()
+
+    to_hash: list[str] = []
+    for name, (size, md5) in expected.items():
+        fp = os.path.join(root, name)
+        try:
+            local_size = os.path.getsize(fp)
+        except OSError:
+            report.missing.append(name)
+            continue
+        if size is not None and local_size != size:
+            report.corrupt.append(name)
+        elif md5 and len(md5) == 32:
+            to_hash.append(name)
+        else:
+            report.ok.append(name)
+            if md5:
+                report.unverified_hashes += 1
+
+    digests: list[str] = []
+    # starting the worker processes isn't worth it if there is nothing to hash
+    if to_hash:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            fps = [os.path.join(root, name) for name in to_hash]
+            chunksize = max(1, len(fps) // (4 * (os.cpu_count() or 1)))
+            digests = list(pool.map(hash_file_mmap, fps, chunksize=chunksize))
+
+    for name, digest in zip(to_hash, digests):
+        md5: str = expected[name][1]  # type: ignore
+        if digest == md5.lower():
+            report.ok.append(name)
+        else:
+            report.corrupt.append(name)
+
+    known = {os.path.normpath(name) for name in expected}
+    for dirpath, _dirs, files in os.walk(root):
+        for file in files:
+            name = os.path.relpath(os.path.join(dirpath, file), root)
+            if file.endswith(LEFTOVER_SUFFIXES):
+                report.leftovers.append(name)
+            elif not file.endswith(BOOKKEEPING_SUFFIXES) and name not in known:
+                report.orphaned.append(name)
+
+    return report
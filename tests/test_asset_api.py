@@ -0,0 +1,43 @@
+from typing import Any
+from typing import Optional
+
+import pytest
+
+from moc_utils import asset_api
+from moc_utils.metrics import METRICS
+
+DATA = bytes(range(256)) * 16
+
+
+class FakeResponse:
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    def __enter__(self) -> "FakeResponse":
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        pass
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def iter_content(self, chunk_size: int) -> Any:
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i : i + chunk_size]
+
+
+def test_get_file_streams(monkeypatch: pytest.MonkeyPatch) -> None:
+    requests: list[tuple[str, bool]] = []
+
+    def get(url: str, stream: bool = False, headers: Optional[dict[str, str]] = None) -> FakeResponse:
+        requests.append((url, stream))
+        return FakeResponse(DATA)
+
+    monkeypatch.setattr(asset_api.net, "get", get)
+    monkeypatch.setattr(asset_api.transfer, "CHUNK_SIZE", 1000)
+    METRICS.reset()
+    handler = asset_api.AssetAPIHandler(url_asset="https://cdn/")
+    assert handler.get_file("pc", "GameFileInfo.json") == DATA
+    assert requests == [("https://cdn/pc/GameFileInfo.json", True)]
+    assert METRICS.bytes_done == len(DATA)
@@ -0,0 +1,59 @@
+import os
+from typing import Any
+
+from moc_utils.blob_store import BlobStore
+from moc_utils.blob_store import link_file
+
+
+def test_fetch_downloads_once(tmp_path: Any) -> None:
+    store = BlobStore(str(tmp_path / "store"))
+    downloads: list[str] = []
+
+    def download(fp: str) -> int:
+        downloads.append(fp)
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+        with open(fp, "wb") as f:
+            f.write(b"blob")
+        return 4
+
+    us = str(tmp_path / "us" / "a.unity3d")
+    jp = str(tmp_path / "jp" / "a.unity3d")
+    assert store.fetch("abcdef", us, download) == 4
+    assert store.fetch("abcdef", jp, download) == 0
+    assert downloads == [store.path("abcdef")]
+    for fp in (us, jp):
+        with open(fp, "rb") as f:
+            assert f.read() == b"blob"
+    assert store.has("abcdef") and store.size() == 4
+
+
+def test_evict_least_recently_used(tmp_path: Any) -> None:
+    store = BlobStore(str(tmp_path / "store"), max_size=10)
+    for i, md5 in enumerate(("aa11", "bb22", "cc33")):
+        src = str(tmp_path / md5)
+        with open(src, "wb") as f:
+            f.write(b"x" * 5)
+        store.add(md5, src)
+        os.utime(store.path(md5), (i, i))
+    linked = str(tmp_path / "tree" / "a.unity3d")
+    link_file(store.path("aa11"), linked)
+
+    assert store.evict() == 5
+    assert not store.has("aa11") and store.has("bb22") and store.has("cc33")
+    # the linked copy in the asset tree stays
+    assert os.path.getsize(linked) == 5
+    assert store.evict(0) == 10
+
+
+def test_link_file_replaces_dst(tmp_path: Any) -> None:
+    src = str(tmp_path / "src")
+    dst = str(tmp_path / "sub" / "dst")
+    with open(src, "wb") as f:
+        f.write(b"new")
+    os.makedirs(os.path.dirname(dst))
+    with open(dst, "wb") as f:
+        f.write(b"old")
+    link_file(src, dst)
+    with open(dst, "rb") as f:
+        assert f.read() == b"new"
+    assert not os.path.exists(f"{dst}.link")
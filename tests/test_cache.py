@@ -0,0 +1,28 @@
+import os
+from typing import Any
+
+import pytest
+
+from moc_utils import cache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> str:
+    monkeypatch.setenv("MOC_UTILS_CACHE_DIR", str(tmp_path))
+    monkeypatch.delenv("MOC_UTILS_NO_CACHE", raising=False)
+    return str(tmp_path)
+
+
+def test_json_round_trip(cache_dir: str) -> None:
+    assert cache.read_json("version.json") is None
+    cache.write_json("version.json", {"a": [1, 2]})
+    assert cache.read_json("version.json") == {"a": [1, 2]}
+    os.utime(os.path.join(cache_dir, "version.json"), (0, 0))
+    assert cache.read_json("version.json", max_age=cache.VERSION_TTL) is None
+    assert cache.read_json("version.json") == {"a": [1, 2]}
+
+
+def test_disabled(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("MOC_UTILS_NO_CACHE", "1")
+    cache.write_json("version.json", {"a": 1})
+    assert cache.read_json("version.json") is None
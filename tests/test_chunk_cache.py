@@ -0,0 +1,49 @@
+import os
+from typing import Any
+
+import pytest
+
+from moc_utils.export.lua.chunk_cache import LuaChunkCache
+from moc_utils.export.lua.chunk_cache import chunk_key
+from moc_utils.export.lua.chunk_cache import library_key
+
+
+def test_chunks_persist(tmp_path: Any) -> None:
+    root = str(tmp_path / "lib")
+    key = chunk_key("dump", b"return 1")
+    cache = LuaChunkCache(root)
+    assert cache.get(key) is None
+    cache.put(key, b"\x1bLua")
+
+    cache = LuaChunkCache(root)
+    assert cache.get(key) == b"\x1bLua"
+    assert (cache.hits, cache.misses) == (1, 0)
+    cache.discard(key)
+    assert LuaChunkCache(root).get(key) is None
+
+
+def test_keys() -> None:
+    assert chunk_key("a", b"return 1") != chunk_key("b", b"return 1")
+    assert chunk_key("a", b"return 1") != chunk_key("a", b"return 2")
+
+
+def test_prune(tmp_path: Any) -> None:
+    old = LuaChunkCache(str(tmp_path / "old_lib"))
+    old.put("a", b"old")
+    current = LuaChunkCache(str(tmp_path / "lib"))
+    current.put("b", b"new")
+    os.utime(os.path.join(old.root, "a.luac"), (0, 0))  # type: ignore
+    current.prune()
+    assert LuaChunkCache(old.root).get("a") is None
+    assert LuaChunkCache(current.root).get("b") == b"new"
+
+
+def test_default(tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> None:
+    lib_fp = str(tmp_path / "slua.dll")
+    with open(lib_fp, "wb") as f:
+        f.write(b"library")
+    monkeypatch.setenv("MOC_UTILS_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.delenv("MOC_UTILS_NO_CACHE", raising=False)
+    assert LuaChunkCache.default(lib_fp).root == os.path.join(tmp_path, "cache", "lua_chunks", library_key(lib_fp))
+    monkeypatch.setenv("MOC_UTILS_NO_CACHE", "1")
+    assert LuaChunkCache.default(lib_fp).root is None
@@ -0,0 +1,77 @@
+import asyncio
+
+from moc_utils.engine import AsyncDownloadEngine
+from moc_utils.engine import ByteBudget
+from moc_utils.engine import DownloadJob
+from moc_utils.engine import schedule_by_size
+
+
+def jobs_of(sizes: list[int]) -> list[DownloadJob]:
+    return [DownloadJob(f"job_{i}", size, print) for i, size in enumerate(sizes)]
+
+
+def test_schedule_keeps_every_job() -> None:
+    jobs = jobs_of([5, 1, 100, 3, 3, 50, 0, 7])
+    for concurrency in (0, 1, 2, 3, 8, 100):
+        scheduled = schedule_by_size(jobs, concurrency)
+        assert sorted(job.name for job in scheduled) == sorted(job.name for job in jobs)
+
+
+def test_schedule_spreads_large_jobs() -> None:
+    # 100 and 90 make up half of the bytes
+    jobs = jobs_of([10] * 19 + [100, 90])
+    scheduled = schedule_by_size(jobs, 4)
+    assert [job.size for job in scheduled[:8]] == [100, 90, 10, 10, 10, 10, 10, 10]
+
+    scheduled = schedule_by_size(jobs, 2)
+    assert [job.size for job in scheduled[:4]] == [100, 10, 90, 10]
+
+
+def test_schedule_large_jobs_left_at_the_end() -> None:
+    # job_0 to job_2 are large, the other jobs run out first
+    scheduled = schedule_by_size(jobs_of([10, 10, 10, 10, 1]), 2)
+    assert [job.name for job in scheduled] == ["job_0", "job_3", "job_1", "job_4", "job_2"]
+    assert schedule_by_size([], 2) == []
+
+
+def test_byte_budget_admits_in_order() -> None:
+    async def run() -> list[str]:
+        budget = ByteBudget(10)
+        admitted: list[str] = []
+
+        async def job(name: str, size: int) -> None:
+            await budget.acquire(size)
+            admitted.append(name)
+
+        await budget.acquire(8)
+        # the large job waits, the small one mustn't overtake it
+        tasks = [asyncio.create_task(job("large", 20)), asyncio.create_task(job("small", 1))]
+        await asyncio.sleep(0)
+        assert admitted == []
+        budget.release(8)
+        await asyncio.sleep(0)
+        # larger than the whole budget, admitted once nothing else is running
+        assert admitted == ["large"]
+        budget.release(20)
+        await asyncio.gather(*tasks)
+        assert budget.used == 1
+        return admitted
+
+    assert asyncio.run(run()) == ["large", "small"]
+
+
+def test_engine_collects_failures() -> None:
+    done: list[str] = []
+
+    def download(name: str) -> str:
+        if name == "bad":
+            raise ValueError(name)
+        return name
+
+    jobs = [DownloadJob(name, 1, download, (name,)) for name in ("a", "bad", "b")]
+    engine = AsyncDownloadEngine(2, 1, on_complete=lambda job, value: done.append(value))
+    result = engine.run(jobs)
+    assert sorted(result.completed) == ["a", "b"] == sorted(done)
+    assert list(result.failed) == ["bad"]
+    assert result.bytes_done == 2
+    assert not result.ok
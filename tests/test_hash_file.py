@@ -0,0 +1,83 @@
+import os
+from typing import Any
+
+from moc_utils.hash_file import AssetHashIndex
+from moc_utils.hash_file import AssetHashJournal
+
+MD5_A = "0123456789abcdef"
+MD5_B = "fedcba9876543210"
+
+
+def test_journal_replay(tmp_path: Any) -> None:
+    fp = str(tmp_path / "file_hash.txt")
+    with open(fp, "wb") as f:
+        f.write(f"a|{MD5_A}|100\r\nb|{MD5_A}|100\r\n".encode())
+
+    journal = AssetHashJournal(fp)
+    with journal:
+        journal.record("b", MD5_B)
+        journal.record("c", MD5_A)
+    # an interrupted sync leaves the journal behind, the next one replays it
+    assert os.path.exists(journal.journal_fp)
+    index = journal.load()
+    assert {key: index.md5(key) for key in index} == {"a": MD5_A, "b": MD5_B, "c": MD5_A}
+    assert index.timestamp("a") == 100
+
+    index.retain({"b", "c"})
+    journal.compact(index)
+    assert not os.path.exists(journal.journal_fp)
+    assert sorted(AssetHashIndex.load(fp)) == ["b", "c"]
+
+
+def test_journal_partial_last_line(tmp_path: Any) -> None:
+    fp = str(tmp_path / "file_hash.txt")
+    journal = AssetHashJournal(fp)
+    # a crash while writing the journal
+    with open(journal.journal_fp, "wb") as f:
+        f.write(f"a|{MD5_A}|100\r\nb|{MD5_A[:5]}".encode())
+    with journal:
+        journal.record("c", MD5_B)
+    index = journal.load()
+    assert {key: index.md5(key) for key in index} == {"a": MD5_A, "c": MD5_B}
+
+
+def test_index_writes_changes_in_place(tmp_path: Any) -> None:
+    fp = str(tmp_path / "file_hash.txt")
+    with open(fp, "wb") as f:
+        f.write(f"a|{MD5_A}|100\r\nbroken\r\nb|{MD5_A}|100\r\n".encode())
+    index = AssetHashIndex.load(fp)
+    assert index.set("a", MD5_A) is False
+    assert index.set("b", MD5_B, 200) is True
+    index.set("c", MD5_B, 300)
+    index.write(fp)
+    with open(fp, "rb") as f:
+        # the malformed line is kept, as only the changed lines are touched
+        assert f.read() == f"a|{MD5_A}|100\r\nbroken\r\nb|{MD5_B}|200\r\nc|{MD5_B}|300\r\n".encode()
+
+
+def test_index_with_invalid_utf8(tmp_path: Any) -> None:
+    fp = str(tmp_path / "file_hash.txt")
+    with open(fp, "wb") as f:
+        f.write(b"\xff\xfe|" + f"{MD5_A}|100\r\nb|{MD5_A}|100\r\n".encode())
+    index = AssetHashIndex.load(fp)
+    # offsets are counted in bytes, not in decoded characters
+    assert index._offsets[index._index["b"]] == 25
+    index.set("b", MD5_B, 200)
+    index.write(fp)
+    with open(fp, "rb") as f:
+        assert f.read() == f"\ufffd\ufffd|{MD5_A}|100\r\nb|{MD5_B}|200\r\n".encode()
+    assert list(AssetHashIndex.load(fp).items()) == [("\ufffd\ufffd", MD5_A, 100), ("b", MD5_B, 200)]
+
+
+def test_index_rewrites_after_removal(tmp_path: Any) -> None:
+    fp = str(tmp_path / "file_hash.txt")
+    index = AssetHashIndex()
+    for key in "abc":
+        index.set(key, MD5_A, 100)
+    index.write(fp)
+    index.remove("b")
+    index.set("c", MD5_B, 1000)
+    index.write(fp)
+    with open(fp, "rb") as f:
+        assert f.read() == f"a|{MD5_A}|100\r\nc|{MD5_B}|1000\r\n".encode()
+    assert list(AssetHashIndex.load(fp).items()) == [("a", MD5_A, 100), ("c", MD5_B, 1000)]
@@ -0,0 +1,44 @@
+import json
+import math
+
+import pytest
+
+from moc_utils.export.lua import json_writer
+from moc_utils.export.lua.dump import json_table_writer
+from moc_utils.export.lua.handler import lua_number
+from moc_utils.export.lua.handler import table_to_python
+from moc_utils.export.lua.sink import MemorySink
+
+
+def test_table_to_python() -> None:
+    assert table_to_python([]) == []
+    assert table_to_python([(2, "b"), (1, "a")]) == ["a", "b"]
+    assert table_to_python([(1, "a"), (3, "c")]) == {1: "a", 3: "c"}
+    assert list(table_to_python([("b", 1), (2, 2), ("a", 3), (1, 4)])) == [1, 2, "a", "b"]  # type: ignore
+    assert lua_number(3.0) == 3 and isinstance(lua_number(3.0), int)
+    assert lua_number(0.5) == 0.5
+
+
+def test_json_table_writer() -> None:
+    sink = MemorySink()
+    export_table = json_table_writer(sink)
+    export_table("db/empty", [])
+    export_table("db/list", ["a", "b"])
+    export_table("db/dict", {1: "a", "x": [1, 2]})
+    assert json.loads(sink.files["db/empty.json"]) == []
+    assert json.loads(sink.files["db/list.json"]) == {"1": "a", "2": "b"}
+    assert json.loads(sink.files["db/dict.json"]) == {"1": "a", "x": [1, 2]}
+
+
+@pytest.mark.parametrize("value", [math.nan, math.inf, -math.inf])
+def test_non_finite_numbers_are_null(value: float) -> None:
+    data = json.loads(json_writer.dumps({"a": value, "b": [1.5, value], "c": {"d": value}}))
+    assert data == {"a": None, "b": [1.5, None], "c": {"d": None}}
+
+
+def test_stdlib_fallback_matches(monkeypatch: pytest.MonkeyPatch) -> None:
+    data = {1: "ä", "b": [1, 2.5, None, True], "c": {}, "d": []}
+    expected = json_writer.dumps(data)
+    monkeypatch.setattr(json_writer, "orjson", None)
+    assert json.loads(json_writer.dumps(data)) == json.loads(expected)
+    assert "ä" in json_writer.dumps(data).decode("utf-8")
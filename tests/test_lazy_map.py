@@ -0,0 +1,58 @@
+from typing import Any
+
+from moc_utils.export.lua import dump
+from moc_utils.export.lua.lazy_map import LazyLuaMap
+from moc_utils.export.lua.lazy_map import LuaBundle
+from moc_utils.export.lua.script_cache import LuaScriptCache
+
+BUNDLES = {"a|1": {"x": b"a.x", "y": b"a.y"}, "b|1": {"x": b"b.x"}, "c|1": {"z": b"c.z"}}
+LUA_DIRS = ["dir", "", "dir"]
+
+
+def indexed_bundles() -> list[LuaBundle]:
+    # the key doubles as the path of the bundle
+    return [LuaBundle(key, lua_dir, key, list(BUNDLES[key])) for key, lua_dir in zip(BUNDLES, LUA_DIRS)]
+
+
+def fake_load(monkeypatch: Any) -> list[str]:
+    loads: list[str] = []
+
+    def load_lua_bundle(src: str, lua_dir: str) -> dict[str, bytes]:
+        loads.append(src)
+        return dict(BUNDLES[src])
+
+    monkeypatch.setattr(dump, "load_lua_bundle", load_lua_bundle)
+    return loads
+
+
+def test_parses_bundles_on_first_require(monkeypatch: Any) -> None:
+    loads = fake_load(monkeypatch)
+    lua_map = LazyLuaMap.from_bundles(indexed_bundles())
+    lua_map.max_bundles = 1
+    assert loads == [] and "missing" not in lua_map and len(lua_map) == 4
+    assert lua_map["dir/x"] == b"a.x"
+    assert lua_map["dir/y"] == b"a.y"
+    assert lua_map["dir/z"] == b"c.z"
+    assert dict(lua_map) == {"dir/x": b"a.x", "dir/y": b"a.y", "x": b"b.x", "dir/z": b"c.z"}
+    # without a script cache, evicted bundles are parsed again
+    assert loads == ["a|1", "c|1", "a|1", "b|1", "c|1"]
+    assert len(lua_map._loaded) == 1
+
+
+def test_caches_parsed_bundles(tmp_path: Any, monkeypatch: Any) -> None:
+    loads = fake_load(monkeypatch)
+    with LazyLuaMap.from_bundles(indexed_bundles(), LuaScriptCache(str(tmp_path))) as lua_map:
+        lua_map.max_bundles = 1
+        assert lua_map["dir/x"] == b"a.x"
+        assert lua_map["dir/z"] == b"c.z"
+        assert lua_map["dir/y"] == b"a.y"
+    assert loads == ["a|1", "c|1"]
+
+    script_cache = LuaScriptCache(str(tmp_path))
+    # b was only indexed, its names are known without its scripts
+    assert script_cache.names("b|1") == ["x"] and script_cache.get("b|1") is None
+    assert script_cache.get("a|1") == BUNDLES["a|1"]
+    bundles = [LuaBundle(key, lua_dir, key, script_cache.names(key)) for key, lua_dir in zip(BUNDLES, LUA_DIRS)]
+    with LazyLuaMap.from_bundles(bundles, script_cache) as lua_map:
+        assert dict(lua_map) == {"dir/x": b"a.x", "dir/y": b"a.y", "x": b"b.x", "dir/z": b"c.z"}
+    assert loads == ["a|1", "c|1", "b|1"]
@@ -0,0 +1,60 @@
+import pytest
+import requests
+
+from moc_utils.limiter import AdaptiveLimiter
+from moc_utils.limiter import LimiterSlot
+
+
+def test_grows_while_the_limit_is_used() -> None:
+    limiter = AdaptiveLimiter(floor=1, ceiling=3, initial=2, interval=0.0)
+    limiter.acquire()
+    limiter.acquire()
+    limiter.release()
+    limiter.record(0.1, 1000)
+    assert limiter.limit == 3
+    # capped by the ceiling
+    limiter.acquire()
+    limiter.acquire()
+    limiter.record(0.1, 1 << 20)
+    assert limiter.limit == 3
+
+
+def test_does_not_grow_unused_limit() -> None:
+    limiter = AdaptiveLimiter(floor=1, ceiling=8, initial=4, interval=0.0)
+    limiter.acquire()
+    limiter.record(0.1, 1000)
+    assert limiter.limit == 4
+
+
+def test_shrinks_on_climbing_latency() -> None:
+    limiter = AdaptiveLimiter(floor=1, ceiling=8, initial=4, interval=0.0)
+    limiter.record(0.1, 1000)
+    limiter.record(1.0, 1000)
+    assert limiter.limit == 3
+
+
+def test_congestion_shrinks_once_per_interval() -> None:
+    limiter = AdaptiveLimiter(floor=2, ceiling=16, initial=16, interval=60.0)
+    limiter.congestion()
+    limiter.congestion()
+    assert limiter.limit == 8
+    for _ in range(3):
+        # as if the interval passed
+        limiter._last_decrease -= 60.0
+        limiter.congestion()
+    assert limiter.limit == 2
+
+
+def test_slot_reports_congestion() -> None:
+    limiter = AdaptiveLimiter(floor=1, ceiling=8, initial=8, interval=60.0)
+    response = requests.Response()
+    response.status_code = 503
+    with pytest.raises(requests.HTTPError), LimiterSlot(limiter):
+        raise requests.HTTPError(response=response)
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
+
+    response.status_code = 404
+    with pytest.raises(requests.HTTPError), LimiterSlot(limiter):
+        raise requests.HTTPError(response=response)
+    assert limiter.limit == 4
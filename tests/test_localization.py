@@ -0,0 +1,45 @@
+import re
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+import pytest
+
+from moc_utils.export.lua import dump
+from moc_utils.export.lua.sink import MemorySink
+
+LUA_MAP = {"dblang_en/a": b"", "dblang_en/b": b"", "dblang_ja/a": b"", "dblang_ko/a": b"", "other/x": b""}
+
+
+class FakeSession:
+    # runs the localization code by exporting a table per required script
+    def __init__(self, _slua_fp: str, _loader: Any) -> None:
+        self.exporter: Optional[Callable[[str, Any], None]] = None
+
+    def __enter__(self) -> "FakeSession":
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        pass
+
+    def set_exporter(self, exporter: Optional[Callable[[str, Any], None]]) -> None:
+        self.exporter = exporter
+
+    def run(self, code: str) -> None:
+        for key in re.findall(r'export_loc\("([^"]+)"\)', code):
+            if key.startswith("dblang_ko"):
+                raise Exception("broken")
+            self.exporter(key[len("dblang_") :], [])  # type: ignore
+
+
+@pytest.fixture(autouse=True)
+def fake_session(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(dump, "LuaSession", FakeSession)
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_failing_language_is_reported(processes: int) -> None:
+    sink = MemorySink()
+    errors = dump.dump_localization(sink, "slua", LUA_MAP, processes=processes)
+    assert errors == {"ko": "broken"}
+    assert sorted(sink.files) == ["en/a.json", "en/b.json", "ja/a.json"]
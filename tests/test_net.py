@@ -0,0 +1,29 @@
+import pytest
+from urllib3.exceptions import MaxRetryError
+from urllib3.exceptions import ProtocolError
+
+from moc_utils import limiter
+from moc_utils.metrics import METRICS
+from moc_utils.net import CountingRetry
+
+
+class FakeLimiter:
+    def __init__(self) -> None:
+        self.congestions = 0
+
+    def congestion(self) -> None:
+        self.congestions += 1
+
+
+def test_counting_retry_ignores_the_exhausted_attempt(monkeypatch: pytest.MonkeyPatch) -> None:
+    fake = FakeLimiter()
+    monkeypatch.setattr(limiter, "_limiter", fake)
+    METRICS.reset()
+    retry = CountingRetry(total=2)
+    error = ProtocolError("connection reset")
+    retry = retry.increment("GET", "/", error=error)
+    retry = retry.increment("GET", "/", error=error)
+    with pytest.raises(MaxRetryError):
+        retry.increment("GET", "/", error=error)
+    assert METRICS.retries == 2
+    assert fake.congestions == 2
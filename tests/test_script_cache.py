@@ -0,0 +1,89 @@
+import json
+import os
+from typing import Any
+
+from moc_utils.export.lua.script_cache import LuaScriptCache
+from moc_utils.export.lua.script_cache import bundle_name
+from moc_utils.export.lua.script_cache import local_bundle_key
+from moc_utils.export.lua.script_cache import remote_bundle_key
+
+CDN_1 = "https://cdn-1.example/assets/"
+CDN_2 = "https://cdn-2.example/assets/"
+
+
+def test_round_trip(tmp_path: Any) -> None:
+    cache = LuaScriptCache(str(tmp_path))
+    cache.put(remote_bundle_key(CDN_1, "lua/lua_x", "a"), {"x/a": b"return 1", "x/b": b""})
+    cache.put(remote_bundle_key(CDN_1, "lua/lua_", "a"), {})
+    cache.save()
+    cache.close()
+
+    with LuaScriptCache(str(tmp_path)) as cache:
+        assert cache.get(remote_bundle_key(CDN_1, "lua/lua_x", "a")) == {"x/a": b"return 1", "x/b": b""}
+        assert cache.names(remote_bundle_key(CDN_1, "lua/lua_x", "a")) == ["x/a", "x/b"]
+        assert cache.get(remote_bundle_key(CDN_1, "lua/lua_", "a")) == {}
+        assert cache.get(remote_bundle_key(CDN_1, "lua/lua_x", "b")) is None
+        assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_save_drops_old_versions_of_the_same_source(tmp_path: Any) -> None:
+    old = remote_bundle_key(CDN_1, "lua/lua_x", "a")
+    new = remote_bundle_key(CDN_1, "lua/lua_x", "b")
+    other_cdn = remote_bundle_key(CDN_2, "lua/lua_x", "a")
+    with LuaScriptCache(str(tmp_path)) as cache:
+        for key in (old, new, other_cdn):
+            cache.put(key, {"x/a": key.encode()})
+        cache.save(current=[new])
+        assert set(cache.bundles) == {new, other_cdn}
+        assert cache.get(other_cdn) == {"x/a": other_cdn.encode()}
+
+
+def test_save_keeps_bundles_of_other_game_dirs(tmp_path: Any) -> None:
+    keys = []
+    for game in ("game_1", "game_2"):
+        os.makedirs(tmp_path / game)
+        fp = tmp_path / game / "lua_x.unity3d"
+        fp.write_bytes(b"bundle")
+        keys.append(local_bundle_key(str(fp)))
+    assert keys[0] != keys[1] and bundle_name(keys[0]) != bundle_name(keys[1])
+    with LuaScriptCache(str(tmp_path / "cache")) as cache:
+        for key in keys:
+            cache.put(key, {"x/a": b""})
+        cache.save(current=keys[:1])
+        assert set(cache.bundles) == set(keys)
+
+
+def test_pack_is_rewritten_once_mostly_dead(tmp_path: Any) -> None:
+    keys = [remote_bundle_key(CDN_1, "lua/lua_x", md5) for md5 in "abc"]
+    with LuaScriptCache(str(tmp_path)) as cache:
+        for key in keys:
+            cache.put(key, {"x/a": key.encode() * 100})
+        cache.save(current=keys[-1:])
+        assert os.path.getsize(cache.pack_fp) == len(keys[-1]) * 100
+    with LuaScriptCache(str(tmp_path)) as cache:
+        assert cache.get(keys[-1]) == {"x/a": keys[-1].encode() * 100}
+
+
+def test_index_of_another_version_is_ignored(tmp_path: Any) -> None:
+    with LuaScriptCache(str(tmp_path)) as cache:
+        cache.put(remote_bundle_key(CDN_1, "lua/lua_x", "a"), {"x/a": b"1"})
+        cache.save()
+    with open(os.path.join(tmp_path, "scripts.index.json"), "wt", encoding="utf8") as f:
+        json.dump({"bundles": {"lua/lua_x|a": [["x/a", 0, 1]]}}, f)
+    with LuaScriptCache(str(tmp_path)) as cache:
+        assert cache.bundles == {}
+
+
+def test_names_without_scripts(tmp_path: Any) -> None:
+    key = remote_bundle_key(CDN_1, "lua/lua_x", "a")
+    with LuaScriptCache(str(tmp_path)) as cache:
+        cache.put_names(key, ["x/a"])
+        cache.save()
+
+    with LuaScriptCache(str(tmp_path)) as cache:
+        assert cache.names(key) == ["x/a"]
+        assert cache.get(key) is None
+        cache.put(key, {"x/a": b"return 1"})
+        # known scripts aren't replaced by names
+        cache.put_names(key, ["x/a"])
+        assert cache.get(key) == {"x/a": b"return 1"}
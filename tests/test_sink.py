@@ -0,0 +1,93 @@
+import os
+import tarfile
+import zipfile
+from typing import Any
+
+import pytest
+
+from moc_utils.export.lua import sink as sink_module
+from moc_utils.export.lua.session import LuaFileSystem
+from moc_utils.export.lua.sink import DirectorySink
+from moc_utils.export.lua.sink import DumpSink
+from moc_utils.export.lua.sink import MemorySink
+from moc_utils.export.lua.sink import TarSink
+from moc_utils.export.lua.sink import ZipSink
+from moc_utils.export.lua.sink import open_sink
+from moc_utils.export.lua.sink import sink_for
+
+FILES = {"db/a.json": b"[]", "db/sub/b.json": b'{"1": 2}', "en/c.json": bytes(range(256))}
+
+
+def write_files(sink: DumpSink) -> None:
+    for name, data in FILES.items():
+        sink.write(name, data)
+
+
+def test_dump_sink_is_abstract() -> None:
+    with pytest.raises(TypeError):
+        DumpSink()  # type: ignore
+
+
+def test_directory_sink(tmp_path: Any) -> None:
+    with DirectorySink(str(tmp_path / "out")) as sink:
+        write_files(sink)
+    for name, data in FILES.items():
+        assert (tmp_path / "out" / name).read_bytes() == data
+
+
+def test_zip_sink_round_trip(tmp_path: Any) -> None:
+    fp = str(tmp_path / "dump.zip")
+    with open_sink(fp) as sink:
+        assert isinstance(sink, ZipSink)
+        write_files(sink)
+    with zipfile.ZipFile(fp) as archive:
+        assert {name: archive.read(name) for name in archive.namelist()} == FILES
+
+
+@pytest.mark.parametrize("suffix", [".tar", ".tar.gz", ".tgz", ".tar.xz", ".tar.bz2"])
+def test_tar_sink_round_trip(tmp_path: Any, suffix: str) -> None:
+    fp = str(tmp_path / f"dump{suffix}")
+    with open_sink(fp) as sink:
+        assert isinstance(sink, TarSink)
+        write_files(sink)
+    with tarfile.open(fp) as archive:
+        files = {member.name: archive.extractfile(member).read() for member in archive}  # type: ignore
+    assert files == FILES
+
+
+@pytest.mark.parametrize("suffix", [".zip", ".tar"])
+def test_archive_rejects_duplicates(tmp_path: Any, suffix: str) -> None:
+    with open_sink(str(tmp_path / f"dump{suffix}")) as sink:
+        write_files(sink)
+        with pytest.raises(ValueError):
+            sink.write("db/a.json", b"{}")
+
+
+def test_tar_zst_requires_zstandard(tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sink_module, "zstandard", None)
+    fp = tmp_path / "dump.tar.zst"
+    with pytest.raises(ImportError):
+        open_sink(str(fp))
+    assert not os.path.exists(fp)
+
+
+def test_child_and_sink_for() -> None:
+    sink = MemorySink()
+    with sink_for(sink) as given:
+        assert given is sink
+        given.child("/db/").write("a.json", b"1")
+    assert sink.files == {"db/a.json": b"1"}
+
+
+def test_file_system_access() -> None:
+    sink = MemorySink()
+    filesystem = LuaFileSystem(sink, "export:", {"db_lua.bytes": b"lua"}, "assets:")
+    assert filesystem.access("assets:/db_lua.bytes") == "r"
+    assert filesystem.access("assets:\\missing") == "r"
+    assert filesystem.access("export:/db/a.json") == "w"
+    assert filesystem.access("C:/game/a.json") is None
+    assert filesystem.read("assets:/db_lua.bytes") == b"lua"
+    assert filesystem.read("assets:\\missing") is None
+    filesystem.write("export:\\db\\a.json", b"1")
+    assert sink.files == {"db/a.json": b"1"}
+    assert LuaFileSystem(None, "export:", None, "assets:").access("export:/a") is None
@@ -0,0 +1,28 @@
+import os
+from itertools import cycle
+
+import pytest
+
+from moc_utils.export.lua.dump import decrypt_textasset_data
+from moc_utils.export.lua.dump import encrypt_textasset_data
+from moc_utils.export.lua.dump import xor_textasset_data
+
+
+def decrypt_per_byte(enc: bytes) -> bytearray:
+    # the former implementation
+    dec_k = bytearray([23, 241, 195, 85, 120, 100, 57, 64, 66, 119, 89, 18, 51, 203, 123, 185, 53])
+    return bytearray([enc[0] ^ 53, *[e ^ k for e, k in zip(enc[1:], cycle(dec_k))]])
+
+
+@pytest.mark.parametrize("size", [1, 2, 17, 18, 1000, 1 << 16, (1 << 20) + 3])
+def test_matches_per_byte_implementation(size: int) -> None:
+    data = os.urandom(size)
+    assert xor_textasset_data(data) == decrypt_per_byte(data)
+    assert xor_textasset_data(memoryview(data)) == decrypt_per_byte(data)
+    assert xor_textasset_data(bytearray(data)) == decrypt_per_byte(data)
+
+
+def test_round_trip() -> None:
+    data = b"return { id = 1 }" * 100
+    assert encrypt_textasset_data(decrypt_textasset_data(data)) == data
+    assert xor_textasset_data(b"") == b""
@@ -0,0 +1,148 @@
+import hashlib
+import os
+from typing import Any
+from typing import Optional
+
+import pytest
+
+from moc_utils import transfer
+from moc_utils.asset_api import AssetAPIHandler
+
+VERSION_1 = bytes(range(256)) * 8
+VERSION_2 = bytes(reversed(range(256))) * 8
+
+
+class FakeResponse:
+    def __init__(self, data: bytes, status_code: int = 200, headers: Optional[dict[str, str]] = None) -> None:
+        self.data = data
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def __enter__(self) -> "FakeResponse":
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        pass
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise transfer.TransferError(f"status {self.status_code}")
+
+    def iter_content(self, chunk_size: int) -> Any:
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i : i + chunk_size]
+
+
+class FakeServer:
+    # serves a single file, honoring Range requests
+    def __init__(self, data: bytes, ranges: bool = True) -> None:
+        self.data = data
+        self.ranges = ranges
+        self.requests: list[dict[str, str]] = []
+
+    def get(self, _url: str, stream: bool = False, headers: Optional[dict[str, str]] = None) -> FakeResponse:
+        headers = headers or {}
+        self.requests.append(headers)
+        if "Range" in headers and self.ranges:
+            start = int(headers["Range"][len("bytes=") : -1])
+            if start >= len(self.data):
+                return FakeResponse(b"", 416)
+            return FakeResponse(
+                self.data[start:], 206, {"Content-Range": f"bytes {start}-{len(self.data) - 1}/{len(self.data)}"}
+            )
+        return FakeResponse(self.data)
+
+
+@pytest.fixture
+def server(monkeypatch: pytest.MonkeyPatch) -> FakeServer:
+    fake = FakeServer(VERSION_2)
+    monkeypatch.setattr(transfer.net, "get", fake.get)
+    return fake
+
+
+def test_stream_to_file(tmp_path: Any, server: FakeServer) -> None:
+    dst = str(tmp_path / "asset.unity3d")
+    md5 = hashlib.md5(VERSION_2).hexdigest()
+    assert transfer.stream_to_file("url", dst, len(VERSION_2), md5, chunk_size=100) == len(VERSION_2)
+    with open(dst, "rb") as f:
+        assert f.read() == VERSION_2
+    assert not os.path.exists(transfer.part_path(dst, md5))
+
+
+def test_resume(tmp_path: Any, server: FakeServer) -> None:
+    dst = str(tmp_path / "asset.unity3d")
+    with open(transfer.part_path(dst, "v2"), "wb") as f:
+        f.write(VERSION_2[:1000])
+    transfer.stream_to_file("url", dst, len(VERSION_2), "v2")
+    assert server.requests == [{"Range": "bytes=1000-"}]
+    with open(dst, "rb") as f:
+        assert f.read() == VERSION_2
+
+
+def test_stale_part_of_other_version(tmp_path: Any, server: FakeServer) -> None:
+    dst = str(tmp_path / "asset.unity3d")
+    with open(transfer.part_path(dst, "v1"), "wb") as f:
+        f.write(VERSION_1[:1000])
+    transfer.stream_to_file("url", dst, len(VERSION_2), "v2")
+    # the part of the old version isn't resumed
+    assert server.requests == [{}]
+    with open(dst, "rb") as f:
+        assert f.read() == VERSION_2
+
+
+def test_416_without_size_restarts(tmp_path: Any, server: FakeServer) -> None:
+    dst = str(tmp_path / "asset.unity3d")
+    # a part at least as long as the file, which the server rejects the range of
+    with open(transfer.part_path(dst, "v2"), "wb") as f:
+        f.write(VERSION_1 + b"tail")
+    assert transfer.stream_to_file("url", dst, None, "v2") == len(VERSION_2)
+    assert server.requests == [{"Range": f"bytes={len(VERSION_1) + 4}-"}, {}]
+    with open(dst, "rb") as f:
+        assert f.read() == VERSION_2
+
+
+def test_range_ignored(tmp_path: Any, server: FakeServer) -> None:
+    server.ranges = False
+    dst = str(tmp_path / "asset.unity3d")
+    with open(transfer.part_path(dst, "v2"), "wb") as f:
+        f.write(b"garbage")
+    transfer.stream_to_file("url", dst, len(VERSION_2), "v2")
+    with open(dst, "rb") as f:
+        assert f.read() == VERSION_2
+
+
+def test_size_mismatch(tmp_path: Any, server: FakeServer) -> None:
+    dst = str(tmp_path / "asset.unity3d")
+    with pytest.raises(transfer.TransferError):
+        transfer.stream_to_file("url", dst, len(VERSION_2) + 1, "v2")
+    assert not os.path.exists(dst)
+    assert not os.path.exists(transfer.part_path(dst, "v2"))
+
+
+def test_part_without_version_is_not_resumed(tmp_path: Any, server: FakeServer) -> None:
+    dst = str(tmp_path / "asset.unity3d")
+    with open(transfer.part_path(dst), "wb") as f:
+        f.write(VERSION_1[:1000])
+    transfer.stream_to_file("url", dst)
+    assert server.requests == [{}]
+    with open(dst, "rb") as f:
+        assert f.read() == VERSION_2
+
+
+def test_launcher_part_of_other_version(tmp_path: Any, server: FakeServer) -> None:
+    v1 = hashlib.md5(VERSION_1).hexdigest()
+    v2 = hashlib.md5(VERSION_2).hexdigest()
+    dst = str(tmp_path / "SoCLauncher_PC_us-prod.exe")
+    # left behind by an interrupted download of the previous launcher
+    for part in (transfer.part_path(dst, v1), transfer.part_path(dst)):
+        with open(part, "wb") as f:
+            f.write(VERSION_1[:1000])
+    handler = AssetAPIHandler(url_asset="https://cdn/", launcher_md5=v2)
+    assert handler.download_launcher_pc(dst) == len(VERSION_2)
+    assert server.requests == [{}]
+    with open(dst, "rb") as f:
+        assert f.read() == VERSION_2
+
+    # an explicit version takes precedence, and a full md5 is verified
+    with pytest.raises(transfer.TransferError):
+        handler.download_launcher_pc(str(tmp_path / "old.exe"), version=v1)
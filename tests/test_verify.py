@@ -0,0 +1,51 @@
+import concurrent.futures
+import hashlib
+import os
+from typing import Any
+
+from moc_utils.verify import verify_files
+
+
+def write(root: Any, name: str, data: bytes) -> None:
+    fp = os.path.join(root, name)
+    os.makedirs(os.path.dirname(fp), exist_ok=True)
+    with open(fp, "wb") as f:
+        f.write(data)
+
+
+def test_verify_files(tmp_path: Any) -> None:
+    write(tmp_path, "a/ok.unity3d", b"ok")
+    write(tmp_path, "a/bad_md5.unity3d", b"xx")
+    write(tmp_path, "a/bad_size.unity3d", b"x")
+    write(tmp_path, "a/short.unity3d", b"short")
+    write(tmp_path, "a/stray.unity3d", b"")
+    write(tmp_path, "a/x.unity3d.0123.part", b"")
+    write(tmp_path, "file_hash.txt", b"")
+    write(tmp_path, "notes.txt", b"")
+    expected = {
+        "a/ok.unity3d": (2, hashlib.md5(b"ok").hexdigest()),
+        "a/bad_md5.unity3d": (2, hashlib.md5(b"ok").hexdigest()),
+        "a/bad_size.unity3d": (2, None),
+        "a/short.unity3d": (5, "0" * 16),
+        "a/missing.unity3d": (1, None),
+    }
+    report = verify_files(str(tmp_path), expected, workers=1)
+    assert sorted(report.ok) == ["a/ok.unity3d", "a/short.unity3d"]
+    assert report.corrupt == ["a/bad_size.unity3d", "a/bad_md5.unity3d"]
+    assert report.missing == ["a/missing.unity3d"]
+    assert report.unverified_hashes == 1
+    assert sorted(report.orphaned) == [os.path.join("a", "stray.unity3d"), "notes.txt"]
+    assert report.leftovers == [os.path.join("a", "x.unity3d.0123.part")]
+    # files that the downloader didn't write are kept
+    assert sorted(report.prunable) == [os.path.join("a", "stray.unity3d"), os.path.join("a", "x.unity3d.0123.part")]
+
+
+def test_nothing_to_hash(tmp_path: Any, monkeypatch: Any) -> None:
+    write(tmp_path, "a/ok.unity3d", b"ok")
+
+    def no_pool(*_args: Any, **_kwargs: Any) -> None:
+        raise AssertionError("no process pool is needed")
+
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", no_pool)
+    report = verify_files(str(tmp_path), {"a/ok.unity3d": (2, "0" * 16)}, workers=1)
+    assert report.ok == ["a/ok.unity3d"]